@@ -13,22 +13,92 @@ DEFAULT_FILE_EXTENSION = ".txt"
 
 # Regex to find common Gutenberg SINGLE-LINE illustration/metadata markers
 SINGLE_LINE_BRACKET_REGEX = re.compile(
-    r"\[(?:Illustration|Copyright|Etext|Project Gutenberg|PG|etext)[^\]\n]*?\]" # Added \n to ensure it's single line
+    rb"\[(?:Illustration|Copyright|Etext|Project Gutenberg|PG|etext)[^\]\n]*?\]" # Added \n to ensure it's single line
 ) # Note: The general [^\]\n]+\] was removed as it's often too greedy. Add back if needed for specific cases.
 
 # Regex for chapter-like headings
+CHAPTER_HEADING_PATTERN = r"^(?:CHAPTER\s+[IVXLCDM\d]+(?:\]|\.)?|PREFACE\.?|CONTENTS\.?|LIST OF ILLUSTRATIONS\.?|EPILOGUE\.?|PROLOGUE\.?|[A-Z][A-Z\s]{3,}[A-Z]\.?)$"
 CHAPTER_HEADING_REGEX = re.compile(
-    r"^(?:CHAPTER\s+[IVXLCDM\d]+(?:\]|\.)?|PREFACE\.?|CONTENTS\.?|LIST OF ILLUSTRATIONS\.?|EPILOGUE\.?|PROLOGUE\.?|[A-Z][A-Z\s]{3,}[A-Z]\.?)$",
+    CHAPTER_HEADING_PATTERN.encode('ascii'),
     re.IGNORECASE # Ensure last char is also a letter for all-caps titles, or it's a known word like PREFACE
 )
+# Same pattern on text, for lines with non-ASCII bytes: there \s must also match NBSP and other Unicode spaces
+CHAPTER_HEADING_TEXT_REGEX = re.compile(CHAPTER_HEADING_PATTERN, re.IGNORECASE)
+
+# Cheap necessary conditions for CHAPTER_HEADING_REGEX (see could_be_chapter_heading):
+# a heading either starts with one of these keywords (any case) or is letters/whitespace only.
+CHAPTER_HEADING_KEYWORD_PREFIXES = (b"CHAPTER", b"PREFACE", b"CONTENTS", b"LIST OF", b"EPILOGUE", b"PROLOGUE")
+# ASCII bytes that can't appear in a generic all-letters heading: everything but letters and whitespace
+NON_TITLE_ASCII_BYTES = bytes(b for b in range(128) if not (chr(b).isalpha() or chr(b).isspace()))
 
 # Start and End markers for the actual content
-START_BOOK_MARKER_PREFIX = "*** START OF THE PROJECT GUTENBERG EBOOK"
-END_BOOK_MARKER_PREFIX = "*** END OF THE PROJECT GUTENBERG EBOOK"
+# (bytes: Gutenberg files are effectively ASCII/Latin-1, so the cleaner works on raw bytes
+# and only decodes once when writing the output file)
+START_BOOK_MARKER_PREFIX = b"*** START OF THE PROJECT GUTENBERG EBOOK"
+END_BOOK_MARKER_PREFIX = b"*** END OF THE PROJECT GUTENBERG EBOOK"
+# Both markers are rare, so one startswith(tuple) per line rejects ordinary lines in a single check
+BOOK_MARKER_PREFIXES = (START_BOOK_MARKER_PREFIX, END_BOOK_MARKER_PREFIX)
+
+IO_BUFFER_SIZE = 1 << 17 # 128 KiB
+
+# Per-line "could this be relevant" checks: `int in bytes` is a plain byte search, much cheaper than `b"[" in line`
+ASTERISK_BYTE = ord("*")
+OPEN_BRACKET_BYTE = ord("[")
+
+# Line breaks for str.splitlines() that bytes.splitlines() doesn't know (form feed, NEL, U+2028, ...); see normalize_input_bytes
+TEXT_ONLY_LINE_BREAKS = "\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+TEXT_ONLY_LINE_BREAK_REGEX = re.compile(f"[{TEXT_ONLY_LINE_BREAKS}]")
+
+def normalize_input_bytes(raw_content):
+    """Makes the raw file bytes split and strip like the decoded text would: invalid UTF-8 is dropped (as decoding
+    with errors='ignore' does) and text-only line breaks become \n. The result is valid UTF-8."""
+    try:
+        text_content = raw_content.decode('utf-8')
+    except UnicodeDecodeError:
+        text_content = raw_content.decode('utf-8', errors='ignore')
+        raw_content = None # Re-encoded below
+    # One substring scan per character is much faster than a regex search over the whole text; all are usually absent
+    if any(line_break in text_content for line_break in TEXT_ONLY_LINE_BREAKS):
+        text_content = TEXT_ONLY_LINE_BREAK_REGEX.sub("\n", text_content)
+        raw_content = None
+    return text_content.encode('utf-8') if raw_content is None else raw_content
+
+# First/last bytes of a bytes.strip()ped line that may still be whitespace to str.strip(): any non-ASCII byte
+# (NBSP, U+3000, ...) and \x1f
+TEXT_EDGE_BYTES = frozenset(range(0x80, 0x100)) | {0x1f}
+
+def needs_text_handling(line):
+    """True if line has bytes that the bytes methods and regexes treat differently from text (non-ASCII, or
+    \x1f, which str counts as whitespace)."""
+    return not line.isascii() or 0x1f in line
+
+def strip_line(line):
+    """bytes.strip() only removes ASCII whitespace; this also removes Unicode spaces (NBSP etc.), like str.strip()."""
+    stripped_line = line.strip()
+    if stripped_line and (stripped_line[0] in TEXT_EDGE_BYTES or stripped_line[-1] in TEXT_EDGE_BYTES):
+        return stripped_line.decode('utf-8').strip().encode('utf-8')
+    return stripped_line
 
 def is_actually_blank(line):
     """Checks if a line is truly blank or contains only whitespace."""
-    return not line.strip()
+    return not strip_line(line)
+
+def is_chapter_heading(line_cleaned):
+    """CHAPTER_HEADING_REGEX.match, on the decoded text where needed; only called once could_be_chapter_heading passed."""
+    if needs_text_handling(line_cleaned):
+        return CHAPTER_HEADING_TEXT_REGEX.match(line_cleaned.decode('utf-8')) is not None
+    return CHAPTER_HEADING_REGEX.match(line_cleaned) is not None
+
+def could_be_chapter_heading(line_cleaned):
+    """Fast pre-filter: False means the heading regexes cannot match, so they (and decoding) can be skipped."""
+    first_byte = line_cleaned[:1]
+    if first_byte.isascii() and not first_byte.isalpha(): # Every heading alternative starts with a letter
+        return False
+    if line_cleaned[:8].upper().startswith(CHAPTER_HEADING_KEYWORD_PREFIXES):
+        return True
+    # Generic all-letters title ([A-Z][A-Z\s]{3,}[A-Z]\.? with IGNORECASE); non-ASCII bytes are left to the text regex
+    body = line_cleaned[:-1] if line_cleaned.endswith(b".") else line_cleaned
+    return len(body.translate(None, NON_TITLE_ASCII_BYTES)) == len(body)
 
 def load_app_config(config_file_path=DEFAULT_CONFIG_FILE_PATH):
     if not os.path.exists(config_file_path):
@@ -45,18 +115,19 @@ def load_app_config(config_file_path=DEFAULT_CONFIG_FILE_PATH):
 def remove_multiline_illustration_blocks(lines):
     output_lines = []
     in_illustration_block = False
-    block_start_chars = ["[illustration", "[Illustration:"] # Make it a list
+    block_start_chars = (b"[illustration", b"[Illustration:") # Tuple so startswith() checks all prefixes at once
     
     for line in lines:
-        stripped_line = line.strip()
-        is_block_start = any(stripped_line.lower().startswith(start_char) for start_char in block_start_chars)
+        # Only needed inside a block or on a line that could start one (it must contain a '[')
+        stripped_line = strip_line(line) if in_illustration_block or OPEN_BRACKET_BYTE in line else b""
+        is_block_start = stripped_line.lower().startswith(block_start_chars)
 
         if in_illustration_block:
-            if stripped_line.endswith("]"):
+            if stripped_line.endswith(b"]"):
                 in_illustration_block = False
             # Continue to skip lines within the block
         elif is_block_start:
-            if not stripped_line.endswith("]"): # If it doesn't end on the same line
+            if not stripped_line.endswith(b"]"): # If it doesn't end on the same line
                 in_illustration_block = True
             # Else (it's a single line [Illustration...]), it's skipped this line
         else:
@@ -69,13 +140,17 @@ def clean_gutenberg_text(text_content):
     
     raw_book_lines = []
     for line in lines:
-        if line.strip().startswith(END_BOOK_MARKER_PREFIX):
-            in_book_content = False
-            break 
+        stripped_line = strip_line(line) if ASTERISK_BYTE in line else b"" # Both markers start with '***'
+        if stripped_line.startswith(BOOK_MARKER_PREFIXES):
+            if stripped_line.startswith(END_BOOK_MARKER_PREFIX):
+                in_book_content = False
+                break
+            if in_book_content: # A repeated START line is book content
+                raw_book_lines.append(line)
+            in_book_content = True # START marker
+            continue
         if in_book_content:
             raw_book_lines.append(line)
-        if line.strip().startswith(START_BOOK_MARKER_PREFIX):
-            in_book_content = True
     
     if not raw_book_lines:
         print("Warning: Could not find book content markers. Attempting to process whole file (may include headers/footers).")
@@ -91,33 +166,40 @@ def process_lines_for_paragraphs(lines_to_process):
     current_paragraph_lines = []
 
     for i, line_raw in enumerate(lines_to_process):
-        # 1. Clean line of any remaining single-line bracket markers
-        line_cleaned = SINGLE_LINE_BRACKET_REGEX.sub("", line_raw).strip()
+        stripped_raw = line_raw.strip() # Computed once; reused for the blank-line checks below
+        if stripped_raw and (stripped_raw[0] in TEXT_EDGE_BYTES or stripped_raw[-1] in TEXT_EDGE_BYTES):
+            stripped_raw = strip_line(stripped_raw) # Inlined test: most lines need no more than bytes.strip()
+
+        # 1. Clean line of any remaining single-line bracket markers (only possible if it has a '[')
+        if OPEN_BRACKET_BYTE in stripped_raw:
+            line_cleaned = strip_line(SINGLE_LINE_BRACKET_REGEX.sub(b"", stripped_raw))
+        else:
+            line_cleaned = stripped_raw
 
         # 2. Skip lines that became empty *only* due to marker removal
-        if not line_cleaned and line_raw.strip(): # Was not blank before, but is now
+        if not line_cleaned and stripped_raw: # Was not blank before, but is now
             continue
         
         # 3. Handle chapter headings
-        if CHAPTER_HEADING_REGEX.match(line_cleaned):
+        if could_be_chapter_heading(line_cleaned) and is_chapter_heading(line_cleaned):
             if current_paragraph_lines: # Finish previous paragraph
-                output_paragraphs.append(" ".join(current_paragraph_lines))
+                output_paragraphs.append(b" ".join(current_paragraph_lines))
                 current_paragraph_lines = []
-            output_paragraphs.append("") # Ensure blank line before heading
+            output_paragraphs.append(b"") # Ensure blank line before heading
             output_paragraphs.append(line_cleaned) # Add chapter heading
-            output_paragraphs.append("") # Ensure blank line after heading
+            output_paragraphs.append(b"") # Ensure blank line after heading
             continue
 
         # 4. Paragraph rejoining logic
-        if is_actually_blank(line_raw): # Use raw line to check for original blank lines
+        if not stripped_raw: # Use raw line to check for original blank lines (same test as is_actually_blank)
             # This line was intentionally blank (or only whitespace) in the source
             if current_paragraph_lines:
-                output_paragraphs.append(" ".join(current_paragraph_lines))
-                output_paragraphs.append("") # Add a blank line for paragraph separation
+                output_paragraphs.append(b" ".join(current_paragraph_lines))
+                output_paragraphs.append(b"") # Add a blank line for paragraph separation
                 current_paragraph_lines = []
             # If it's already a blank line and previous wasn't, ensure one blank line
-            elif output_paragraphs and output_paragraphs[-1] != "":
-                output_paragraphs.append("")
+            elif output_paragraphs and output_paragraphs[-1] != b"":
+                output_paragraphs.append(b"")
         elif line_cleaned: # Line has content after cleaning
             current_paragraph_lines.append(line_cleaned)
         # If line_cleaned is empty but line_raw was not (e.g. only contained spaces after regex),
@@ -127,7 +209,7 @@ def process_lines_for_paragraphs(lines_to_process):
 
     # Add any remaining paragraph
     if current_paragraph_lines:
-        output_paragraphs.append(" ".join(current_paragraph_lines))
+        output_paragraphs.append(b" ".join(current_paragraph_lines))
 
     # Filter out multiple consecutive blank lines that might have been introduced
     final_text_list = []
@@ -135,26 +217,26 @@ def process_lines_for_paragraphs(lines_to_process):
         final_text_list.append(output_paragraphs[0]) # Add first element
         for j in range(1, len(output_paragraphs)):
             # Add current element if it's not blank, OR if it is blank but previous wasn't
-            if output_paragraphs[j] != "" or (output_paragraphs[j] == "" and output_paragraphs[j-1] != ""):
+            if output_paragraphs[j] != b"" or (output_paragraphs[j] == b"" and output_paragraphs[j-1] != b""):
                 final_text_list.append(output_paragraphs[j])
     
     # Remove trailing blank line if any
-    if final_text_list and final_text_list[-1] == "":
+    if final_text_list and final_text_list[-1] == b"":
         final_text_list.pop()
 
-    return "\n".join(final_text_list)
+    return b"\n".join(final_text_list)
 
 
 def process_file(input_file_path, output_dir, file_name_override=None):
     print(f"Processing file: {input_file_path}")
     try:
-        with open(input_file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        with open(input_file_path, 'rb', buffering=IO_BUFFER_SIZE) as f:
             raw_content = f.read()
     except Exception as e:
         print(f"Error reading file {input_file_path}: {e}")
         return
 
-    cleaned_content = clean_gutenberg_text(raw_content)
+    cleaned_content = clean_gutenberg_text(normalize_input_bytes(raw_content))
 
     if not cleaned_content.strip():
         print(f"Warning: No substantial content processed for {input_file_path}. Output file may be empty or nearly empty.")
@@ -170,8 +252,9 @@ def process_file(input_file_path, output_dir, file_name_override=None):
 
     try:
         os.makedirs(output_dir, exist_ok=True)
-        with open(output_file_path, 'w', encoding='utf-8') as f:
-            f.write(cleaned_content)
+        # cleaned_content is valid UTF-8 (see normalize_input_bytes); decoded once here for the text-mode write
+        with open(output_file_path, 'w', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f:
+            f.write(cleaned_content.decode('utf-8'))
         print(f"Cleaned file saved to: {output_file_path}")
     except Exception as e:
         print(f"Error writing file {output_file_path}: {e}")
@@ -183,11 +266,12 @@ def process_directory(input_dir, output_dir, extension_to_process):
     
     print(f"Processing all '{extension_to_process}' files in directory: {input_dir}")
     found_files = False
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith(extension_to_process.lower()):
-            found_files = True
-            file_path = os.path.join(input_dir, filename)
-            process_file(file_path, output_dir)
+    extension_lower = extension_to_process.lower()
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(extension_lower) and entry.is_file():
+                found_files = True
+                process_file(entry.path, output_dir)
     if not found_files:
         print(f"No files with extension '{extension_to_process}' found in '{input_dir}'.")
 
@@ -1,22 +1,36 @@
+# This module is fully annotated so it can be compiled ahead of time with mypyc:
+#   pip install mypy && python -m mypyc llm_output_validator.py
+# The resulting extension module (.so/.pyd) shadows this file on import; without it the
+# pure-Python version is used unchanged.
 import re
-from typing import List, Tuple, Optional, Set # Added Set for type hinting
+from typing import Final, List, Tuple, Optional, Set # Added Set for type hinting
 
 # --- Regex Constants ---
-RE_S_SEGMENT_LINE = re.compile(r"^(S\d+)\((.*)\)$")
-RE_PHRASE_ALIGN_LINE = re.compile(r"^(S\d+)\s*~\s*(.*?)\s*~\s*(.*)$")
-RE_S_LEMMA_LINE = re.compile(r"^(S\d+)\s*::\s*(.*)$") # For SimSL and DIGLOT_MAP segment headers
-RE_DIGLOT_ENTRY = re.compile(r"^(.*?)->(.*?)\((.*?)\)\s*\(([A-Za-z])\)$")
-RE_S_ID_FORMAT = re.compile(r"^S\d+$") # To check S-ID format in LOCKED_PHRASE
+RE_S_SEGMENT_LINE: Final = re.compile(r"^(S\d+)\((.*)\)$")
+RE_PHRASE_ALIGN_LINE: Final = re.compile(r"^(S\d+)\s*~\s*(.*?)\s*~\s*(.*)$")
+RE_S_LEMMA_LINE: Final = re.compile(r"^(S\d+)\s*::\s*(.*)$") # For SimSL and DIGLOT_MAP segment headers
+RE_DIGLOT_ENTRY: Final = re.compile(r"^(.*?)->(.*?)\((.*?)\)\s*\(([A-Za-z])\)$") # Reference shape; see parse_diglot_entry
+RE_S_ID_FORMAT: Final = re.compile(r"^S\d+$") # To check S-ID format in LOCKED_PHRASE
 
 # --- Section Marker Constants ---
 # These are the sections expected for a standard LLM-processed sentence block
-REQUIRED_SECTION_MARKERS = [
+REQUIRED_SECTION_MARKERS: Final[List[str]] = [
     "AdvS::", "SimS::", "SimE::",
     "SimS_Segments::", "PHRASE_ALIGN::", "SimSL::",
     "AdvSL::", "DIGLOT_MAP::"
 ]
-OPTIONAL_SECTION_MARKERS = ["LOCKED_PHRASE::"]
-ALL_POSSIBLE_MARKERS = REQUIRED_SECTION_MARKERS + OPTIONAL_SECTION_MARKERS
+OPTIONAL_SECTION_MARKERS: Final[List[str]] = ["LOCKED_PHRASE::"]
+ALL_POSSIBLE_MARKERS: Final[List[str]] = REQUIRED_SECTION_MARKERS + OPTIONAL_SECTION_MARKERS
+NUM_REQUIRED_MARKERS: Final = len(REQUIRED_SECTION_MARKERS)
+NUM_MARKERS: Final = len(ALL_POSSIBLE_MARKERS)
+MARKER_SLOT: Final[dict[str, int]] = {marker: slot for slot, marker in enumerate(ALL_POSSIBLE_MARKERS)}
+
+# One alternation over every marker, anchored at line starts. Run over the stripped lines joined
+# by "\n", it finds all marker lines in a single C-level scan.
+RE_MARKER_SCAN: Final = re.compile(
+    "^(?:" + "|".join(re.escape(marker) for marker in ALL_POSSIBLE_MARKERS) + ")",
+    re.MULTILINE
+)
 
 
 def get_section_content(
@@ -31,9 +45,10 @@ def get_section_content(
     Content lines are individual lines of content, already stripped.
     If marker has content on the same line, that's the first content line.
     """
+    stripped_block_lines = [line.strip() for line in original_block_lines]
     start_line_idx = -1
-    for i, line in enumerate(original_block_lines):
-        if line.strip().startswith(start_marker):
+    for i, line in enumerate(stripped_block_lines):
+        if line.startswith(start_marker):
             start_line_idx = i
             break
     if start_line_idx == -1:
@@ -42,7 +57,7 @@ def get_section_content(
     # Find where the next section starts to define the end of the current section
     end_line_idx_for_content = len(original_block_lines) # Default to end of block
     for i in range(start_line_idx + 1, len(original_block_lines)):
-        line_stripped_for_next_marker_check = original_block_lines[i].strip()
+        line_stripped_for_next_marker_check = stripped_block_lines[i]
         for marker_to_check_next in all_known_markers:
             if line_stripped_for_next_marker_check.startswith(marker_to_check_next):
                 end_line_idx_for_content = i
@@ -50,21 +65,76 @@ def get_section_content(
         if end_line_idx_for_content != len(original_block_lines): # Found next marker
             break
     
-    section_content_lines = []
+    return collect_section_lines(stripped_block_lines, start_marker, start_line_idx, end_line_idx_for_content), start_line_idx
+
+
+def collect_section_lines(
+    stripped_block_lines: List[str],
+    start_marker: str,
+    start_line_idx: int,
+    end_line_idx: int
+) -> List[str]:
+    """
+    Returns the non-empty content lines of the section whose marker is on start_line_idx and which
+    runs up to (not including) end_line_idx. Content after the marker on its own line comes first.
+    """
+    section_content_lines: List[str] = []
     # Check for content on the same line as the marker
-    marker_line_itself_stripped = original_block_lines[start_line_idx].strip()
+    marker_line_itself_stripped = stripped_block_lines[start_line_idx]
     if len(marker_line_itself_stripped) > len(start_marker): # Content exists after marker on same line
         content_on_marker_line = marker_line_itself_stripped[len(start_marker):].strip()
         if content_on_marker_line: # Add if not just whitespace
             section_content_lines.append(content_on_marker_line)
     
     # Add subsequent lines that belong to this section
-    for i in range(start_line_idx + 1, end_line_idx_for_content):
-        line_content = original_block_lines[i].strip()
+    for i in range(start_line_idx + 1, end_line_idx):
+        line_content = stripped_block_lines[i]
         if line_content: # Add non-empty stripped lines
             section_content_lines.append(line_content)
             
-    return section_content_lines, start_line_idx
+    return section_content_lines
+
+
+def scan_section_markers(stripped_block_lines: List[str]) -> List[Tuple[int, int]]:
+    """
+    Finds every line that starts with a known section marker, using RE_MARKER_SCAN over the joined
+    stripped lines. Returns (line index, marker slot) pairs in line order.
+    """
+    joined_lines = "\n".join(stripped_block_lines) # Stripped lines never contain line separators
+    found: List[Tuple[int, int]] = []
+    line_idx = 0
+    last_pos = 0
+    for match in RE_MARKER_SCAN.finditer(joined_lines):
+        match_pos = match.start()
+        line_idx += joined_lines.count("\n", last_pos, match_pos)
+        last_pos = match_pos
+        found.append((line_idx, MARKER_SLOT[match.group()]))
+    return found
+
+
+def parse_diglot_entry(entry: str) -> Optional[Tuple[str, str, str, str]]:
+    """
+    Splits a single DIGLOT_MAP entry 'EngWord->SpaLemma(ExactSpaForm)(V)' into its four parts.
+    Hand-written equivalent of RE_DIGLOT_ENTRY.match(entry).groups() using str.find/rfind,
+    returning the same groups (or None where the regex would not match).
+    """
+    # Trailing '(V)' where V is a single ASCII letter
+    if len(entry) < 3 or entry[-1] != ')' or entry[-3] != '(':
+        return None
+    viability_char = entry[-2]
+    if not ('A' <= viability_char <= 'Z' or 'a' <= viability_char <= 'z'):
+        return None
+    head = entry[:-3]
+    arrow = head.find('->')
+    if arrow == -1:
+        return None
+    rest = head[arrow + 2:].rstrip() # The regex allows whitespace between ')' and '(V)'
+    if not rest.endswith(')'):
+        return None
+    form_open = rest.find('(')
+    if form_open == -1:
+        return None
+    return head[:arrow], rest[:form_open], rest[form_open + 1:-1], viability_char
 
 
 def validate_llm_block(block_text: str) -> List[str]:
@@ -74,8 +144,9 @@ def validate_llm_block(block_text: str) -> List[str]:
     Assumes block_text is the core output from LLM, before script appends final END_SENTENCE.
     """
     errors: List[str] = []
-    original_lines = block_text.splitlines() # Keep original lines for accurate indexing by get_section_content
-    stripped_lines_for_initial_checks = [line.strip() for line in original_lines if line.strip()]
+    original_lines = block_text.splitlines() # Line indices in messages refer to these lines
+    stripped_lines = [line.strip() for line in original_lines] # Stripped once, shared by every check below
+    stripped_lines_for_initial_checks = [line for line in stripped_lines if line]
 
     if not stripped_lines_for_initial_checks:
         errors.append("Block is empty or contains only whitespace.")
@@ -85,50 +156,50 @@ def validate_llm_block(block_text: str) -> List[str]:
     if any("END_SENTENCE" in line for line in stripped_lines_for_initial_checks):
         errors.append("Block contains premature END_SENTENCE marker(s).")
 
-    marker_indices: dict[str, int] = {} # Stores line index of found markers
-    
-    for marker in REQUIRED_SECTION_MARKERS:
-        found_marker_at_index = -1
-        for i, line_text in enumerate(original_lines):
-            if line_text.strip().startswith(marker):
-                if marker in marker_indices:
-                    errors.append(f"Duplicate required section marker: {marker} (first at line {marker_indices[marker]+1}, new at {i+1}).")
-                else: # Store first occurrence only for order checks
-                    marker_indices[marker] = i
-                found_marker_at_index = i # Mark as found for this specific marker
-                # break # Don't break, to catch duplicates properly for *this* marker if any on later lines.
-                # Correction: only one instance of each marker is expected. If found, store and assume it's the one.
-                # The duplicate check handles if it appears again.
-        if marker not in marker_indices : # If after checking all lines, marker was not added
-            errors.append(f"Missing required section marker: {marker}")
-            
-    for marker in OPTIONAL_SECTION_MARKERS:
-        for i, line_text in enumerate(original_lines):
-            if line_text.strip().startswith(marker):
-                if marker in marker_indices: # Check against all markers already found
-                    errors.append(f"Duplicate optional section marker: {marker} (first at line {marker_indices[marker]+1}, new at {i+1}).")
-                else:
-                    marker_indices[marker] = i
-                # break # Optional markers can appear once.
+    # Line index of the first occurrence of each marker, by slot in ALL_POSSIBLE_MARKERS (-1 = not found).
+    # The marker set is small and closed, so plain lists indexed by slot replace per-marker dict lookups.
+    marker_line_idx: List[int] = [-1] * NUM_MARKERS
+
+    # Single regex scan over the block: every line index at which each marker starts.
+    found_markers = scan_section_markers(stripped_lines)
+    marker_occurrences: List[List[int]] = [[] for _ in range(NUM_MARKERS)]
+    for line_idx, slot in found_markers:
+        marker_occurrences[slot].append(line_idx)
+
+    for slot in range(NUM_MARKERS):
+        marker = ALL_POSSIBLE_MARKERS[slot]
+        occurrences = marker_occurrences[slot]
+        is_required = slot < NUM_REQUIRED_MARKERS
+        if not occurrences:
+            if is_required:
+                errors.append(f"Missing required section marker: {marker}")
+            continue
+        marker_line_idx[slot] = occurrences[0] # First occurrence is used for order checks
+        kind = "required" if is_required else "optional"
+        for dup_idx in occurrences[1:]:
+            errors.append(f"Duplicate {kind} section marker: {marker} (first at line {occurrences[0]+1}, new at {dup_idx+1}).")
 
     if errors: return errors # Stop if fundamental markers are missing/duplicated
 
-    # Check order of REQUIRED markers
-    last_idx = -1
-    for i, marker_in_order in enumerate(REQUIRED_SECTION_MARKERS):
-        current_marker_actual_idx = marker_indices[marker_in_order] # Assumes all required markers are now in marker_indices
-        if current_marker_actual_idx < last_idx:
-            errors.append(f"Section {marker_in_order} (at line {current_marker_actual_idx+1}) appears out of expected order relative to {REQUIRED_SECTION_MARKERS[i-1]}.")
-        last_idx = current_marker_actual_idx
+    # Check order of REQUIRED markers (slots 0..NUM_REQUIRED_MARKERS-1 are in expected order)
+    for slot in range(1, NUM_REQUIRED_MARKERS):
+        if marker_line_idx[slot] < marker_line_idx[slot - 1]:
+            errors.append(f"Section {REQUIRED_SECTION_MARKERS[slot]} (at line {marker_line_idx[slot]+1}) appears out of expected order relative to {REQUIRED_SECTION_MARKERS[slot-1]}.")
     
     if errors: return errors
 
+    # Each marker now occurs exactly once, so a section runs from its marker line to the next marker line.
+    section_contents: List[Optional[List[str]]] = [None] * NUM_MARKERS
+    for k, (line_idx, slot) in enumerate(found_markers):
+        end_idx = found_markers[k + 1][0] if k + 1 < len(found_markers) else len(stripped_lines)
+        section_contents[slot] = collect_section_lines(stripped_lines, ALL_POSSIBLE_MARKERS[slot], line_idx, end_idx)
+
     # --- Section-specific validations ---
     s_segment_ids_ordered: List[str] = []
     s_segment_ids_set: Set[str] = set()
 
     # II. SimS_Segments::
-    content_lines, _ = get_section_content(original_lines, "SimS_Segments::", ALL_POSSIBLE_MARKERS)
+    content_lines = section_contents[MARKER_SLOT["SimS_Segments::"]]
     if content_lines is None: errors.append("SimS_Segments:: marker found but content extraction failed (internal helper error).")
     elif not content_lines: errors.append("SimS_Segments:: section is present but has no segment definition lines.")
     else:
@@ -147,7 +218,7 @@ def validate_llm_block(block_text: str) -> List[str]:
             errors.append(f"SimS_Segments:: IDs not sequential. Found: {s_segment_ids_ordered}, Expected: {expected_s_ids}")
 
     # III. PHRASE_ALIGN::
-    content_lines, _ = get_section_content(original_lines, "PHRASE_ALIGN::", ALL_POSSIBLE_MARKERS)
+    content_lines = section_contents[MARKER_SLOT["PHRASE_ALIGN::"]]
     if content_lines is None: errors.append("PHRASE_ALIGN:: marker found but content extraction failed.")
     elif not content_lines and s_segment_ids_set: errors.append("PHRASE_ALIGN:: section empty but SimS_Segments exist.")
     elif content_lines:
@@ -164,13 +235,13 @@ def validate_llm_block(block_text: str) -> List[str]:
             if not span2.strip(): errors.append(f"PHRASE_ALIGN:: Line {i+1} (ID {s_id}) has empty second span.")
 
     # IV. SimSL::
-    content_lines, _ = get_section_content(original_lines, "SimSL::", ALL_POSSIBLE_MARKERS)
+    content_lines = section_contents[MARKER_SLOT["SimSL::"]]
     if content_lines is None: errors.append("SimSL:: marker found but content extraction failed.")
     elif not content_lines and s_segment_ids_set: errors.append("SimSL:: section empty but SimS_Segments exist.")
     elif content_lines:
         if len(content_lines) != len(s_segment_ids_set):
             errors.append(f"SimSL:: Line count ({len(content_lines)}) differs from SimS_Segments count ({len(s_segment_ids_set)}).")
-        found_s_ids_in_simsl = set()
+        found_s_ids_in_simsl: Set[str] = set()
         for i, line in enumerate(content_lines):
             match = RE_S_LEMMA_LINE.match(line)
             if not match:
@@ -186,20 +257,20 @@ def validate_llm_block(block_text: str) -> List[str]:
 
 
     # V. AdvSL::
-    content_lines, _ = get_section_content(original_lines, "AdvSL::", ALL_POSSIBLE_MARKERS)
+    content_lines = section_contents[MARKER_SLOT["AdvSL::"]]
     if content_lines is None: errors.append("AdvSL:: marker found but content extraction failed.")
     # AdvSL can be empty, e.g. "AdvSL::" or "AdvSL:: \n"
     elif len(content_lines) > 1: errors.append("AdvSL:: section has multiple content lines; expected one logical line of lemmas.")
     # No specific content validation for lemmas themselves here, just structure.
 
 # VI. DIGLOT_MAP::
-    content_lines, _ = get_section_content(original_lines, "DIGLOT_MAP::", ALL_POSSIBLE_MARKERS)
+    content_lines = section_contents[MARKER_SLOT["DIGLOT_MAP::"]]
     if content_lines is None: 
         errors.append("DIGLOT_MAP:: marker found but content extraction failed.")
     elif not content_lines and s_segment_ids_set: # Check if s_segment_ids_set is non-empty
         errors.append("DIGLOT_MAP:: section empty but SimS_Segments exist (expected S-ID lines for DIGLOT_MAP).")
     elif content_lines: # Only proceed if there are lines to parse for DIGLOT_MAP
-        found_s_ids_in_diglot = set()
+        found_s_ids_in_diglot: Set[str] = set()
         for i, line in enumerate(content_lines):
             match_outer = RE_S_LEMMA_LINE.match(line) # Expects S<n> :: entries
             if not match_outer:
@@ -226,11 +297,11 @@ def validate_llm_block(block_text: str) -> List[str]:
                              errors.append(f"DIGLOT_MAP:: S-ID {s_id}, found empty entry part (likely due to '||' or trailing/leading '|'). Full entry string: '{entries_str}'")
                         continue # Skip further processing for this genuinely empty part
 
-                    match_entry = RE_DIGLOT_ENTRY.match(entry_part_stripped)
-                    if not match_entry:
+                    parsed_entry = parse_diglot_entry(entry_part_stripped)
+                    if parsed_entry is None:
                         errors.append(f"DIGLOT_MAP:: S-ID {s_id}, entry '{entry_part_stripped[:30]}...' malformed (failed basic regex).")
                     else:
-                        eng, spa_lemma, form, viability_char = match_entry.groups()
+                        eng, spa_lemma, form, viability_char = parsed_entry
                         if not eng.strip(): # Check if eng is not just whitespace
                             errors.append(f"DIGLOT_MAP:: S-ID {s_id}, entry '{entry_part_stripped[:30]}...' has empty EngWord.")
                         if not spa_lemma.strip():
@@ -247,8 +318,8 @@ def validate_llm_block(block_text: str) -> List[str]:
 
 
     # VII. LOCKED_PHRASE:: (Optional)
-    if "LOCKED_PHRASE::" in marker_indices: # Only validate if marker was found
-        content_lines, _ = get_section_content(original_lines, "LOCKED_PHRASE::", ALL_POSSIBLE_MARKERS)
+    if marker_line_idx[MARKER_SLOT["LOCKED_PHRASE::"]] != -1: # Only validate if marker was found
+        content_lines = section_contents[MARKER_SLOT["LOCKED_PHRASE::"]]
         if content_lines is None: errors.append("LOCKED_PHRASE:: marker found but content extraction failed.")
         elif len(content_lines) > 1: errors.append("LOCKED_PHRASE:: section has multiple content lines; expected one.")
         elif content_lines and content_lines[0].strip(): # If content exists and is not just whitespace
@@ -257,4 +328,53 @@ def validate_llm_block(block_text: str) -> List[str]:
                 if not RE_S_ID_FORMAT.match(s_id_locked): errors.append(f"LOCKED_PHRASE:: Contains non-S<n> formatted ID: '{s_id_locked}'")
                 elif s_id_locked not in s_segment_ids_set: errors.append(f"LOCKED_PHRASE:: Uses unknown segment ID: {s_id_locked}")
     
-    return errors
\ No newline at end of file
+    return errors
+
+def streamed_block_error(partial_block_text: str) -> Optional[str]:
+    """
+    Early check on a block that is still arriving. Looks only at the complete lines received so far and
+    returns the error, worded as validate_llm_block words it, once they already guarantee one: a premature
+    END_SENTENCE, a duplicated marker, or a required marker ahead of the one that must come before it.
+    Returns None while the block can still pass.
+    """
+    complete_text = partial_block_text[:partial_block_text.rfind("\n") + 1]
+    stripped_lines = [line.strip() for line in complete_text.splitlines()]
+    if any("END_SENTENCE" in line for line in stripped_lines):
+        return "Block contains premature END_SENTENCE marker(s)."
+    first_line_idx: List[int] = [-1] * NUM_MARKERS
+    for line_idx, slot in scan_section_markers(stripped_lines):
+        if first_line_idx[slot] != -1:
+            kind = "required" if slot < NUM_REQUIRED_MARKERS else "optional"
+            return f"Duplicate {kind} section marker: {ALL_POSSIBLE_MARKERS[slot]} (first at line {first_line_idx[slot]+1}, new at {line_idx+1})."
+        if 0 < slot < NUM_REQUIRED_MARKERS and first_line_idx[slot - 1] == -1:
+            return f"Section {REQUIRED_SECTION_MARKERS[slot]} (at line {line_idx+1}) appears out of expected order relative to {REQUIRED_SECTION_MARKERS[slot-1]}."
+        first_line_idx[slot] = line_idx
+    return None
+
+def streamed_block_cannot_pass(partial_block_text: str) -> bool:
+    """True once streamed_block_error finds an error in a block that is still arriving."""
+    return streamed_block_error(partial_block_text) is not None
+
+def validate_llm_batch_block(batch_text: str, expected_blocks: int) -> Tuple[List[str], List[List[str]]]:
+    """
+    Splits a multi-sentence LLM response on lines that are exactly END_SENTENCE and validates each
+    part with validate_llm_block. Returns (blocks, errors_per_block), both of length expected_blocks.
+    If the response holds a different number of blocks, no block can be trusted to belong to its
+    sentence, so every index gets an error.
+    """
+    blocks: List[str] = []
+    current_lines: List[str] = []
+    for line in batch_text.splitlines():
+        if line.strip() == "END_SENTENCE":
+            blocks.append("\n".join(current_lines).strip())
+            current_lines = []
+        else:
+            current_lines.append(line)
+    trailing_block = "\n".join(current_lines).strip()
+    if trailing_block: # The last block may or may not be followed by END_SENTENCE
+        blocks.append(trailing_block)
+
+    if len(blocks) != expected_blocks:
+        count_error = f"Batch output has {len(blocks)} blocks; expected {expected_blocks}."
+        return [""] * expected_blocks, [[count_error] for _ in range(expected_blocks)]
+    return blocks, [validate_llm_block(block) for block in blocks]
@@ -1,190 +1,319 @@
 # Filename: llm_prompts.py
 # Purpose: To load and format prompts for the multi-call LLM processing pipeline.
+# This module is fully annotated so it can be compiled ahead of time with mypyc:
+#   pip install mypy && python -m mypyc llm_prompts.py
+# The resulting extension module (.so/.pyd) shadows this file on import; without it the
+# pure-Python version is used unchanged. PROMPT_DIR is deliberately not Final so it can still be overridden.
 
 import os
+import hashlib
+import logging
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-import sys
+from typing import Final, List, Dict, Any, Optional, Tuple, Callable, Union
+
+logger = logging.getLogger(__name__)
 
 # --- Prompt Filenames (relative to the directory of this script or a configured prompt dir) ---
-PROMPT_DIR = Path(__file__).parent / "llm_prompt_templates" 
+PROMPT_DIR: Path = Path(__file__).parent / "llm_prompt_templates"
+
+PROMPT_CALL1_FILENAME: Final = "prompt_call1_advs_advsl_batch.txt"
+PROMPT_CALL2_FILENAME: Final = "prompt_call2_simsL2_L2simsl_batch.txt"
+PROMPT_CALL3_FILENAME: Final = "prompt_call3_advs_segments_lemmas_batch.txt"
+PROMPT_CALL4_FILENAME: Final = "prompt_call4_simpler_advs_segments_lemmas_batch.txt"
+PROMPT_CALL5_FILENAME: Final = "prompt_call5_simsL3_align_lemmas_batch.txt"
+PROMPT_CALL6_FILENAME: Final = "prompt_call6_diglotmap_batch.txt"
+
+# --- Input placeholders (each appears exactly once in its template) ---
+PROMPT_CALL1_PLACEHOLDER: Final = "{batched_input_sentences_with_ids_and_delimited_text}"
+PROMPT_CALL2_PLACEHOLDER: Final = PROMPT_CALL1_PLACEHOLDER # Call 2 shares the Call 1 input layout
+PROMPT_CALL3_PLACEHOLDER: Final = "{batched_input_advs_sentences_with_ids_and_eng_context}"
+PROMPT_CALL4_PLACEHOLDER: Final = "{batched_input_for_call4}"
+PROMPT_CALL5_PLACEHOLDER: Final = "{batched_input_eng_sentences_with_ids}"
+PROMPT_CALL6_PLACEHOLDER: Final = "{batched_input_for_call6}"
+
+PROMPT_PLACEHOLDERS: Final[Dict[str, str]] = {
+    PROMPT_CALL1_FILENAME: PROMPT_CALL1_PLACEHOLDER,
+    PROMPT_CALL2_FILENAME: PROMPT_CALL2_PLACEHOLDER,
+    PROMPT_CALL3_FILENAME: PROMPT_CALL3_PLACEHOLDER,
+    PROMPT_CALL4_FILENAME: PROMPT_CALL4_PLACEHOLDER,
+    PROMPT_CALL5_FILENAME: PROMPT_CALL5_PLACEHOLDER,
+    PROMPT_CALL6_FILENAME: PROMPT_CALL6_PLACEHOLDER,
+}
+
+# Keys every Call 6 phrase-alignment record must carry
+_REQ_KEYS: Final = frozenset(('id', 'sims_l3_segment_text', 'eng_span_text'))
+# Sort key for L3 lemma entries whose id is not S<digits>
+_UNNUMBERED_SEGMENT_SORT_KEY: Final = float('inf')
 
-PROMPT_CALL1_FILENAME = "prompt_call1_advs_advsl_batch.txt"
-PROMPT_CALL2_FILENAME = "prompt_call2_simsL2_L2simsl_batch.txt"
-PROMPT_CALL3_FILENAME = "prompt_call3_advs_segments_lemmas_batch.txt"
-PROMPT_CALL4_FILENAME = "prompt_call4_simpler_advs_segments_lemmas_batch.txt"
-PROMPT_CALL5_FILENAME = "prompt_call5_simsL3_align_lemmas_batch.txt"
-PROMPT_CALL6_FILENAME = "prompt_call6_diglotmap_batch.txt"
+# --- Fixed tokens of the batched input lines (joined by plain concatenation in the builders) ---
+_INPUT_HEADER_OPEN: Final = "--- INPUT (ID: "
+_INPUT_HEADER_CLOSE: Final = ") ---"
+_TEXT_OPEN: Final = "TEXT: {{"
+_ENG_TEXT_OPEN: Final = "ENG_TEXT: {{"
+_ORIGINAL_ENGLISH_TEXT_OPEN: Final = "ORIGINAL_ENGLISH_TEXT: {{"
+_ORIGINAL_ADVS_TEXT_OPEN: Final = "ORIGINAL_AdvS_TEXT: {{"
+_ADVS_TEXT_TO_SEGMENT_OPEN: Final = "AdvS_TEXT_TO_SEGMENT: {{"
+_SEGMENT_TEXT_OPEN: Final = "::{{"
+_SEGMENT_LEMMAS_SEP: Final = "::"
+_ALIGN_SIMS_OPEN: Final = " ~ {{"
+_ALIGN_ENG_OPEN: Final = "}} ~ {{"
+_DELIM_CLOSE: Final = "}}"
+
+# (label opener, sentence key) pairs for the calls whose input is just an id header plus delimited text fields
+_CALL1_FIELDS: Final = ((_TEXT_OPEN, 'eng_text'),)
+_CALL3_FIELDS: Final = ((_ORIGINAL_ENGLISH_TEXT_OPEN, 'eng_text'), (_ADVS_TEXT_TO_SEGMENT_OPEN, 'advs_text'))
+_CALL5_FIELDS: Final = ((_ENG_TEXT_OPEN, 'eng_text'),)
+
+@lru_cache(maxsize=16)
+def _read_prompt_template_file(file_path_str: str) -> str:
+    """Reads a template file once per path; later calls return the cached text. Errors propagate (and are not cached)."""
+    text = Path(file_path_str).read_bytes().decode('utf-8') # One-shot read; no TextIOWrapper layer
+    if '\r' in text: # Keep text-mode universal-newline behaviour for templates saved with CRLF
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
 
 def load_prompt_template(filename: str) -> Optional[str]:
-    """Loads a prompt template from the specified file in the PROMPT_DIR."""
+    """Loads a prompt template from the specified file in the PROMPT_DIR (cached after the first successful read)."""
     file_path = PROMPT_DIR / filename
-    if not file_path.exists():
+    try:
+        return _read_prompt_template_file(str(file_path))
+    except FileNotFoundError:
         print(f"ERROR: Prompt template file not found: {file_path}")
         return None
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
     except Exception as e:
         print(f"ERROR: Could not read prompt template file {file_path}: {e}")
         return None
 
+# Keyed by the template's full path, so reassigning PROMPT_DIR picks up the other directory's templates
+_SPLIT_TEMPLATE_CACHE: Final[Dict[Tuple[str, str], Tuple[str, str]]] = {}
+
+def load_and_split_template(filename: str, placeholder: str) -> Optional[Tuple[str, str]]:
+    """Loads a template and splits it once around its placeholder into (prefix, suffix). Successful splits are cached."""
+    cache_key = (str(PROMPT_DIR / filename), placeholder)
+    parts = _SPLIT_TEMPLATE_CACHE.get(cache_key)
+    if parts is not None:
+        return parts
+    template = load_prompt_template(filename)
+    if template is None:
+        return None
+    if placeholder not in template:
+        print(f"ERROR: Placeholder {placeholder} not found in prompt template {filename}")
+        return None
+    prefix, suffix = template.split(placeholder, 1)
+    parts = (prefix, suffix)
+    _SPLIT_TEMPLATE_CACHE[cache_key] = parts
+    return parts
+
+# (prefix, suffix) for every registered prompt file, keyed by its full path under PROMPT_DIR; the default
+# directory's are filled at import so formatting never touches the template text
+TEMPLATES: Final[Dict[str, Tuple[str, str]]] = {}
+
+def _ensure_loaded() -> None:
+    """Splits each registered template in PROMPT_DIR not yet in TEMPLATES. Missing files are reported and retried on the next call."""
+    for filename, placeholder in PROMPT_PLACEHOLDERS.items():
+        template_path = str(PROMPT_DIR / filename)
+        if template_path not in TEMPLATES:
+            parts = load_and_split_template(filename, placeholder)
+            if parts is not None:
+                TEMPLATES[template_path] = parts
+
+def get_template_parts(filename: str) -> Optional[Tuple[str, str]]:
+    """Returns the pre-split (prefix, suffix) for a registered prompt file in PROMPT_DIR, to pass to the matching formatter."""
+    template_path = str(PROMPT_DIR / filename)
+    parts = TEMPLATES.get(template_path)
+    if parts is None:
+        _ensure_loaded()
+        parts = TEMPLATES.get(template_path)
+    return parts
+
+_ensure_loaded()
+
+# --- Prompt-cache prefixes ---
+# Everything before the placeholder is identical for every batch of a given call, so it is the part a
+# provider-side prompt cache can reuse (e.g. the block marked with Anthropic's cache_control).
+
+def get_cached_prefix(filename: str) -> Optional[str]:
+    """Returns the static template text before the batch input for a known prompt file, or None."""
+    placeholder = PROMPT_PLACEHOLDERS.get(filename)
+    if placeholder is None:
+        print(f"ERROR: No input placeholder registered for prompt template {filename}")
+        return None
+    parts = load_and_split_template(filename, placeholder)
+    return parts[0] if parts else None
+
+@lru_cache(maxsize=16)
+def _sha256_hex(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def get_cached_prefix_hash(filename: str) -> Optional[str]:
+    """SHA-256 of the cacheable prefix, so callers can confirm the cache boundary is byte-identical across requests."""
+    prefix = get_cached_prefix(filename)
+    return _sha256_hex(prefix) if prefix is not None else None
+
 # --- Formatting Functions for Each Call ---
+# build_callN_input() renders only the batched input block; format_callN_*() wraps it in the
+# (prefix, suffix) pair from get_template_parts (or load_and_split_template for other files).
+# A whole template string, the formatters' original argument, is still accepted.
+
+TemplateArg = Union[Tuple[str, str], str, None]
+
+def _check_template_parts(template_parts: Any) -> None:
+    """Raises TypeError unless template_parts is a (prefix, suffix) pair, so a wrong argument can't yield a garbled prompt."""
+    if not (isinstance(template_parts, tuple) and len(template_parts) == 2):
+        raise TypeError(f"template_parts must be a (prefix, suffix) tuple or a template string, not {type(template_parts).__name__}")
+
+def _compose_prompt(template: TemplateArg, placeholder: str, build_input: Callable[[Any], str], batch: List[Any]) -> Optional[str]:
+    if not template: return None
+    if isinstance(template, str): # Whole template: filled in with str.replace, as before the pre-split
+        return template.replace(placeholder, build_input(batch))
+    _check_template_parts(template)
+    return template[0] + build_input(batch) + template[1]
+
+def _format_id_text_block(sentence_data: Dict[str, Any], fields: Tuple[Tuple[str, str], ...]) -> str:
+    """One sentence's input block: the ID header, one `LABEL: {{text}}` line per field, then a blank line."""
+    parts = [_INPUT_HEADER_OPEN, sentence_data['id'], _INPUT_HEADER_CLOSE, "\n"]
+    for field_open, key in fields:
+        parts += (field_open, sentence_data[key], _DELIM_CLOSE, "\n")
+    return "".join(parts)
+
+def build_call1_input(sentences_batch: List[Dict[str, str]]) -> str:
+    """Builds the batched Call 1 input block that goes between the template prefix and suffix."""
+    return "\n".join([_format_id_text_block(sentence_data, _CALL1_FIELDS) for sentence_data in sentences_batch])
 
 def format_call1_advs_advsl_prompt(
-    sentences_batch: List[Dict[str, str]], 
-    prompt_template: str
-) -> Optional[str]:
-    if not prompt_template: return None
-    formatted_input_lines = []
-    for sentence_data in sentences_batch:
-        # Corrected: Simple concatenation for {{text}}
-        delimited_text = "{{" + sentence_data['eng_text'] + "}}"
-        formatted_input_lines.append(f"--- INPUT (ID: {sentence_data['id']}) ---")
-        formatted_input_lines.append(f"TEXT: {delimited_text}")
-        formatted_input_lines.append("") 
-    batched_input_str = "\n".join(formatted_input_lines)
-    return prompt_template.replace("{batched_input_sentences_with_ids_and_delimited_text}", batched_input_str)
-
-def format_call2_simsL2_L2simsl_prompt(
-    sentences_batch: List[Dict[str, str]], 
-    prompt_template: str
+    sentences_batch: List[Dict[str, str]],
+    template_parts: TemplateArg
 ) -> Optional[str]:
-    return format_call1_advs_advsl_prompt(sentences_batch, prompt_template)
+    return _compose_prompt(template_parts, PROMPT_CALL1_PLACEHOLDER, build_call1_input, sentences_batch)
+
+# Call 2 uses the same input layout as Call 1; only the template differs
+format_call2_simsL2_L2simsl_prompt = format_call1_advs_advsl_prompt
+
+def build_call3_input(sentences_batch_data: List[Dict[str, Any]]) -> str:
+    """Builds the batched Call 3 input block that goes between the template prefix and suffix."""
+    return "\n".join([_format_id_text_block(sentence_data, _CALL3_FIELDS) for sentence_data in sentences_batch_data])
 
 def format_call3_advs_segments_lemmas_prompt(
-    sentences_batch_data: List[Dict[str, Any]], 
-    prompt_template: str
+    sentences_batch_data: List[Dict[str, Any]],
+    template_parts: TemplateArg
 ) -> Optional[str]:
-    if not prompt_template: return None
-    formatted_input_lines = []
-    for sentence_data in sentences_batch_data:
-        # Corrected: Simple concatenation for {{text}}
-        eng_text_delimited = "{{" + sentence_data['eng_text'] + "}}"
-        advs_text_delimited = "{{" + sentence_data['advs_text'] + "}}"
-        formatted_input_lines.append(f"--- INPUT (ID: {sentence_data['id']}) ---")
-        formatted_input_lines.append(f"ORIGINAL_ENGLISH_TEXT: {eng_text_delimited}")
-        formatted_input_lines.append(f"AdvS_TEXT_TO_SEGMENT: {advs_text_delimited}")
-        formatted_input_lines.append("")
-    batched_input_str = "\n".join(formatted_input_lines)
-    return prompt_template.replace("{batched_input_advs_sentences_with_ids_and_eng_context}", batched_input_str)
+    return _compose_prompt(template_parts, PROMPT_CALL3_PLACEHOLDER, build_call3_input, sentences_batch_data)
+
+def build_call4_input(sentences_batch_data: List[Dict[str, Any]]) -> str:
+    """Builds the batched Call 4 input block that goes between the template prefix and suffix."""
+    sentence_blocks: List[str] = [""] * len(sentences_batch_data) # One pre-joined block per sentence
+    for i, sentence_data in enumerate(sentences_batch_data):
+        # Fetch each field once per sentence rather than once per use
+        eng_text = sentence_data.get('eng_text')
+        advs_text_full = sentence_data.get('advs_text_full')
+        advs_segments = sentence_data['advs_segments']
+        lines: List[str] = [_INPUT_HEADER_OPEN + sentence_data['id'] + _INPUT_HEADER_CLOSE]
+        if eng_text:
+            lines.append(_ORIGINAL_ENGLISH_TEXT_OPEN + eng_text + _DELIM_CLOSE)
+        if advs_text_full:
+            lines.append(_ORIGINAL_ADVS_TEXT_OPEN + advs_text_full + _DELIM_CLOSE)
+        lines.append("AdvS_SEGMENTS_TO_SIMPLIFY_START::")
+        for seg_data in advs_segments:
+            lines.append(seg_data['id'] + _SEGMENT_TEXT_OPEN + seg_data['text'] + _DELIM_CLOSE)
+        lines.append("AdvS_SEGMENTS_TO_SIMPLIFY_END::\n")
+        sentence_blocks[i] = "\n".join(lines)
+    return "\n".join(sentence_blocks)
 
 def format_call4_simpler_advs_segments_lemmas_prompt(
-    sentences_batch_data: List[Dict[str, Any]], 
-    prompt_template: str
+    sentences_batch_data: List[Dict[str, Any]],
+    template_parts: TemplateArg
 ) -> Optional[str]:
-    if not prompt_template: return None
-    formatted_input_lines = []
-    for sentence_data in sentences_batch_data:
-        formatted_input_lines.append(f"--- INPUT (ID: {sentence_data['id']}) ---")
-        if sentence_data.get('eng_text'):
-            # Corrected: Simple concatenation for {{text}}
-            eng_text_val = "{{" + sentence_data['eng_text'] + "}}"
-            formatted_input_lines.append(f"ORIGINAL_ENGLISH_TEXT: {eng_text_val}")
-        if sentence_data.get('advs_text_full'):
-            # Corrected: Simple concatenation for {{text}}
-            advs_text_full_val = "{{" + sentence_data['advs_text_full'] + "}}"
-            formatted_input_lines.append(f"ORIGINAL_AdvS_TEXT: {advs_text_full_val}")
-        
-        formatted_input_lines.append("AdvS_SEGMENTS_TO_SIMPLIFY_START::")
-        for seg_data in sentence_data['advs_segments']:
-            # Corrected: Simple concatenation for {{text}}
-            advs_segment_text_delimited = "{{" + seg_data['text'] + "}}"
-            formatted_input_lines.append(f"{seg_data['id']}::{advs_segment_text_delimited}")
-        formatted_input_lines.append("AdvS_SEGMENTS_TO_SIMPLIFY_END::")
-        formatted_input_lines.append("")
-    batched_input_str = "\n".join(formatted_input_lines)
-    return prompt_template.replace("{batched_input_for_call4}", batched_input_str)
+    return _compose_prompt(template_parts, PROMPT_CALL4_PLACEHOLDER, build_call4_input, sentences_batch_data)
+
+def build_call5_input(sentences_batch: List[Dict[str, str]]) -> str:
+    """Builds the batched Call 5 input block that goes between the template prefix and suffix."""
+    return "\n".join([_format_id_text_block(sentence_data, _CALL5_FIELDS) for sentence_data in sentences_batch])
 
 def format_call5_simsL3_align_lemmas_prompt(
-    sentences_batch: List[Dict[str, str]], 
-    prompt_template: str
+    sentences_batch: List[Dict[str, str]],
+    template_parts: TemplateArg
 ) -> Optional[str]:
-    if not prompt_template: return None
-    formatted_input_lines = []
-    for sentence_data in sentences_batch:
-        # Corrected: Simple concatenation for {{text}}
-        eng_text_delimited = "{{" + sentence_data['eng_text'] + "}}"
-        formatted_input_lines.append(f"--- INPUT (ID: {sentence_data['id']}) ---")
-        formatted_input_lines.append(f"ENG_TEXT: {eng_text_delimited}")
-        formatted_input_lines.append("") 
-    batched_input_str = "\n".join(formatted_input_lines)
-    return prompt_template.replace("{batched_input_eng_sentences_with_ids}", batched_input_str)
+    return _compose_prompt(template_parts, PROMPT_CALL5_PLACEHOLDER, build_call5_input, sentences_batch)
+
+def _append_checked_alignment_lines(lines: List[str], sentence_data: Dict[str, Any], alignments: List[Any]) -> None:
+    """Call 6 alignment lines with per-record validation; only used when the upfront batch check finds a bad record."""
+    debug_enabled = logger.isEnabledFor(logging.DEBUG) # Checked once, not per bad record
+    for align_data in alignments:
+        if not isinstance(align_data, dict):
+            # Don't crash the whole batch formatter; leave a placeholder so the bad record is visible
+            if debug_enabled:
+                logger.debug("C6 FORMATTER: align_data for sentence ID %s is NOT A DICT. Value: %r", sentence_data.get('id', 'UNKNOWN_ID'), align_data)
+            lines.append(f"S_ERR ~ {{MALFORMED_ALIGN_DATA_NOT_DICT}} ~ {{SKIPPED}}") # Add placeholder
+            continue
+        missing_keys = _REQ_KEYS.difference(align_data)
+        if missing_keys:
+            # Add a placeholder to the prompt being built so we know which one failed
+            # but don't crash the whole prompt formatting.
+            # The LLM will likely ignore this malformed line.
+            # The main script will later fail to parse this if the LLM echoes it or similar.
+            if debug_enabled:
+                logger.debug("C6 FORMATTER: align_data for sentence ID %s MISSING KEYS %s. Full item: %r", sentence_data.get('id', 'UNKNOWN_ID'), sorted(missing_keys), align_data)
+            err_id = align_data.get('id', 'UNKNOWN_ALIGN_ID')
+            lines.append(f"{err_id} ~ {{ERROR_IN_ALIGN_DATA_KEYS}} ~ {{SKIPPED}}")
+            continue # Skip to the next align_data item
+        lines.append(align_data['id'] + _ALIGN_SIMS_OPEN + align_data['sims_l3_segment_text'] + _ALIGN_ENG_OPEN + align_data['eng_span_text'] + _DELIM_CLOSE)
+
+def build_call6_input(sentences_batch_data: List[Dict[str, Any]]) -> str:
+    """Builds the batched Call 6 input block that goes between the template prefix and suffix."""
+    sentence_blocks: List[str] = [""] * len(sentences_batch_data) # One pre-joined block per sentence
+    for i, sentence_data in enumerate(sentences_batch_data):
+        # Fetch each field once per sentence rather than once per use
+        sims_segments = sentence_data['sims_l3_segments']
+        alignments = sentence_data['phrase_alignments_l3_to_eng']
+        lemmas_by_segment = sentence_data['l3_simsl_per_segment']
+        lines: List[str] = [
+            _INPUT_HEADER_OPEN + sentence_data['id'] + _INPUT_HEADER_CLOSE,
+            _ENG_TEXT_OPEN + sentence_data['eng_text'] + _DELIM_CLOSE,
+            "SimS_L3_SEGMENTS_START::",
+        ]
+        for seg_data in sims_segments:
+            lines.append(seg_data['id'] + _SEGMENT_TEXT_OPEN + seg_data['text'] + _DELIM_CLOSE)
+        lines.append("SimS_L3_SEGMENTS_END::")
+        lines.append("PHRASE_ALIGNMENTS_START::")
+        if __debug__ and not all(isinstance(align_data, dict) and _REQ_KEYS.issubset(align_data) for align_data in alignments):
+            _append_checked_alignment_lines(lines, sentence_data, alignments) # Slow path: emit placeholders for bad records
+        else:
+            for align_data in alignments:
+                lines.append(align_data['id'] + _ALIGN_SIMS_OPEN + align_data['sims_l3_segment_text'] + _ALIGN_ENG_OPEN + align_data['eng_span_text'] + _DELIM_CLOSE)
+        lines.append("PHRASE_ALIGNMENTS_END::")
+        lines.append("L3_SimSL_PER_SEGMENT_START::")
+        # Decorate once (segment number, original position, id) and sort the tuples; ids not of the
+        # form S<digits> sort last in their original order, as with the previous stable key sort
+        decorated_segment_ids = [
+            (int(seg_id[1:]) if seg_id[:1] == 'S' and seg_id[1:].isdigit() else _UNNUMBERED_SEGMENT_SORT_KEY, order, seg_id)
+            for order, seg_id in enumerate(lemmas_by_segment)
+        ]
+        decorated_segment_ids.sort()
+        for _, _, seg_id in decorated_segment_ids:
+            lemmas_str = lemmas_by_segment[seg_id]
+            lines.append(seg_id + _SEGMENT_LEMMAS_SEP + lemmas_str)
+        lines.append("L3_SimSL_PER_SEGMENT_END::\n")
+        sentence_blocks[i] = "\n".join(lines)
+    return "\n".join(sentence_blocks)
 
 def format_call6_diglotmap_prompt(
     sentences_batch_data: List[Dict[str, Any]],
-    prompt_template: str
+    template_parts: TemplateArg
 ) -> Optional[str]:
-    if not prompt_template: return None
-    formatted_input_lines = []
-    for sentence_data in sentences_batch_data:
-        formatted_input_lines.append(f"--- INPUT (ID: {sentence_data['id']}) ---")
-        # Corrected: Simple concatenation for {{text}}
-        eng_text_val = "{{" + sentence_data['eng_text'] + "}}"
-        formatted_input_lines.append(f"ENG_TEXT: {eng_text_val}")
-        
-        formatted_input_lines.append("SimS_L3_SEGMENTS_START::")
-        for seg_data in sentence_data['sims_l3_segments']:
-            # Corrected: Simple concatenation for {{text}}
-            seg_text_val = "{{" + seg_data['text'] + "}}"
-            formatted_input_lines.append(f"{seg_data['id']}::{seg_text_val}")
-        formatted_input_lines.append("SimS_L3_SEGMENTS_END::")
-
-        formatted_input_lines.append("PHRASE_ALIGNMENTS_START::")
-        for align_data in sentence_data['phrase_alignments_l3_to_eng']: 
-            # ---- MORE AGGRESSIVE DEBUG BLOCK ----
-            print(f"DEBUG C6 FORMATTER: Processing align_data for sentence {sentence_data.get('id', 'UNKNOWN_ID')}: {align_data}", file=sys.stderr) # Print every align_data
-            sys.stderr.flush() # Ensure it prints immediately
-
-            if not isinstance(align_data, dict):
-                print(f"DEBUG C6 ERROR: align_data for sentence ID {sentence_data.get('id', 'UNKNOWN_ID')} is NOT A DICT. Value: {align_data}", file=sys.stderr)
-                sys.stderr.flush()
-                # To prevent crash and see if other items are okay, we could skip this problematic item
-                # Or, to ensure we catch the error source, let it try and fail, but the print above helps.
-                # For now, let it try to access keys to see where it fails if it's not a dict.
-                # If it is not a dict, the key access below will raise a TypeError or AttributeError.
-                # To be super safe for now and avoid crashing the whole batch formatter:
-                if not isinstance(align_data, dict):
-                    formatted_input_lines.append(f"S_ERR ~ {{MALFORMED_ALIGN_DATA_NOT_DICT}} ~ {{SKIPPED}}") # Add placeholder
-                    continue
-
-
-            error_in_align_data_keys = False
-            required_keys_for_align = ['id', 'sims_l3_segment_text', 'eng_span_text']
-            for req_key in required_keys_for_align:
-                if req_key not in align_data:
-                    print(f"DEBUG C6 ERROR: align_data for sentence ID {sentence_data.get('id', 'UNKNOWN_ID')} MISSING KEY '{req_key}'.", file=sys.stderr)
-                    print(f"DEBUG C6 ERROR: Present keys: {list(align_data.keys())}", file=sys.stderr)
-                    print(f"DEBUG C6 ERROR: Full align_data item: {align_data}", file=sys.stderr)
-                    sys.stderr.flush()
-                    error_in_align_data_keys = True
-            
-            if error_in_align_data_keys:
-                # Add a placeholder to the prompt being built so we know which one failed
-                # but don't crash the whole prompt formatting.
-                # The LLM will likely ignore this malformed line.
-                # The main script will later fail to parse this if the LLM echoes it or similar.
-                err_id = align_data.get('id', 'UNKNOWN_ALIGN_ID')
-                formatted_input_lines.append(f"{err_id} ~ {{ERROR_IN_ALIGN_DATA_KEYS}} ~ {{SKIPPED}}")
-                continue # Skip to the next align_data item
-            # ---- END MORE AGGRESSIVE DEBUG BLOCK ----
-            
-            # Original lines causing the error:
-            sims_seg_text_delimited = "{{" + align_data['sims_l3_segment_text'] + "}}" 
-            eng_span_text_delimited = "{{" + align_data['eng_span_text'] + "}}" 
-            formatted_input_lines.append(f"{align_data['id']} ~ {sims_seg_text_delimited} ~ {eng_span_text_delimited}")
-        formatted_input_lines.append("PHRASE_ALIGNMENTS_END::")
-
-        formatted_input_lines.append("L3_SimSL_PER_SEGMENT_START::")
-        sorted_segment_ids = sorted(sentence_data['l3_simsl_per_segment'].keys(), 
-                                    key=lambda x: int(x[1:]) if x.startswith('S') and x[1:].isdigit() else float('inf'))
-        for seg_id in sorted_segment_ids:
-            lemmas_str = sentence_data['l3_simsl_per_segment'][seg_id]
-            formatted_input_lines.append(f"{seg_id}::{lemmas_str}")
-        formatted_input_lines.append("L3_SimSL_PER_SEGMENT_END::")
-        formatted_input_lines.append("")
-    batched_input_str = "\n".join(formatted_input_lines)
-    return prompt_template.replace("{batched_input_for_call6}", batched_input_str)
+    return _compose_prompt(template_parts, PROMPT_CALL6_PLACEHOLDER, build_call6_input, sentences_batch_data)
+
+def format_prompts_bulk(
+    calls: List[Tuple[Callable[[Any], str], Optional[Tuple[str, str]], List[Dict[str, Any]]]]
+) -> List[Optional[str]]:
+    """Formats many (build_callN_input, template_parts, batch) jobs in one pass.
+    Each prompt is composed exactly once as prefix + body + suffix; a job with no template yields None."""
+    prompts: List[Optional[str]] = [None] * len(calls)
+    for i, (build_input, template_parts, batch) in enumerate(calls):
+        if not template_parts: continue
+        _check_template_parts(template_parts)
+        prompts[i] = template_parts[0] + build_input(batch) + template_parts[1]
+    return prompts
 
 if __name__ == '__main__':
     # (Test code remains the same, it will now use the corrected formatters)
@@ -211,20 +340,20 @@ if __name__ == '__main__':
 
     print("\n--- Testing Call 1 Formatter ---")
     sentences1 = [{"id": "bk1_s1", "eng_text": "First sentence."}, {"id": "bk1_s2", "eng_text": "Second sentence with \"quotes\"."}]
-    template1 = load_prompt_template(PROMPT_CALL1_FILENAME)
+    template1 = get_template_parts(PROMPT_CALL1_FILENAME)
     if template1: print(format_call1_advs_advsl_prompt(sentences1, template1))
     print("\n--- Testing Call 3 Formatter ---")
     sentences3_data = [{"id": "bk1_s1", "eng_text": "First eng.", "advs_text": "First advs."}, {"id": "bk1_s2", "eng_text": "Second eng.", "advs_text": "Second advs."}]
-    template3 = load_prompt_template(PROMPT_CALL3_FILENAME)
+    template3 = get_template_parts(PROMPT_CALL3_FILENAME)
     if template3: print(format_call3_advs_segments_lemmas_prompt(sentences3_data, template3))
     print("\n--- Testing Call 4 Formatter ---")
     sentences4_data = [{"id": "bk1_s1", "eng_text": "Full eng text for context.", "advs_text_full": "Full advs text for context.", "advs_segments": [{"id": "A1", "text": "AdvS Seg 1-1 text"}, {"id": "A2", "text": "AdvS Seg 1-2 text"}]}]
-    template4 = load_prompt_template(PROMPT_CALL4_FILENAME)
+    template4 = get_template_parts(PROMPT_CALL4_FILENAME)
     if template4: print(format_call4_simpler_advs_segments_lemmas_prompt(sentences4_data, template4))
     print("\n--- Testing Call 5 Formatter ---")
-    template5 = load_prompt_template(PROMPT_CALL5_FILENAME)
+    template5 = get_template_parts(PROMPT_CALL5_FILENAME)
     if template5: print(format_call5_simsL3_align_lemmas_prompt(sentences1, template5))
     print("\n--- Testing Call 6 Formatter ---")
     sentences6_data = [{"id": "bk1_s1","eng_text": "The quick brown fox.","sims_l3_segments": [{"id": "S1", "text": "El rápido zorro"},{"id": "S2", "text": "marrón."}],"phrase_alignments_l3_to_eng": [{"id": "S1", "sims_segment_text": "El rápido zorro", "eng_span_text": "The quick brown"},{"id": "S2", "sims_segment_text": "marrón.", "eng_span_text": "fox."}],"l3_simsl_per_segment": {"S1": "el rápido zorro","S2": "marrón"}}]
-    template6 = load_prompt_template(PROMPT_CALL6_FILENAME)
+    template6 = get_template_parts(PROMPT_CALL6_FILENAME)
     if template6: print(format_call6_diglotmap_prompt(sentences6_data, template6))
\ No newline at end of file
@@ -1,25 +1,44 @@
 # Filename: raw2stage.py
 import re
 import nltk  # For sentence tokenization
+from functools import lru_cache
 from pathlib import Path
 import sys   # For sys.exit
+import os
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from collections.abc import Iterator
+from typing import Optional
 
 # --- Configuration for TOML parsing ---
+# Preference order: rtoml / pytomlpp (optional compiled parsers), then tomllib, then toml.
 try:
-    import tomllib
-    TOML_LOAD_MODE = "rb" # tomllib expects binary mode
+    import rtoml # Optional: pip install rtoml
+    TOML_LOAD_MODE = "r" # rtoml expects text mode
     def load_toml_file(f):
-        return tomllib.load(f)
+        return rtoml.load(f)
 except ImportError:
     try:
-        import toml # Requires: pip install toml
-        TOML_LOAD_MODE = "r" # toml expects text mode
+        import pytomlpp # Optional: pip install pytomlpp
+        TOML_LOAD_MODE = "r" # pytomlpp parses a str
         def load_toml_file(f):
-            return toml.load(f)
-        print("Using 'toml' library for config. Python 3.11+ with 'tomllib' is preferred.")
+            return pytomlpp.loads(f.read())
     except ImportError:
-        print("TOML library not found. Please install 'toml' (pip install toml) or use Python 3.11+.")
-        sys.exit(1)
+        try:
+            import tomllib
+            TOML_LOAD_MODE = "rb" # tomllib expects binary mode
+            def load_toml_file(f):
+                return tomllib.load(f)
+        except ImportError:
+            try:
+                import toml # Requires: pip install toml
+                TOML_LOAD_MODE = "r" # toml expects text mode
+                def load_toml_file(f):
+                    return toml.load(f)
+                print("Using 'toml' library for config. Python 3.11+ with 'tomllib' is preferred.")
+            except ImportError:
+                print("TOML library not found. Please install 'toml' (pip install toml) or use Python 3.11+.")
+                sys.exit(1)
 # --- End Configuration for TOML parsing ---
 
 # --- NLTK Setup ---
@@ -44,45 +63,75 @@ except Exception as e:
     print(f"An unexpected error occurred related to NLTK data: {e}")
     print("Please ensure NLTK is installed correctly and its data paths are accessible.")
     sys.exit(1)
+
+# Build the Punkt tokenizer once: nltk.sent_tokenize reloads it on every call in recent NLTK releases.
+def _load_sentence_tokenizer():
+    try:
+        from nltk.tokenize import PunktTokenizer # NLTK >= 3.8.2 (punkt_tab)
+    except ImportError:
+        PunktTokenizer = None
+    try:
+        if PunktTokenizer is not None:
+            return PunktTokenizer("english").tokenize
+        return nltk.data.load("tokenizers/punkt/english.pickle").tokenize
+    except Exception:
+        return nltk.sent_tokenize # Fall back; any loading error then surfaces per paragraph as before
+
+_sent_tokenize = _load_sentence_tokenizer()
+
+# Paragraphs are tokenized one at a time rather than batched through tokenize_sents(): NLTK's batch
+# method is just a loop over tokenize(), and per-paragraph calls keep staged output streaming,
+# keep NLTK errors isolated to one paragraph, and let repeated paragraphs hit the cache below.
+@lru_cache(maxsize=4096)
+def sent_tokenize_cached(text: str) -> tuple[str, ...]:
+    """Sentence-splits a paragraph; repeated paragraphs (headers, epigraphs, boilerplate) hit the cache."""
+    return tuple(_sent_tokenize(text))
 # --- End NLTK Setup ---
 
 # --- Regexes for Chapter/Section Detection ---
 
-# For [ <number> ] style chapters - check on raw paragraph text
-BRACKETED_ARABIC_CHAPTER_REGEX = re.compile(r"^\s*\[\s*(\d+)\s*\]\s*$")
-BRACKETED_ROMAN_CHAPTER_REGEX = re.compile(r"^\s*\[\s*([IVXLCDM]+)\s*\]\s*$", re.IGNORECASE)
-
-# For — I — style sections (currently junked) - check on cleaned paragraph text
-EM_DASH_SECTION_REGEX = re.compile(r"^\s*—\s*([IVXLCDM]+)\s*—\s*$", re.IGNORECASE)
+# For [ <number> ] / [ <roman> ] style chapters - check on raw paragraph text.
+# One pattern, dispatched on which named group matched.
+BRACKETED_CHAPTER_REGEX = re.compile(
+    r"^\s*\[\s*(?:(?P<arabic>\d+)|(?P<roman>[IVXLCDM]+))\s*\]\s*$",
+    re.IGNORECASE
+)
 
-# For "CHAPTER X: Title" or "CHAPTER NOTICE"
-# Group 1: "CHAPTER" (keyword)
-# Group 2: Potential number/numeral (e.g., "I", "1", "ONE") OR first word of a title (e.g. "NOTICE")
-# Group 3: Rest of the title if group 2 was a number/numeral
-CHAPTER_MAIN_REGEX = re.compile(
-    r"^\s*(CHAPTER)\s+([IVXLCDM\d]+(?:st|nd|rd|th)?|[A-ZÀ-ÖØ-ÞĀ-ĒĪ-ŌŪ-Ž'-]+)\s*[:.]?\s*(.*)$",
+# Headings checked on the cleaned paragraph text, as one alternation in priority order
+# (the first alternative that matches wins, exactly as the former one-regex-per-kind cascade did):
+#   emdash  - "— I —" style sections (currently junked)
+#   chapter - "CHAPTER X: Title" or "CHAPTER NOTICE"
+#             chapter_num: potential number/numeral (e.g., "I", "1", "ONE") OR first word of a title (e.g. "NOTICE")
+#             chapter_rest: rest of the title if chapter_num was a number/numeral
+#   special - PREFACE, INTRODUCTION, etc. (no "CHAPTER" keyword)
+#   short   - standalone Roman (IVXLCDM) / Arabic numerals "II", "2." (only used on short lines)
+# Each alternative is wrapped in its own named group, so match.lastgroup names the kind that matched.
+SECTION_HEADING_REGEX = re.compile(
+    r"(?P<emdash>^\s*—\s*(?P<emdash_num>[IVXLCDM]+)\s*—\s*$)"
+    r"|(?P<chapter>^\s*CHAPTER\s+(?P<chapter_num>[IVXLCDM\d]+(?:st|nd|rd|th)?|[A-ZÀ-ÖØ-ÞĀ-ĒĪ-ŌŪ-Ž'-]+)\s*[:.]?\s*(?P<chapter_rest>.*)$)"
+    r"|(?P<special>^\s*(?P<special_name>PREFACE|INTRODUCTION|EPILOGUE|PROLOGUE|CONTENTS|APPENDIX|GLOSSARY|FORWARD|FOREWORD)(?:[:.\s]|$))"
+    r"|(?P<short>^\s*(?P<short_num>[IVXLCDM\d]+)\s*[:.]?\s*$)",
     re.IGNORECASE
 )
+# Every character SECTION_HEADING_REGEX can match on at the start of an already-stripped text
+# (IGNORECASE also folds 'İ'/'ı' onto 'I'); decimal digits are checked separately with str.isdecimal().
+# Prose paragraphs starting with anything else skip the regex entirely.
+_HEADING_FIRST_CHARS = frozenset("—ACDEFGILMPVXacdefgilmpvxİı")
+
 # Known word numbers (can be expanded)
-KNOWN_WORD_NUMBERS = {
+KNOWN_WORD_NUMBERS = frozenset({
     "ZERO", "ONE", "TWO", "THREE", "FOUR", "FIVE", "SIX", "SEVEN", "EIGHT", "NINE", "TEN",
     "ELEVEN", "TWELVE", "THIRTEEN", "FOURTEEN", "FIFTEEN", "SIXTEEN", "SEVENTEEN", "EIGHTEEN", "NINETEEN",
     "TWENTY", "THIRTY", "FORTY", "FIFTY", "SIXTY", "SEVENTY", "EIGHTY", "NINETY", "HUNDRED", "THOUSAND",
     "FIRST", "SECOND", "THIRD", "FOURTH", "FIFTH", "SIXTH", "SEVENTH", "EIGHTH", "NINTH", "TENTH"
-}
-
-
-# For standalone Roman/Arabic numerals "II", "2." (short lines)
-SHORT_LINE_NUMERAL_CHAPTER_REGEX = re.compile(
-    r"^\s*([IVXLCDM\d]+)\s*[:.]?\s*$", # Only Roman (IVXLCDM) and Arabic (d) numerals
-    re.IGNORECASE
-)
+})
 
-# For special sections like PREFACE, INTRODUCTION, etc. (no "CHAPTER" keyword)
-SPECIAL_SECTION_REGEX = re.compile(
-    r"^\s*(PREFACE|INTRODUCTION|EPILOGUE|PROLOGUE|CONTENTS|APPENDIX|GLOSSARY|FORWARD|FOREWORD)(?:[:.\s]|$)",
-    re.IGNORECASE
-)
+# Shared text-normalization patterns (compiled once instead of per call)
+# Note: the numeral/name groups captured by the heading regexes above never contain whitespace,
+# so their values are used without strip().
+PARAGRAPH_SPLIT_REGEX = re.compile(r'(?:\n\s*){2,}')
+NUMERAL_TOKEN_REGEX = re.compile(r"[IVXLCDM\d]+(?:ST|ND|RD|TH)?", re.IGNORECASE)
+BRACKET_TOKEN_REGEX = re.compile(r"[^\[\]]+|[\[\]]") # A run of non-bracket text, or a single bracket
 # --- End Regexes for Chapter/Section Detection ---
 
 def load_config(config_path_str="config.toml"):
@@ -91,7 +140,8 @@ def load_config(config_path_str="config.toml"):
         print(f"Error: Configuration file '{config_path}' not found.")
         return None
     try:
-        with open(config_path, TOML_LOAD_MODE) as f:
+        # TOML files are UTF-8; text mode would otherwise use the locale's encoding (e.g. cp1252 on Windows)
+        with open(config_path, TOML_LOAD_MODE, encoding=None if TOML_LOAD_MODE == "rb" else "utf-8") as f:
             config = load_toml_file(f)
         return config
     except Exception as e:
@@ -103,184 +153,289 @@ def filter_paragraph_lines_for_bracket_content(lines_in_raw_para: list[str]) ->
     overall_junk_line_strings = []
     bracket_depth = 0
     for line_text in lines_in_raw_para:
-        current_line_clean_chars = []
-        current_line_junk_chars = []
-        line_became_entirely_junk_due_to_filtering = True
-        char_idx_first_non_whitespace = -1
-        for ci, char_test in enumerate(line_text):
-            if not char_test.isspace():
-                char_idx_first_non_whitespace = ci
-                break
-        if char_idx_first_non_whitespace == -1:
+        # Fast path: lines with no brackets (nearly all prose) are classified whole with C-level scans
+        if '[' not in line_text and ']' not in line_text:
             if bracket_depth == 0:
-                current_line_clean_chars.extend(list(line_text))
-                line_became_entirely_junk_due_to_filtering = False
+                overall_cleaned_line_strings.append(line_text)
+                overall_junk_line_strings.append("")
             else:
-                current_line_junk_chars.extend(list(line_text))
-        else:
-            original_leading_whitespace = line_text[:char_idx_first_non_whitespace]
-            for char_idx, char_val in enumerate(line_text[char_idx_first_non_whitespace:], start=char_idx_first_non_whitespace):
-                is_first_nw_char_on_line = (char_idx == char_idx_first_non_whitespace)
-                if char_val == '[':
-                    if bracket_depth == 0 and is_first_nw_char_on_line:
-                        bracket_depth += 1
-                        current_line_junk_chars.extend(list(original_leading_whitespace))
-                        current_line_junk_chars.append(char_val)
-                    elif bracket_depth > 0:
-                        bracket_depth += 1
-                        current_line_junk_chars.append(char_val)
-                    else:
-                        if line_became_entirely_junk_due_to_filtering:
-                            current_line_clean_chars.extend(list(original_leading_whitespace))
-                        current_line_clean_chars.append(char_val)
-                        line_became_entirely_junk_due_to_filtering = False
-                elif char_val == ']':
-                    if bracket_depth > 0:
-                        current_line_junk_chars.append(char_val)
-                        bracket_depth -= 1
-                    else:
-                        if line_became_entirely_junk_due_to_filtering:
-                            current_line_clean_chars.extend(list(original_leading_whitespace))
-                        current_line_clean_chars.append(char_val)
-                        line_became_entirely_junk_due_to_filtering = False
+                # Inside a bracket block: everything after the leading whitespace is junk
+                # (an all-whitespace line is kept whole)
+                overall_junk_line_strings.append(line_text.lstrip() or line_text)
+            continue
+        # The line has a bracket, so it also has a non-whitespace character
+        char_idx_first_non_whitespace = len(line_text) - len(line_text.lstrip())
+        original_leading_whitespace = line_text[:char_idx_first_non_whitespace]
+        # A '[' as the first non-whitespace character outside a block opens a junk block and takes the indent with it
+        opens_with_junk_block = bracket_depth == 0 and line_text[char_idx_first_non_whitespace] == '['
+        # Walk the line as regex tokens (a single bracket, or a run of non-bracket text) so the scanning
+        # happens in C; within a text run the depth cannot change, so the whole run is classified at once
+        clean_parts = []
+        junk_parts = []
+        for token_match in BRACKET_TOKEN_REGEX.finditer(line_text, char_idx_first_non_whitespace):
+            token = token_match.group()
+            if token == '[':
+                if bracket_depth > 0 or token_match.start() == char_idx_first_non_whitespace:
+                    bracket_depth += 1
+                    junk_parts.append(token)
                 else:
-                    if bracket_depth == 0:
-                        if line_became_entirely_junk_due_to_filtering:
-                            current_line_clean_chars.extend(list(original_leading_whitespace))
-                        current_line_clean_chars.append(char_val)
-                        line_became_entirely_junk_due_to_filtering = False
-                    else:
-                        current_line_junk_chars.append(char_val)
-        if not line_became_entirely_junk_due_to_filtering:
-            overall_cleaned_line_strings.append("".join(current_line_clean_chars))
-        overall_junk_line_strings.append("".join(current_line_junk_chars))
-    temp_joined_clean_para = " ".join(s.strip() for s in overall_cleaned_line_strings if s.strip())
-    final_cleaned_text = re.sub(r'\s+', ' ', temp_joined_clean_para).strip()
+                    clean_parts.append(token)
+            elif token == ']':
+                if bracket_depth > 0:
+                    bracket_depth -= 1
+                    junk_parts.append(token)
+                else:
+                    clean_parts.append(token)
+            elif bracket_depth == 0:
+                clean_parts.append(token)
+            else:
+                junk_parts.append(token)
+
+        if clean_parts: # The indent goes with the first clean character, even if it also opened a junk block
+            overall_cleaned_line_strings.append(original_leading_whitespace + "".join(clean_parts))
+        junk_text = "".join(junk_parts)
+        overall_junk_line_strings.append(original_leading_whitespace + junk_text if opens_with_junk_block else junk_text)
+    # Join the clean lines and collapse every whitespace run to one space (split() also drops the ends)
+    final_cleaned_text = " ".join(" ".join(overall_cleaned_line_strings).split())
     final_junk_text = "\n".join(overall_junk_line_strings)
     return final_cleaned_text, final_junk_text
 
-def process_text_to_staged_format(text_content: str, initial_sentence_counter: int) -> tuple[list[str], str, int]:
-    raw_paragraphs = re.split(r'(?:\n\s*){2,}', text_content.strip())
-    staged_output_lines = []
-    collected_junk_text_parts = []
-    current_sentence_counter = initial_sentence_counter
+def iter_paragraphs(text: str):
+    """Yields the blank-line-separated paragraphs of text one at a time (same pieces as PARAGRAPH_SPLIT_REGEX.split)."""
+    prev_end = 0
+    for separator in PARAGRAPH_SPLIT_REGEX.finditer(text):
+        yield text[prev_end:separator.start()]
+        prev_end = separator.end()
+    yield text[prev_end:]
 
-    for raw_para_idx, raw_para_text_unstripped in enumerate(raw_paragraphs):
-        raw_para_text = raw_para_text_unstripped.strip() # Use stripped version for checks
-        if not raw_para_text:
-            continue
-        
-        is_chapter_heading = False
-        chapter_display_text = ""
-        paragraph_fully_handled = False
-
-        # Priority 1: Check for bracketed chapter markers like [1] or [I] on the raw paragraph
-        match_bracket_arabic = BRACKETED_ARABIC_CHAPTER_REGEX.match(raw_para_text)
-        if match_bracket_arabic:
-            is_chapter_heading = True
-            chapter_display_text = f"Chapter {match_bracket_arabic.group(1).strip()}"
-            collected_junk_text_parts.append(f"--- Junk from identified bracketed chapter marker (Para {raw_para_idx + 1}) ---\n{raw_para_text_unstripped.strip()}")
-            paragraph_fully_handled = True
+# Classification depends only on the paragraph text, so byte-identical paragraphs (licence headers,
+# boilerplate shared across a corpus) are classified once per worker process. The paragraph number
+# and sentence counter are applied by the caller, keeping the cached results position-independent.
+@lru_cache(maxsize=4096)
+def _classify_paragraph(raw_para_text_unstripped: str) -> tuple[Optional[str], tuple[str, ...], tuple[tuple[str, str], ...], str]:
+    """Classifies one raw paragraph.
+    Returns (chapter_display_text or None, sentences, junk_entries, warning). Junk entries are
+    (header_template, junk_text) pairs whose header contains a '{para}' field for the paragraph number."""
+    raw_para_text = raw_para_text_unstripped.strip() # Use stripped version for checks
+    if not raw_para_text:
+        return None, (), (), ""
+
+    junk_entries = []
+    is_chapter_heading = False
+    chapter_display_text = ""
+    paragraph_fully_handled = False
+
+    # Priority 1: Check for bracketed chapter markers like [1] or [I] on the raw paragraph
+    # raw_para_text is stripped, so only a paragraph starting with '[' can match
+    match_bracket = BRACKETED_CHAPTER_REGEX.match(raw_para_text) if raw_para_text[0] == '[' else None
+    if match_bracket:
+        is_chapter_heading = True
+        if match_bracket.lastgroup == 'arabic':
+            chapter_display_text = f"Chapter {match_bracket.group('arabic')}"
+        else:
+            chapter_display_text = f"Chapter {match_bracket.group('roman').upper()}"
+        junk_entries.append(("--- Junk from identified bracketed chapter marker (Para {para}) ---", raw_para_text))
+        paragraph_fully_handled = True
+    
+    cleaned_para_text_for_processing = ""
+    if not paragraph_fully_handled:
+        # If not a bracketed chapter, then filter for other brackets (illustrations, etc.)
+        original_lines = raw_para_text_unstripped.splitlines() # Use unstripped to preserve original junk lines
+        cleaned_para_text_for_processing, junk_from_filter = filter_paragraph_lines_for_bracket_content(original_lines)
+        if junk_from_filter.strip():
+            junk_entries.append(("--- Junk from bracket filtering (Para {para}) ---", junk_from_filter))
+
+        if not cleaned_para_text_for_processing: # If paragraph became empty after this filtering
+            paragraph_fully_handled = True # Nothing left to process
+
+    if not paragraph_fully_handled:
+        # Priorities 2 and 3: em-dash sections, then standard chapter/section detection, in one regex pass
+        first_char = cleaned_para_text_for_processing[0] # Whitespace-normalized, so never a space
+        if first_char in _HEADING_FIRST_CHARS or first_char.isdecimal():
+            match_heading = SECTION_HEADING_REGEX.match(cleaned_para_text_for_processing)
         else:
-            match_bracket_roman = BRACKETED_ROMAN_CHAPTER_REGEX.match(raw_para_text)
-            if match_bracket_roman:
-                is_chapter_heading = True
-                chapter_display_text = f"Chapter {match_bracket_roman.group(1).strip().upper()}"
-                collected_junk_text_parts.append(f"--- Junk from identified bracketed chapter marker (Para {raw_para_idx + 1}) ---\n{raw_para_text_unstripped.strip()}")
-                paragraph_fully_handled = True
-        
-        cleaned_para_text_for_processing = ""
-        if not paragraph_fully_handled:
-            # If not a bracketed chapter, then filter for other brackets (illustrations, etc.)
-            original_lines = raw_para_text_unstripped.splitlines() # Use unstripped to preserve original junk lines
-            cleaned_para_text_for_processing, junk_from_filter = filter_paragraph_lines_for_bracket_content(original_lines)
-            if junk_from_filter.strip():
-                collected_junk_text_parts.append(f"--- Junk from bracket filtering (Para {raw_para_idx + 1}) ---\n{junk_from_filter}")
-
-            if not cleaned_para_text_for_processing: # If paragraph became empty after this filtering
-                paragraph_fully_handled = True # Nothing left to process
-
-        if not paragraph_fully_handled:
-            # Priority 2: Check for em-dash sections like — I — on the cleaned text
-            match_em_dash_section = EM_DASH_SECTION_REGEX.match(cleaned_para_text_for_processing)
-            if match_em_dash_section:
-                # Currently, we junk these. Could be promoted to %%PART_MARKER%% later.
-                numeral = match_em_dash_section.group(1).strip().upper()
-                collected_junk_text_parts.append(f"--- Junk from identified em-dash section marker: Part {numeral} (Para {raw_para_idx + 1}) ---\n{cleaned_para_text_for_processing}")
-                paragraph_fully_handled = True
+            match_heading = None
+        heading_kind = match_heading.lastgroup if match_heading else None
+
+        if heading_kind == 'emdash':
+            # Currently, we junk these. Could be promoted to %%PART_MARKER%% later.
+            numeral = match_heading.group('emdash_num').upper()
+            junk_entries.append((f"--- Junk from identified em-dash section marker: Part {numeral} (Para {{para}}) ---", cleaned_para_text_for_processing))
+            paragraph_fully_handled = True
+        elif heading_kind == 'chapter':
+            is_chapter_heading = True
+            chapter_num_token = match_heading.group('chapter_num')
+            potential_num_or_title_word = chapter_num_token.upper()
+            rest_of_title = match_heading.group('chapter_rest').strip()
+
+            # Try to determine if potential_num_or_title_word is a number/numeral
+            # (NUMERAL_TOKEN_REGEX ignores case, so the captured token is matched as-is)
+            is_actual_numeral = NUMERAL_TOKEN_REGEX.fullmatch(chapter_num_token) is not None
+            is_known_word_number = potential_num_or_title_word in KNOWN_WORD_NUMBERS
             
-        if not paragraph_fully_handled:
-            # Priority 3: Standard Chapter/Section Detection on cleaned_para_text_for_processing
-            match_main = CHAPTER_MAIN_REGEX.match(cleaned_para_text_for_processing)
-            if match_main:
-                is_chapter_heading = True
-                potential_num_or_title_word = match_main.group(2).strip().upper()
-                rest_of_title = match_main.group(3).strip()
-
-                # Try to determine if potential_num_or_title_word is a number/numeral
-                is_actual_numeral = bool(re.fullmatch(r"[IVXLCDM\d]+(?:ST|ND|RD|TH)?", potential_num_or_title_word, re.IGNORECASE))
-                is_known_word_number = potential_num_or_title_word in KNOWN_WORD_NUMBERS
-                
-                if is_actual_numeral or is_known_word_number:
-                    chapter_display_text = f"Chapter {potential_num_or_title_word}"
+            if is_actual_numeral or is_known_word_number:
+                chapter_display_text = f"Chapter {potential_num_or_title_word}"
+                if rest_of_title:
+                    if rest_of_title.endswith('.') and not rest_of_title.endswith('..'):
+                        rest_of_title = rest_of_title[:-1].strip()
                     if rest_of_title:
-                        if rest_of_title.endswith('.') and not rest_of_title.endswith('..'):
-                            rest_of_title = rest_of_title[:-1].strip()
-                        if rest_of_title:
-                            chapter_display_text += f": {rest_of_title}"
-                else: # Treat as a title like "CHAPTER NOTICE"
-                    full_title_part = f"{potential_num_or_title_word} {rest_of_title}".strip()
-                    chapter_display_text = f"Chapter {full_title_part}"
-            
-            if not is_chapter_heading:
-                match_special = SPECIAL_SECTION_REGEX.match(cleaned_para_text_for_processing)
-                if match_special:
-                    is_chapter_heading = True
-                    chapter_display_text = match_special.group(1).strip().title()
-
-            if not is_chapter_heading:
-                # Increased length heuristic for short line numerals
-                if len(cleaned_para_text_for_processing) < 30: 
-                    match_short_numeral = SHORT_LINE_NUMERAL_CHAPTER_REGEX.match(cleaned_para_text_for_processing)
-                    if match_short_numeral:
-                        is_chapter_heading = True
-                        numeral = match_short_numeral.group(1).strip().upper()
-                        chapter_display_text = f"Chapter {numeral}"
-            
+                        chapter_display_text += f": {rest_of_title}"
+            else: # Treat as a title like "CHAPTER NOTICE"
+                full_title_part = f"{potential_num_or_title_word} {rest_of_title}".strip()
+                chapter_display_text = f"Chapter {full_title_part}"
+        elif heading_kind == 'special':
+            is_chapter_heading = True
+            chapter_display_text = match_heading.group('special_name').title()
+        elif heading_kind == 'short' and len(cleaned_para_text_for_processing) < 30:
+            # Increased length heuristic for short line numerals
+            is_chapter_heading = True
+            numeral = match_heading.group('short_num').upper()
+            chapter_display_text = f"Chapter {numeral}"
+
+        if heading_kind != 'emdash':
             paragraph_fully_handled = is_chapter_heading # If it's a chapter, it's handled
 
+    if is_chapter_heading:
+        return " ".join(chapter_display_text.split()), (), tuple(junk_entries), ""
+    if paragraph_fully_handled or not cleaned_para_text_for_processing:
+        return None, (), tuple(junk_entries), ""
+
+    # Process as regular sentences
+    try:
+        sentences_in_para = sent_tokenize_cached(cleaned_para_text_for_processing)
+    except Exception as e:
+        junk_entries.append(("--- Junk from NLTK error on Para Block {para} ---", cleaned_para_text_for_processing))
+        return None, (), tuple(junk_entries), f"Warning: NLTK error tokenizing paragraph: '{cleaned_para_text_for_processing[:100]}...'. Error: {e}. Skipping."
+
+    kept_sentences = []
+    for sent_text in sentences_in_para:
+        # Only whether there are 0, 1 or 2+ alphanumerics matters, so stop counting at 2
+        alnum_count = 0
+        for ch in sent_text:
+            if ch.isalnum():
+                alnum_count += 1
+                if alnum_count == 2: break
+        if alnum_count == 0 or (alnum_count < 2 and len(sent_text) < 6):
+            if sent_text.strip():
+                junk_entries.append(("--- Junk from post-NLTK short/punct sentence filter (Para {para}) ---", sent_text))
+            continue
+        cleaned_sentence = " ".join(sent_text.split()) # Collapse whitespace runs and strip
+        if cleaned_sentence:
+            kept_sentences.append(cleaned_sentence)
+    return None, tuple(kept_sentences), tuple(junk_entries), ""
+
+def process_text_to_staged_format(text_content: str, initial_sentence_counter: int, collected_junk_text_parts: list[str],
+                                  log_lines: list[str]) -> Iterator[str]:
+    """Yields staged output lines one at a time; junk fragments are appended to collected_junk_text_parts, and
+    warnings to log_lines (this runs in a worker process, whose own prints would interleave with other books')."""
+    current_sentence_counter = initial_sentence_counter
+
+    for raw_para_idx, raw_para_text_unstripped in enumerate(iter_paragraphs(text_content.strip())):
+        chapter_display_text, sentences, junk_entries, warning = _classify_paragraph(raw_para_text_unstripped)
+        for junk_header, junk_text in junk_entries:
+            collected_junk_text_parts.append(f"{junk_header.format(para=raw_para_idx + 1)}\n{junk_text}")
+        if warning:
+            log_lines.append(warning)
+
         # --- Output if chapter heading was identified (from any method) ---
-        if is_chapter_heading:
-            chapter_display_text = re.sub(r'\s+', ' ', chapter_display_text).strip()
+        if chapter_display_text is not None:
             if not chapter_display_text:
-                 print(f"Warning: Empty chapter display text for supposed heading from: '{raw_para_text_unstripped.strip()}' (Para Block {raw_para_idx + 1})")
+                 log_lines.append(f"Warning: Empty chapter display text for supposed heading from: '{raw_para_text_unstripped.strip()}' (Para Block {raw_para_idx + 1})")
             else:
-                staged_output_lines.append(f"%%CHAPTER_MARKER%% {chapter_display_text}")
-                staged_output_lines.append(f"{{S{current_sentence_counter}: {chapter_display_text}}}")
-                current_sentence_counter += 1
-        
-        elif not paragraph_fully_handled and cleaned_para_text_for_processing: # Process as regular sentences
-            try:
-                sentences_in_para = nltk.sent_tokenize(cleaned_para_text_for_processing)
-            except Exception as e:
-                print(f"Warning: NLTK error tokenizing paragraph: '{cleaned_para_text_for_processing[:100]}...'. Error: {e}. Skipping.")
-                collected_junk_text_parts.append(f"--- Junk from NLTK error on Para Block {raw_para_idx + 1} ---\n{cleaned_para_text_for_processing}")
-                continue
-
-            for sent_text in sentences_in_para:
-                test_sent_alphanum = "".join(filter(str.isalnum, sent_text))
-                if not test_sent_alphanum or (len(test_sent_alphanum) < 2 and len(sent_text) < 6) :
-                    if sent_text.strip():
-                        collected_junk_text_parts.append(f"--- Junk from post-NLTK short/punct sentence filter (Para {raw_para_idx + 1}) ---\n{sent_text}")
-                    continue
-                cleaned_sentence = re.sub(r'\s+', ' ', sent_text).strip()
-                if not cleaned_sentence:
-                    continue
-                staged_output_lines.append(f"{{S{current_sentence_counter}: {cleaned_sentence}}}")
+                yield f"%%CHAPTER_MARKER%% {chapter_display_text}"
+                yield f"{{S{current_sentence_counter}: {chapter_display_text}}}"
                 current_sentence_counter += 1
+            continue
+
+        for cleaned_sentence in sentences:
+            yield f"{{S{current_sentence_counter}: {cleaned_sentence}}}"
+            current_sentence_counter += 1
+    
+def read_raw_text(raw_file_path: Path) -> str:
+    """Reads a raw book as UTF-8 (undecodable bytes dropped, newlines normalized to "\n", as read_text does).
+    The file is memory-mapped so the undecoded bytes stay in the page cache instead of a heap copy."""
+    with raw_file_path.open('rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return "" # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = str(mm, encoding='utf-8', errors='ignore')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def process_one_file(raw_file_path: Path, staged_output_dir: Path) -> tuple[int, int, int, list[str]]:
+    """Stages one raw book file; runs in a worker process.
+    Returns (processed, skipped, errors, log_lines) so the parent can tally counts and print the log in order."""
+    log_lines = [f"\n--- Analyzing: {raw_file_path.name} ---"]
+    base_name = raw_file_path.stem
+    staged_text_file_path = staged_output_dir / f"{base_name}.txt"
+    junk_file_path = staged_output_dir / f"{base_name}.junk.txt"
+
+    # An exclusive create checks for and claims the staged output in one open() call;
+    # the junk file is only looked at when the staged file is already there.
+    try:
+        f_staged = staged_text_file_path.open('x', encoding='utf-8')
+    except FileExistsError:
+        if junk_file_path.exists():
+            log_lines.append(f"Skipping '{raw_file_path.name}': Output files already exist.")
+            return 0, 1, 0, log_lines
+        f_staged = None # Staged file without its junk file: both are rewritten below
+    except OSError:
+        f_staged = None # Reopened (and any error reported) when the staged text is written
     
-    final_all_junk_text = "\n\n".join(collected_junk_text_parts)
-    return staged_output_lines, final_all_junk_text, current_sentence_counter
+    log_lines.append(f"Processing '{raw_file_path.name}'...")
+    try:
+        raw_content = read_raw_text(raw_file_path)
+    except Exception as e:
+        if f_staged is not None: # Don't leave the just-created empty output behind
+            f_staged.close()
+            staged_text_file_path.unlink(missing_ok=True)
+        log_lines.append(f"Error reading file '{raw_file_path.name}': {e}")
+        return 0, 0, 1, log_lines
+
+    current_sentence_idx = 1 
+    all_junk_for_book_parts = []
+
+    if not raw_content.strip():
+        log_lines.append(f"Skipping '{raw_file_path.name}': File is empty or contains only whitespace.")
+        error_count = 0
+        try:
+            if f_staged is not None:
+                f_staged.close() # Already created empty
+            else:
+                staged_text_file_path.write_text("", encoding='utf-8')
+            junk_file_path.write_text("", encoding='utf-8')
+        except Exception as e_w:
+            log_lines.append(f"Error writing empty out files for '{raw_file_path.name}': {e_w}")
+            error_count +=1
+        return 0, 1, error_count, log_lines
+    
+    # Stream staged lines straight to disk; lines are "\n"-separated with no trailing newline.
+    staged_line_count = 0
+    file_processed_flag = True
+    error_count = 0
+    try:
+        if f_staged is None:
+            f_staged = staged_text_file_path.open('w', encoding='utf-8')
+        with f_staged:
+            for staged_line in process_text_to_staged_format(raw_content, current_sentence_idx, all_junk_for_book_parts, log_lines):
+                f_staged.write(f"\n{staged_line}" if staged_line_count else staged_line)
+                staged_line_count += 1
+        if not staged_line_count:
+            log_lines.append(f"No processable output for '{raw_file_path.name}'. Staged file will be empty.")
+        log_lines.append(f"Saved staged text to '{staged_text_file_path.name}'")
+    except Exception as e_s:
+        log_lines.append(f"Error writing staged file '{staged_text_file_path.name}': {e_s}")
+        error_count +=1; file_processed_flag = False
+    
+    final_junk_output = "\n\n".join(all_junk_for_book_parts)
+    if not final_junk_output.strip(): log_lines.append(f"No significant junk for '{raw_file_path.name}'.")
+    try:
+        junk_file_path.write_text(final_junk_output, encoding='utf-8')
+        log_lines.append(f"Saved junk to '{junk_file_path.name}'")
+    except Exception as e_j:
+        log_lines.append(f"Error writing junk file '{junk_file_path.name}': {e_j}")
+        error_count +=1
+    
+    return (1 if file_processed_flag else 0), 0, error_count, log_lines
 
 def main():
     config = load_config()
@@ -303,64 +458,21 @@ def main():
     print(f"Processing files from: {raw_files_dir}")
     print(f"Saving processed sentence files and junk files to: {staged_output_dir}")
 
+    # Books are independent, so stage them in parallel across CPU cores
+    raw_file_paths = list(raw_files_dir.glob('*.txt'))
+    max_workers = min(os.cpu_count() or 1, len(raw_file_paths)) or 1
     processed_count, skipped_count, error_count = 0, 0, 0
-    for raw_file_path in raw_files_dir.glob('*.txt'):
-        print(f"\n--- Analyzing: {raw_file_path.name} ---")
-        base_name = raw_file_path.stem
-        staged_text_file_path = staged_output_dir / f"{base_name}.txt"
-        junk_file_path = staged_output_dir / f"{base_name}.junk.txt"
-
-        if staged_text_file_path.exists() and junk_file_path.exists():
-            print(f"Skipping '{raw_file_path.name}': Output files already exist.")
-            skipped_count += 1
-            continue
-        
-        print(f"Processing '{raw_file_path.name}'...")
-        try:
-            with open(raw_file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                raw_content = f.read()
-        except Exception as e:
-            print(f"Error reading file '{raw_file_path.name}': {e}")
-            error_count += 1; continue
-
-        current_sentence_idx = 1 
-        all_staged_lines_for_book, all_junk_for_book_parts = [], []
-
-        if not raw_content.strip():
-            print(f"Skipping '{raw_file_path.name}': File is empty or contains only whitespace.")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_one_file, raw_file_path, staged_output_dir) for raw_file_path in raw_file_paths]
+        for raw_file_path, future in zip(raw_file_paths, futures): # Report in submission order
             try:
-                with open(staged_text_file_path, 'w', encoding='utf-8') as f_s: f_s.write("")
-                with open(junk_file_path, 'w', encoding='utf-8') as f_j: f_j.write("")
-            except Exception as e_w:
-                print(f"Error writing empty out files for '{raw_file_path.name}': {e_w}")
-                error_count +=1
-            skipped_count +=1; continue
-        
-        staged_lines, junk_text, _ = process_text_to_staged_format(raw_content, current_sentence_idx)
-        all_staged_lines_for_book.extend(staged_lines)
-        if junk_text.strip(): all_junk_for_book_parts.append(junk_text)
-
-        final_staged_text_output = "\n".join(all_staged_lines_for_book)
-        file_processed_flag = True
-        if not final_staged_text_output:
-            print(f"No processable output for '{raw_file_path.name}'. Staged file will be empty.")
-        try:
-            with open(staged_text_file_path, 'w', encoding='utf-8') as f_s: f_s.write(final_staged_text_output)
-            print(f"Saved staged text to '{staged_text_file_path.name}'")
-        except Exception as e_s:
-            print(f"Error writing staged file '{staged_text_file_path.name}': {e_s}")
-            error_count +=1; file_processed_flag = False
-        
-        final_junk_output = "\n\n".join(all_junk_for_book_parts)
-        if not final_junk_output.strip(): print(f"No significant junk for '{raw_file_path.name}'.")
-        try:
-            with open(junk_file_path, 'w', encoding='utf-8') as f_j: f_j.write(final_junk_output)
-            print(f"Saved junk to '{junk_file_path.name}'")
-        except Exception as e_j:
-            print(f"Error writing junk file '{junk_file_path.name}': {e_j}")
-            error_count +=1
-        
-        if file_processed_flag: processed_count += 1
+                processed, skipped, errors, log_lines = future.result()
+            except Exception as e:
+                print(f"\n--- Analyzing: {raw_file_path.name} ---")
+                print(f"Error processing '{raw_file_path.name}': {e}")
+                error_count += 1; continue
+            print("\n".join(log_lines))
+            processed_count += processed; skipped_count += skipped; error_count += errors
 
     print(f"\n--- Processing Complete ---")
     print(f"Attempted processing for {processed_count} file(s).")
@@ -368,4 +480,4 @@ def main():
     if error_count > 0: print(f"Encountered errors in {error_count} file operation(s).")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -6,18 +6,46 @@ from pathlib import Path
 import re
 import time
 import argparse
+import logging
+import logging.handlers
+import queue
 import sys
-from typing import Optional, List # Added List for type hinting
+import asyncio
+import hashlib
+import json
+import sqlite3
+import random
+import unicodedata
+import datetime
+import functools
+from typing import Optional, List, Tuple # Added List for type hinting
 from dotenv import load_dotenv
 
 # --- Import from the validator module ---
 try:
-    from llm_output_validator import validate_llm_block
+    from llm_output_validator import validate_llm_block, validate_llm_batch_block, streamed_block_error
 except ImportError:
     print("ERROR: Could not import 'validate_llm_block' from 'llm_output_validator.py'.")
     print("Please ensure 'llm_output_validator.py' is in the same directory or accessible in PYTHONPATH.")
     sys.exit(1)
 
+# --- Configuration for TOML parsing ---
+try:
+    import tomllib # Python 3.11+
+    TOML_LOAD_MODE = "rb" # tomllib expects binary mode
+    def load_toml_file(f): return tomllib.load(f)
+except ImportError:
+    try:
+        import toml # Fallback: pip install toml
+        TOML_LOAD_MODE = "r" # toml expects text mode
+        def load_toml_file(f): return toml.load(f)
+        print("Using 'toml' library for config. Python 3.11+ with 'tomllib' is preferred.", file=sys.stderr)
+    except ImportError:
+        load_toml_file = None # Reported by load_project_config
+# --- End Configuration for TOML parsing ---
+
+logger = logging.getLogger("stage2llm")
+
 # --- Configuration ---
 MODEL_NAME = "gemini-2.5-pro-preview-05-06"
 DEFAULT_STAGED_DIR_NAME = "Staged"
@@ -25,16 +53,50 @@ DEFAULT_LLM_OUTPUT_DIR_NAME = "stage"
 DEFAULT_MAX_API_RETRIES = 3
 DEFAULT_MAX_VALIDATION_RETRIES = 2 # 1 initial try + 1 corrective retry
 DEFAULT_RETRY_DELAY_SECONDS = 5
-API_CALL_DELAY_SECONDS = 1 # Base delay between successful API calls for sentences
-
-SENTENCE_LINE_REGEX = re.compile(r"^{S\d+:\s*(.*)}$")
-CHAPTER_MARKER_REGEX = re.compile(r"^%%CHAPTER_MARKER%%\s*(.*)$")
-
-# --- LLM_PROMPT_TEMPLATE ---
-LLM_PROMPT_TEMPLATE = """
+DEFAULT_CONCURRENT_REQUESTS = 8 # Sentences in flight at once, shared across all books
+DEFAULT_MAX_BOOKS_CONCURRENCY = 4 # Books processed at once; the request limits above still apply globally
+DEFAULT_BATCH_SIZE = 1 # Target sentences per API call; >1 shares one request's overhead across several sentences
+DEFAULT_REQUESTS_PER_MINUTE = 60 # Pacing for API call starts across all in-flight sentences
+MAX_RATE_LIMIT_BACKOFF_SECONDS = 120 # Cap on the computed backoff after a 429/quota error
+PROMPT_TOKEN_USAGE = {"prompt": 0, "cached": 0} # Run totals from response usage metadata, to confirm context-cache hits
+RESPONSE_CACHE_DIR_NAME = ".llm_cache" # Under content_project_dir
+RESPONSE_CACHE_DB_NAME = "cache.sqlite" # Inside RESPONSE_CACHE_DIR_NAME
+RESPONSE_CACHE_WRITE_BATCH = 32 # Cache entries buffered before one executemany; also flushed after every book
+PROGRESS_LOG_INTERVAL_SECONDS = 15 # Minimum gap between per-book "items written" INFO lines
+PROGRESS_FILE_SUFFIX = ".progress.json" # Sidecar next to a .llm.txt that is still being written; see process_book_file_async
+SOURCES_FILE_SUFFIX = ".sources.json" # Sidecar next to a finished .llm.txt: a digest of the source item behind each block
+CONTEXT_CACHE_TTL_SECONDS = 3600 # Lifetime of the Gemini context cache holding STATIC_SYSTEM_PROMPT
+CONTEXT_CACHE_REFRESH_SECONDS = CONTEXT_CACHE_TTL_SECONDS // 3 # TTL renewal interval; a failed renewal still leaves time for the next
+RESPONSE_CACHE_VERSION = "2" # Part of every cache key; bump when the prompt/output format or validator rules change
+
+# Sent with every request; built once here rather than per call. Plain dicts, as the SDK expects.
+SAFETY_SETTINGS = (
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+)
+# GENERATION_CONFIG = genai.types.GenerationConfig(temperature=0.7) # Optional; if enabled, pass generation_config=GENERATION_CONFIG
+
+# Gemini's 429 errors usually say how long to wait, as a RetryInfo "retry_delay { seconds: N }" or "Please retry in N.Ns"
+RETRY_DELAY_HINT_REGEX = re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)|retry in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+
+# A block in a .llm.txt ends with an END_SENTENCE line and is followed by one blank line
+OUTPUT_BLOCK_SPLIT_REGEX = re.compile(r"(?<=^END_SENTENCE\n)\n", re.MULTILINE)
+
+# Run with finditer over the whole staged file: a chapter marker or a {S<n>: sentence} line, told apart by
+# match.lastgroup. Surrounding whitespace is trimmed by the pattern itself; [^\S\n] keeps it from crossing lines.
+STAGED_LINE_REGEX = re.compile(
+    r"^[^\S\n]*(?:%%CHAPTER_MARKER%%[^\S\n]*(?P<marker>.*?)|\{S\d+:[^\S\n]*(?P<sentence>.*?)[^\S\n]*\})[^\S\n]*$",
+    re.MULTILINE)
+
+# --- Prompt ---
+# The static instructions and example go to Gemini once as a system instruction (held in a context cache
+# when the API allows it); each request then only sends the short per-sentence USER_PROMPT_TEMPLATE.
+STATIC_SYSTEM_PROMPT = """
 You are an expert linguist and data formatter.
-Your primary task is to process the "TARGET SENTENCE" provided below.
-Use the "PRECEDING CONTEXT" and "SUCCEEDING CONTEXT" (if available) ONLY for disambiguation, pronoun resolution, and to understand the narrative flow related to the TARGET SENTENCE.
+Your primary task is to process the "TARGET SENTENCE" provided in the user message.
+Use the "PRECEDING CONTEXT" and "SUCCEEDING CONTEXT" (if available, also in the user message) ONLY for disambiguation, pronoun resolution, and to understand the narrative flow related to the TARGET SENTENCE.
 DO NOT generate full output blocks for the context sentences.
 The output block you generate MUST correspond ONLY to the "TARGET SENTENCE".
 
@@ -42,17 +104,6 @@ Overall Goal for Simplification:
 For both the "SimE" (Simple English) and "SimS" (Simple Spanish) outputs, the primary goal is extreme simplicity suitable for an absolute beginner learner. Think of language appropriate for a **first-grade reading level (e.g., for a 6-7 year old child learning to read or learning a second language from scratch).** Prioritize very common, high-frequency words and simple sentence structures.
 +IMPORTANT: Your generated output for a single TARGET SENTENCE should be one continuous block of text containing all the required '::' sections. DO NOT include the literal string 'END_SENTENCE' anywhere within this block of text you generate; the 'END_SENTENCE' marker is only used externally to separate distinct, fully-formed blocks in the final combined file.
 
----
-PRECEDING CONTEXT:
-{preceding_context}
----
-TARGET SENTENCE (This is the English sentence from the source text you need to process):
-"{source_sentence}"
----
-SUCCEEDING CONTEXT:
-{succeeding_context}
----
-
 The output block for the TARGET SENTENCE MUST strictly follow this format and include all sections, even if some are empty or placeholders.
 Pay EXTREME attention to the lemmatization rules for SimSL and AdvSL.
 
@@ -145,115 +196,452 @@ END_SENTENCE //This line should not be output by you. It will be added by an ext
 // (The LLM's output for the TARGET SENTENCE block should conclude after the last section like DIGLOT_MAP or LOCKED_PHRASE. Do not add an "END_SENTENCE" line yourself.)
 """
 
-def load_project_config(config_path_str="config.toml"):
+USER_PROMPT_TEMPLATE = """---
+PRECEDING CONTEXT:
+{preceding_context}
+---
+TARGET SENTENCE (This is the English sentence from the source text you need to process):
+"{source_sentence}"
+---
+SUCCEEDING CONTEXT:
+{succeeding_context}
+---
+"""
+# Split once at import so each prompt is built by concatenation instead of re-parsing the template with str.format
+_USER_PROMPT_HEAD, _, _USER_PROMPT_REST = USER_PROMPT_TEMPLATE.partition("{preceding_context}")
+_USER_PROMPT_MID1, _, _USER_PROMPT_REST = _USER_PROMPT_REST.partition("{source_sentence}")
+_USER_PROMPT_MID2, _, _USER_PROMPT_TAIL = _USER_PROMPT_REST.partition("{succeeding_context}")
+
+# Used when several consecutive sentences go out in one request (--batch_size > 1). Each target becomes one
+# block of the response; blocks that fail validate_llm_batch_block are redone with the single-sentence prompt.
+BATCH_USER_PROMPT_TEMPLATE = """---
+PRECEDING CONTEXT:
+{preceding_context}
+---
+TARGET SENTENCES (These are consecutive English sentences from the source text you need to process. Produce one complete output block for EACH target, in the order given. Put a line containing only END_SENTENCE after each block; for this request that overrides the instruction not to output END_SENTENCE. Each target's following targets serve as its succeeding context.):
+{target_sentences}
+---
+SUCCEEDING CONTEXT:
+{succeeding_context}
+---
+"""
+
+# Put in front of the original user prompt when the previous output failed validation
+CORRECTIVE_PROMPT_PREFIX = ("PREVIOUS ATTEMPT FAILED VALIDATION. PLEASE PAY EXTREME ATTENTION TO THE REQUIRED OUTPUT FORMAT. "
+                            "Specifically, ensure all sections are present and correctly formatted. Previous errors: ")
+CORRECTIVE_PROMPT_SUFFIX = "\n---\n"
+
+def is_llm_placeholder(llm_output: str) -> bool:
+    """True for the '// LLM_...' stand-ins this script writes when no real output was obtained."""
+    return llm_output.startswith("// LLM_")
+
+def build_user_prompt(preceding_context: str, source_sentence: str, succeeding_context: str) -> str:
+    """Same result as USER_PROMPT_TEMPLATE.format(...) with these three fields."""
+    return "".join((_USER_PROMPT_HEAD, preceding_context, _USER_PROMPT_MID1, source_sentence,
+                    _USER_PROMPT_MID2, succeeding_context, _USER_PROMPT_TAIL))
+
+def build_batch_user_prompt(preceding_context: str, source_sentences: List[str], succeeding_context: str) -> str:
+    target_lines = "\n".join(f'TARGET {i}: "{sentence}"' for i, sentence in enumerate(source_sentences, 1))
+    return BATCH_USER_PROMPT_TEMPLATE.format(preceding_context=preceding_context, target_sentences=target_lines,
+                                             succeeding_context=succeeding_context)
+
+def create_model_with_cached_system_prompt():
+    """Returns (model, context cache or None). The model carries STATIC_SYSTEM_PROMPT, preferably from a Gemini
+    context cache so the prefix isn't re-sent and re-billed per sentence. Falls back to a plain system instruction
+    when the cache can't be created (e.g. the prompt is below the model's minimum cacheable size). The caller keeps
+    the cache alive with keep_context_cache_alive and deletes it when the run ends."""
     try:
-        import tomllib # Python 3.11+
-        TOML_LOAD_MODE = "rb"
-        def load_toml_file(f): return tomllib.load(f)
-    except ImportError:
+        cached_content = genai.caching.CachedContent.create(
+            model=MODEL_NAME,
+            system_instruction=STATIC_SYSTEM_PROMPT,
+            ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS)
+        )
+        logger.info(f"Created Gemini context cache '{cached_content.name}' for the static prompt (TTL {CONTEXT_CACHE_TTL_SECONDS}s).")
+        return genai.GenerativeModel.from_cached_content(cached_content=cached_content), cached_content
+    except Exception as e:
+        logger.info(f"Gemini context cache unavailable ({e}); sending the static prompt as a system instruction.")
+        return genai.GenerativeModel(MODEL_NAME, system_instruction=STATIC_SYSTEM_PROMPT), None
+
+async def keep_context_cache_alive(cached_content):
+    """Renews the context cache's TTL every CONTEXT_CACHE_REFRESH_SECONDS until cancelled, so runs longer than
+    CONTEXT_CACHE_TTL_SECONDS keep using it."""
+    while True:
+        await asyncio.sleep(CONTEXT_CACHE_REFRESH_SECONDS)
         try:
-            import toml # Fallback: pip install toml
-            TOML_LOAD_MODE = "r"
-            def load_toml_file(f): return toml.load(f)
-            print("Using 'toml' library for config. Python 3.11+ with 'tomllib' is preferred.", file=sys.stderr)
-        except ImportError:
-            print("TOML library not found. Please install 'toml' (pip install toml) or use Python 3.11+.", file=sys.stderr)
-            return None
+            await asyncio.to_thread(cached_content.update, ttl=datetime.timedelta(seconds=CONTEXT_CACHE_TTL_SECONDS))
+            logger.debug(f"Renewed Gemini context cache '{cached_content.name}' (TTL {CONTEXT_CACHE_TTL_SECONDS}s).")
+        except Exception as e:
+            logger.warning(f"Could not renew Gemini context cache '{cached_content.name}': {e}")
+
+async def delete_context_cache(cached_content):
+    try:
+        await asyncio.to_thread(cached_content.delete)
+        logger.debug(f"Deleted Gemini context cache '{cached_content.name}'.")
+    except Exception as e:
+        logger.warning(f"Could not delete Gemini context cache '{cached_content.name}' (it expires on its own): {e}")
 
-    config_path = Path(config_path_str)
+def load_project_config(config_path_str="config.toml"):
+    return _load_project_config_cached(Path(config_path_str).resolve())
+
+@functools.lru_cache(maxsize=4)
+def _load_project_config_cached(config_path: Path):
+    if load_toml_file is None:
+        logger.error("TOML library not found. Please install 'toml' (pip install toml) or use Python 3.11+.")
+        return None
     if not config_path.is_file():
-        print(f"Error: Project configuration file '{config_path}' not found.", file=sys.stderr)
+        logger.error(f"Project configuration file '{config_path}' not found.")
         return None
     try:
         with open(config_path, TOML_LOAD_MODE) as f:
             config_data = load_toml_file(f)
         return config_data.get("content_project_dir")
     except Exception as e:
-        print(f"Error parsing TOML file '{config_path}': {e}", file=sys.stderr)
+        logger.error(f"Error parsing TOML file '{config_path}': {e}")
         return None
 
-def process_sentence_with_llm(source_sentence_text: str, preceding_context: str, succeeding_context: str,
-                              model, max_api_retries: int, max_validation_retries: int, 
-                              retry_delay: int) -> str:
-    
-    original_prompt_text = LLM_PROMPT_TEMPLATE.format(
-        preceding_context=preceding_context,
-        source_sentence=source_sentence_text,
-        succeeding_context=succeeding_context
-    )
-    current_prompt_to_send = original_prompt_text
+def item_source_digest(item: dict) -> str:
+    return hashlib.blake2b(f"{item['type']}\0{item['text']}".encode('utf-8'), digest_size=8).hexdigest()
 
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-    ]
-    # generation_config = genai.types.GenerationConfig(temperature=0.7) # Optional
+def load_existing_blocks(output_llm_file_path: Path, sources_file_path: Path, all_items: List[dict]) -> dict:
+    """Validated sentence blocks from a finished output whose source sentence is unchanged, by item index.
+    Lets a --force rerun keep those blocks instead of sending the sentences to the LLM again."""
+    try:
+        block_sources = json.loads(sources_file_path.read_text(encoding='utf-8'))["block_sources"]
+        existing_blocks = OUTPUT_BLOCK_SPLIT_REGEX.split(output_llm_file_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError, KeyError):
+        return {}
+    if len(existing_blocks) < len(block_sources): # Output and sidecar don't belong together
+        return {}
+    reusable_blocks = {}
+    for item_idx, (item, block_source, block) in enumerate(zip(all_items, block_sources, existing_blocks)):
+        if item["type"] != "sentence" or block_source != item_source_digest(item):
+            continue
+        block_core = block.rstrip("\n").removesuffix("END_SENTENCE")
+        if not validate_llm_block(block_core):
+            reusable_blocks[item_idx] = block
+    return reusable_blocks
+
+class RequestRateLimiter:
+    """Spaces API call starts at least 60/requests_per_minute seconds apart, shared by all concurrent sentences."""
+    def __init__(self, requests_per_minute: float):
+        self.min_interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.min_interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def back_off(self, delay_seconds: float):
+        """Holds every caller's next API call for delay_seconds, so one 429 pauses all in-flight sentences."""
+        self._next_slot = max(self._next_slot, time.monotonic() + delay_seconds)
+
+def rate_limit_backoff_seconds(error: Exception, retry_delay: float, api_attempt: int) -> float:
+    """The server's suggested delay if the error carries one, else capped exponential backoff with jitter."""
+    hint_match = RETRY_DELAY_HINT_REGEX.search(str(error))
+    if hint_match:
+        return float(hint_match.group(1) or hint_match.group(2))
+    return min(MAX_RATE_LIMIT_BACKOFF_SECONDS, retry_delay * (2**api_attempt)) * random.uniform(0.5, 1.5)
+
+class ResponseCache:
+    """Validated LLM outputs on disk, keyed by SHA-256 of (cache version, model, system prompt, user prompt).
+    Stored in one SQLite table (WAL mode) under cache_dir; writes are buffered and committed in batches.
+    With reuse_by_source, outputs are also filed under their source sentence alone, so a sentence that recurs
+    with different context (or after re-staging) reuses the earlier output instead of calling the LLM."""
+    def __init__(self, cache_dir: Path, model_name: str, system_prompt: str, reuse_by_source: bool = False):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.reuse_by_source = reuse_by_source
+        # Hash the fixed part of the key once; each lookup copies this state and adds the user prompt
+        self._key_prefix_hash = hashlib.sha256(f"{RESPONSE_CACHE_VERSION}\0{model_name}\0{system_prompt}\0".encode('utf-8'))
+        self._pending_writes = {} # key -> (created_at, payload) not yet in the database
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            # Autocommit mode; batches get an explicit transaction in flush(). Only the event loop thread uses it.
+            self._db = sqlite3.connect(cache_dir / RESPONSE_CACHE_DB_NAME, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses "
+                             "(key TEXT PRIMARY KEY, model TEXT, created_at INTEGER, payload BLOB)")
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Response cache unavailable at '{cache_dir}': {e}")
+            self._db = None
+
+    def _key_for(self, prompt_text: str) -> str:
+        key_hash = self._key_prefix_hash.copy()
+        key_hash.update(prompt_text.encode('utf-8'))
+        return key_hash.hexdigest()
+
+    def get(self, prompt_text: str) -> Optional[str]:
+        if self._db is None:
+            return None
+        key = self._key_for(prompt_text)
+        if key in self._pending_writes:
+            return self._pending_writes[key][1].decode('utf-8')
+        try:
+            row = self._db.execute("SELECT payload FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        cached_output = bytes(row[0]).decode('utf-8')
+        if validate_llm_block(cached_output): # Re-checked so entries from looser validator rules are not reused
+            return None
+        return cached_output
+
+    def put(self, prompt_text: str, validated_output: str):
+        if self._db is None:
+            return
+        self._pending_writes[self._key_for(prompt_text)] = (int(time.time()), validated_output.encode('utf-8'))
+        if len(self._pending_writes) >= RESPONSE_CACHE_WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self._db is None or not self._pending_writes:
+            return
+        rows = [(key, self.model_name, created_at, payload) for key, (created_at, payload) in self._pending_writes.items()]
+        self._pending_writes.clear()
+        try:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO responses (key, model, created_at, payload) VALUES (?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+        except sqlite3.Error as e:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+            logger.warning(f"Could not write {len(rows)} response cache entries: {e}")
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def _source_key(source_sentence_text: str) -> str:
+        # NUL can't occur in a prompt, so these keys never collide with prompt keys
+        return "\0SOURCE\0" + " ".join(unicodedata.normalize("NFC", source_sentence_text).split())
+
+    def get_for_source(self, source_sentence_text: str) -> Optional[str]:
+        return self.get(self._source_key(source_sentence_text)) if self.reuse_by_source else None
+
+    def put_for_source(self, source_sentence_text: str, validated_output: str):
+        if self.reuse_by_source:
+            self.put(self._source_key(source_sentence_text), validated_output)
+
+async def process_sentence_with_llm_async(source_sentence_text: str, preceding_context: str, succeeding_context: str,
+                                          model, max_api_retries: int, max_validation_retries: int, 
+                                          retry_delay: int, semaphore: asyncio.Semaphore,
+                                          rate_limiter: RequestRateLimiter, log_label: str,
+                                          response_cache: Optional[ResponseCache] = None,
+                                          stream_responses: bool = False) -> str:
+    original_prompt_text = build_user_prompt(preceding_context, source_sentence_text, succeeding_context)
+    if response_cache is not None:
+        cached_output = response_cache.get(original_prompt_text)
+        if cached_output is not None:
+            logger.debug(f"Using cached LLM output ({log_label}): '{source_sentence_text[:60]}...'")
+            return cached_output
+        cached_output = response_cache.get_for_source(source_sentence_text)
+        if cached_output is not None:
+            logger.debug(f"Using cached LLM output for the same sentence in another context ({log_label}): '{source_sentence_text[:60]}...'")
+            return cached_output
+
+    async with semaphore:
+        logger.debug(f"Sending to LLM ({log_label}): '{source_sentence_text[:60]}...'")
+        return await _process_sentence_with_llm_locked(
+            source_sentence_text, original_prompt_text,
+            model, max_api_retries, max_validation_retries, retry_delay, rate_limiter, response_cache,
+            stream_responses
+        )
 
-    for validation_attempt in range(max_validation_retries):
-        raw_llm_output_core = None # The LLM's response text before END_SENTENCE is managed
-        
-        for api_attempt in range(max_api_retries):
-            try:
-                # print(f"    DEBUG: Sending (API Attempt {api_attempt+1}, Val Attempt {validation_attempt+1}):\n{current_prompt_to_send[:350]}...")
-                response = model.generate_content(current_prompt_to_send, safety_settings=safety_settings)
-                
-                if not response.parts:
-                    reason = "Unknown reason, empty parts list in response."
-                    if response.prompt_feedback and response.prompt_feedback.block_reason:
-                        reason = response.prompt_feedback.block_reason_message or str(response.prompt_feedback.block_reason)
-                    print(f"  LLM Warning (API Attempt {api_attempt+1}): Prompt for '{source_sentence_text[:50]}...' blocked or empty. Reason: {reason}", file=sys.stderr)
-                    if response.prompt_feedback and response.prompt_feedback.block_reason:
-                        raw_llm_output_core = f"// LLM_BLOCKED_OR_EMPTY_RESPONSE (Reason: {reason}) FOR_SOURCE: {source_sentence_text}"
-                        break # Break API retry loop for this validation attempt
-                
-                if response.text:
-                    raw_llm_output_core = response.text.strip()
-                    break # Successful API call and got text
-                else: # No .text attribute but response.parts was not empty
-                    print(f"  LLM Warning (API Attempt {api_attempt+1}): Response for '{source_sentence_text[:50]}...' has no .text. Parts: {response.parts}", file=sys.stderr)
-                
-                if api_attempt + 1 < max_api_retries: time.sleep(retry_delay)
-
-            except Exception as e:
-                print(f"  LLM API Error (API Attempt {api_attempt + 1}/{max_api_retries}) for '{source_sentence_text[:50]}...': {e}", file=sys.stderr)
-                if "429" in str(e) or "resource_exhausted" in str(e).lower() or "model_unavailable" in str(e).lower() or "quota" in str(e).lower():
-                    effective_delay = retry_delay * (2**api_attempt)
-                    print(f"  Retrying API call in {effective_delay} seconds...", file=sys.stderr)
-                    time.sleep(effective_delay)
-                elif api_attempt + 1 == max_api_retries:
-                    raw_llm_output_core = f"// LLM_API_ERROR_MAX_RETRIES_FOR_SOURCE: {source_sentence_text}"
-                    break 
-                else:
-                    time.sleep(retry_delay)
+async def process_sentence_batch_with_llm_async(batch_items: List[tuple], model, max_api_retries: int,
+                                                max_validation_retries: int, retry_delay: int,
+                                                semaphore: asyncio.Semaphore, rate_limiter: RequestRateLimiter,
+                                                log_label: str, response_cache: Optional[ResponseCache] = None,
+                                                stream_responses: bool = False) -> List[str]:
+    """batch_items are consecutive (source_sentence, preceding_context, succeeding_context) tuples. They go out
+    in one request; any sentence whose block is missing or fails validation is redone on its own."""
+    if len(batch_items) == 1:
+        source_sentence_text, preceding_context, succeeding_context = batch_items[0]
+        return [await process_sentence_with_llm_async(
+            source_sentence_text, preceding_context, succeeding_context, model, max_api_retries,
+            max_validation_retries, retry_delay, semaphore, rate_limiter, log_label, response_cache,
+            stream_responses
+        )]
+
+    source_sentences = [item[0] for item in batch_items]
+    batch_prompt_text = build_batch_user_prompt(batch_items[0][1], source_sentences, batch_items[-1][2])
+    block_cache_keys = [f"{batch_prompt_text}\0{i}" for i in range(len(batch_items))]
+    if response_cache is not None:
+        cached_outputs = [response_cache.get(key) or response_cache.get_for_source(source)
+                          for key, source in zip(block_cache_keys, source_sentences)]
+        if all(cached_output is not None for cached_output in cached_outputs):
+            logger.debug(f"Using cached LLM output ({log_label}): batch of {len(batch_items)} from '{source_sentences[0][:60]}...'")
+            return cached_outputs
+
+    async with semaphore:
+        logger.debug(f"Sending to LLM ({log_label}): batch of {len(batch_items)} from '{source_sentences[0][:60]}...'")
+        raw_batch_output, _ = await _generate_with_api_retries(
+            batch_prompt_text, source_sentences[0], model, max_api_retries, retry_delay, rate_limiter
+        )
+
+    if not raw_batch_output or is_llm_placeholder(raw_batch_output):
+        blocks, errors_per_block = [""] * len(batch_items), [["No usable batch output."]] * len(batch_items)
+    else:
+        blocks, errors_per_block = validate_llm_batch_block(raw_batch_output, len(batch_items))
+
+    batch_outputs: List[Optional[str]] = []
+    failed_indices = []
+    for i, (block, block_errors) in enumerate(zip(blocks, errors_per_block)):
+        if block_errors:
+            batch_outputs.append(None)
+            failed_indices.append(i)
+        else:
+            batch_outputs.append(block)
+            if response_cache is not None:
+                response_cache.put(block_cache_keys[i], block)
+                response_cache.put_for_source(source_sentences[i], block)
+
+    if failed_indices:
+        logger.warning(f"{len(failed_indices)} of {len(batch_items)} blocks in batch ({log_label}) unusable ({errors_per_block[failed_indices[0]][0]}); retrying them one sentence at a time.")
+        single_outputs = await asyncio.gather(*(
+            process_sentence_with_llm_async(
+                batch_items[i][0], batch_items[i][1], batch_items[i][2], model, max_api_retries,
+                max_validation_retries, retry_delay, semaphore, rate_limiter, f"{log_label} #{i + 1}", response_cache,
+                stream_responses
+            ) for i in failed_indices
+        ))
+        for i, single_output in zip(failed_indices, single_outputs):
+            batch_outputs[i] = single_output
+    return batch_outputs
+
+async def _close_stream(response, chunk_iterator) -> None:
+    """Stops reading an abandoned streamed response: closes the chunk iterator and the SDK's stream
+    from the API under it (cancelling the call where the transport allows), so nothing more is received."""
+    for stream_source in (chunk_iterator, getattr(response, "_iterator", None)):
+        close = getattr(stream_source, "aclose", None) or getattr(stream_source, "cancel", None)
+        if close is None: continue
+        try:
+            closed = close()
+            if asyncio.iscoroutine(closed): await closed
+        except Exception as e:
+            logger.debug(f"Error closing an abandoned response stream: {e}")
+
+async def _read_streamed_response(response) -> tuple:
+    """Consumes a streamed response chunk by chunk. Returns (text so far, early_stop_error): the validation
+    error that stopped the read, after closing the stream, or None when the whole stream was read; response
+    then also carries the aggregated text, parts, feedback and usage like a non-streamed one."""
+    streamed_text = ""
+    chunk_iterator = response.__aiter__()
+    async for chunk in chunk_iterator:
+        if chunk.parts:
+            streamed_text += chunk.text
+            early_stop_error = streamed_block_error(streamed_text)
+            if early_stop_error is not None:
+                await _close_stream(response, chunk_iterator)
+                return streamed_text, early_stop_error
+    return streamed_text, None
+
+async def _generate_with_api_retries(prompt_to_send: str, source_sentence_text: str, model,
+                                     max_api_retries: int, retry_delay: int,
+                                     rate_limiter: RequestRateLimiter, stream: bool = False) -> Tuple[Optional[str], Optional[str]]:
+    """Sends one prompt, retrying API failures. Returns (text, early_stop_error): the response text, a '// LLM_...'
+    placeholder if the prompt was blocked or every attempt errored, or None if no text came back. With stream,
+    the prompt must be for a single block: the response is read as it arrives and dropped early once it can no
+    longer validate, and early_stop_error is then the error that showed it; otherwise it is None."""
+    raw_llm_output_core = None # The LLM's response text before END_SENTENCE is managed
+    for api_attempt in range(max_api_retries):
+        try:
+            logger.debug(f"Sending (API Attempt {api_attempt+1}):\n{prompt_to_send[:350]}...")
+            await rate_limiter.wait()
+            if stream:
+                response = await model.generate_content_async(prompt_to_send, safety_settings=SAFETY_SETTINGS, stream=True)
+                streamed_text, early_stop_error = await _read_streamed_response(response)
+                if early_stop_error is not None: # Only this error goes to the corrective retry, not the partial text's gaps
+                    logger.debug(f"Stopped reading the streamed response for '{source_sentence_text[:50]}...' early: {early_stop_error}")
+                    return streamed_text.strip(), early_stop_error
+            else:
+                response = await model.generate_content_async(prompt_to_send, safety_settings=SAFETY_SETTINGS)
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                PROMPT_TOKEN_USAGE["prompt"] += usage.prompt_token_count or 0
+                PROMPT_TOKEN_USAGE["cached"] += usage.cached_content_token_count or 0
             
-            if raw_llm_output_core and raw_llm_output_core.startswith("// LLM_BLOCKED"):
+            if not response.parts:
+                reason = "Unknown reason, empty parts list in response."
+                if response.prompt_feedback and response.prompt_feedback.block_reason:
+                    reason = response.prompt_feedback.block_reason_message or str(response.prompt_feedback.block_reason)
+                logger.warning(f"LLM Warning (API Attempt {api_attempt+1}): Prompt for '{source_sentence_text[:50]}...' blocked or empty. Reason: {reason}")
+                if response.prompt_feedback and response.prompt_feedback.block_reason:
+                    raw_llm_output_core = f"// LLM_BLOCKED_OR_EMPTY_RESPONSE (Reason: {reason}) FOR_SOURCE: {source_sentence_text}"
+                    break # Break API retry loop
+            
+            if response.text:
+                raw_llm_output_core = response.text.strip()
+                break # Successful API call and got text
+            else: # No .text attribute but response.parts was not empty
+                logger.warning(f"LLM Warning (API Attempt {api_attempt+1}): Response for '{source_sentence_text[:50]}...' has no .text. Parts: {response.parts}")
+            
+            if api_attempt + 1 < max_api_retries: await asyncio.sleep(retry_delay)
+
+        except Exception as e:
+            logger.warning(f"LLM API Error (API Attempt {api_attempt + 1}/{max_api_retries}) for '{source_sentence_text[:50]}...': {e}")
+            if "429" in str(e) or "resource_exhausted" in str(e).lower() or "model_unavailable" in str(e).lower() or "quota" in str(e).lower():
+                effective_delay = rate_limit_backoff_seconds(e, retry_delay, api_attempt)
+                logger.warning(f"Retrying API call in {effective_delay:.1f} seconds...")
+                rate_limiter.back_off(effective_delay) # The next rate_limiter.wait() here, and in every sibling, honours it
+            elif api_attempt + 1 == max_api_retries:
+                raw_llm_output_core = f"// LLM_API_ERROR_MAX_RETRIES_FOR_SOURCE: {source_sentence_text}"
                 break 
-        # End of API retry loop for this validation attempt
-
-        if not raw_llm_output_core: 
-            raw_llm_output_core = f"// LLM_NO_OUTPUT_AFTER_API_RETRIES_FOR_SOURCE: {source_sentence_text}"
-            return raw_llm_output_core + "\nEND_SENTENCE\n" 
+            else:
+                await asyncio.sleep(retry_delay)
+        
+        if raw_llm_output_core and raw_llm_output_core.startswith("// LLM_BLOCKED"):
+            break 
+    return raw_llm_output_core, None
+
+async def _process_sentence_with_llm_locked(source_sentence_text: str, original_prompt_text: str,
+                                            model, max_api_retries: int, max_validation_retries: int, 
+                                            retry_delay: int, rate_limiter: RequestRateLimiter,
+                                            response_cache: Optional[ResponseCache],
+                                            stream_responses: bool = False) -> str:
+    current_prompt_to_send = original_prompt_text
 
-        if raw_llm_output_core.startswith("// LLM_BLOCKED"): # Or other critical API failure placeholders
-            return raw_llm_output_core + "\nEND_SENTENCE\n"
+    for validation_attempt in range(max_validation_retries):
+        raw_llm_output_core, early_stop_error = await _generate_with_api_retries(
+            current_prompt_to_send, source_sentence_text, model, max_api_retries, retry_delay, rate_limiter,
+            stream=stream_responses
+        )
 
-        validation_errors = validate_llm_block(raw_llm_output_core)
-        if not validation_errors:
-            return raw_llm_output_core # Script will append END_SENTENCE
+        if early_stop_error is not None: # A stream dropped part-way: the rest of the block was never received
+            validation_errors = [early_stop_error]
+        else:
+            if not raw_llm_output_core: 
+                raw_llm_output_core = f"// LLM_NO_OUTPUT_AFTER_API_RETRIES_FOR_SOURCE: {source_sentence_text}"
+                return raw_llm_output_core + "\nEND_SENTENCE\n" 
+
+            if raw_llm_output_core.startswith("// LLM_BLOCKED"):
+                return raw_llm_output_core + "\nEND_SENTENCE\n"
+            if is_llm_placeholder(raw_llm_output_core): # API errors exhausted the retries; a corrective prompt won't help
+                return raw_llm_output_core
+
+            validation_errors = validate_llm_block(raw_llm_output_core)
+            if not validation_errors:
+                if response_cache is not None:
+                    response_cache.put(original_prompt_text, raw_llm_output_core)
+                    response_cache.put_for_source(source_sentence_text, raw_llm_output_core)
+                return raw_llm_output_core # Script will append END_SENTENCE
         
         error_details = "; ".join(validation_errors)
-        print(f"  LLM Output Validation Failed (Attempt {validation_attempt+1}/{max_validation_retries}) for '{source_sentence_text[:50]}...': {error_details}", file=sys.stderr)
+        logger.warning(f"LLM Output Validation Failed (Attempt {validation_attempt+1}/{max_validation_retries}) for '{source_sentence_text[:50]}...': {error_details}")
 
         if validation_attempt + 1 < max_validation_retries:
-            corrective_instruction = (
-                "PREVIOUS ATTEMPT FAILED VALIDATION. PLEASE PAY EXTREME ATTENTION TO THE REQUIRED OUTPUT FORMAT. "
-                f"Specifically, ensure all sections are present and correctly formatted. Previous errors: {error_details}\n---\n"
-            )
-            current_prompt_to_send = corrective_instruction + original_prompt_text
-            print(f"  Retrying with corrective prompt (Validation Attempt {validation_attempt+2}).")
-            time.sleep(retry_delay) 
+            current_prompt_to_send = f"{CORRECTIVE_PROMPT_PREFIX}{error_details}{CORRECTIVE_PROMPT_SUFFIX}{original_prompt_text}"
+            logger.info(f"Retrying with corrective prompt (Validation Attempt {validation_attempt+2}).")
+            await asyncio.sleep(retry_delay) 
         else: # Max validation retries reached
             return f"// LLM_OUTPUT_VALIDATION_FAILED_MAX_RETRIES (Errors: {error_details}) FOR_SOURCE: {source_sentence_text}"
 
@@ -261,131 +649,215 @@ def process_sentence_with_llm(source_sentence_text: str, preceding_context: str,
     return f"// LLM_PROCESSING_FAILED_UNEXPECTEDLY_IN_VALIDATION_LOOP_FOR_SOURCE: {source_sentence_text}"
 
 
-def process_book_file(staged_file_path: Path, llm_output_dir: Path, model, args,
-                      num_context_sentences: int, item_limit: Optional[int]):
+async def process_book_file_async(staged_file_path: Path, llm_output_dir: Path, model, args,
+                                  num_context_sentences: int, item_limit: Optional[int],
+                                  semaphore: asyncio.Semaphore, rate_limiter: RequestRateLimiter,
+                                  response_cache: Optional[ResponseCache] = None):
     book_name_stem = staged_file_path.stem
+    book_logger = logger.getChild(book_name_stem) # Log lines from concurrent books carry the book's name
     output_llm_file_path = llm_output_dir / f"{book_name_stem}.llm.txt"
-
-    if not args.force and output_llm_file_path.exists() and item_limit is None:
-        print(f"Skipping '{staged_file_path.name}': Output file '{output_llm_file_path.name}' already exists (and not in limit/force mode).")
+    # Blocks are appended to the output as they complete, and this sidecar records how many items are on disk and
+    # how many bytes of the output they fill. It is removed once the file is finished, so an output with a sidecar is
+    # a partial one to resume; anything past the recorded length is a block whose progress was never recorded.
+    progress_file_path = output_llm_file_path.with_suffix(PROGRESS_FILE_SUFFIX)
+    can_resume = not args.force and item_limit is None and progress_file_path.exists()
+    sources_file_path = output_llm_file_path.with_suffix(SOURCES_FILE_SUFFIX)
+
+    if not args.force and output_llm_file_path.exists() and item_limit is None and not can_resume:
+        book_logger.info(f"Skipping '{staged_file_path.name}': Output file '{output_llm_file_path.name}' already exists (and not in limit/force mode).")
         return True, True 
 
-    print(f"Processing '{staged_file_path.name}'...")
+    book_logger.info(f"Processing '{staged_file_path.name}'...")
     
     try:
-        with open(staged_file_path, 'r', encoding='utf-8') as f_in:
-            raw_lines_from_staged_file = f_in.readlines()
+        # One read; STAGED_LINE_REGEX then walks the whole text, with only "\n" separating items, as with readlines()
+        staged_text = staged_file_path.read_text(encoding='utf-8')
     except Exception as e:
-        print(f"Error reading input file '{staged_file_path.name}': {e}", file=sys.stderr)
+        book_logger.error(f"Error reading input file '{staged_file_path.name}': {e}")
         return False, False
 
-    all_items: List[dict] = [] # Stores {"type": "marker"|"sentence", "text": "..."}
-    for line_raw in raw_lines_from_staged_file:
-        line = line_raw.strip()
-        chapter_match = CHAPTER_MARKER_REGEX.match(line)
-        if chapter_match:
-            all_items.append({"type": "marker", "text": chapter_match.group(1).strip()})
-        else:
-            sentence_match = SENTENCE_LINE_REGEX.match(line)
-            if sentence_match:
-                all_items.append({"type": "sentence", "text": sentence_match.group(1).strip()})
+    # Stores {"type": "marker"|"sentence", "text": "..."}; lastgroup is "marker" or "sentence"
+    all_items: List[dict] = [{"type": line_match.lastgroup, "text": line_match.group(line_match.lastgroup)}
+                             for line_match in STAGED_LINE_REGEX.finditer(staged_text)]
 
     if not all_items:
-        print(f"No processable items (%%CHAPTER_MARKER%% or {{S...}}) found in '{staged_file_path.name}'.", file=sys.stderr)
+        book_logger.warning(f"No processable items (%%CHAPTER_MARKER%% or {{S...}}) found in '{staged_file_path.name}'.")
         if item_limit is None or item_limit >= 0 : # Write placeholder if we intended to process or limit=0
              try:
                 llm_output_dir.mkdir(parents=True, exist_ok=True)
                 with open(output_llm_file_path, 'w', encoding='utf-8') as f_out: f_out.write("// NO_PROCESSABLE_ITEMS_IN_SOURCE_FILE\nEND_SENTENCE\n")
-                print(f"Wrote placeholder output file '{output_llm_file_path.name}'.")
+                progress_file_path.unlink(missing_ok=True)
+                book_logger.info(f"Wrote placeholder output file '{output_llm_file_path.name}'.")
              except Exception as e_write:
-                print(f"Error writing placeholder output file: {e_write}", file=sys.stderr)
+                book_logger.error(f"Error writing placeholder output file: {e_write}")
                 return False, False
         return False, True 
 
     num_items_to_output_in_file = len(all_items)
     if item_limit is not None:
         num_items_to_output_in_file = min(item_limit, len(all_items))
-        print(f"  Limiting output to the first {num_items_to_output_in_file} items (markers or sentences) for this run.")
-
-    all_output_blocks_for_book: List[str] = []
-    llm_calls_made_this_file = 0
+        book_logger.info(f"Limiting output to the first {num_items_to_output_in_file} items (markers or sentences) for this run.")
 
-    for current_item_idx in range(num_items_to_output_in_file):
+    items_already_written = 0
+    if can_resume and output_llm_file_path.exists():
+        try:
+            progress = json.loads(progress_file_path.read_text(encoding='utf-8'))
+            if progress.get("source_items") == len(all_items):
+                items_already_written = min(int(progress.get("items_written", 0)), num_items_to_output_in_file)
+                recorded_output_bytes = progress.get("output_bytes")
+                if items_already_written and recorded_output_bytes is not None:
+                    if output_llm_file_path.stat().st_size < recorded_output_bytes:
+                        book_logger.warning(f"'{output_llm_file_path.name}' is shorter than its progress file records; starting over.")
+                        items_already_written = 0
+                    else: # Drops a block written just before a crash, which would otherwise be repeated
+                        os.truncate(output_llm_file_path, int(recorded_output_bytes))
+            else:
+                book_logger.warning(f"Progress file '{progress_file_path.name}' is for a different version of this book; starting over.")
+        except (OSError, ValueError) as e:
+            book_logger.warning(f"Could not read progress file '{progress_file_path.name}' ({e}); starting over.")
+    if items_already_written:
+        book_logger.info(f"Resuming after {items_already_written} items already in '{output_llm_file_path.name}'.")
+    reusable_blocks = load_existing_blocks(output_llm_file_path, sources_file_path, all_items) if args.force else {}
+
+    all_output_blocks_for_book: List[Optional[str]] = []
+    block_item_indices: List[int] = [] # Item index each block in all_output_blocks_for_book came from
+    sentence_jobs = [] # (positions in all_output_blocks_for_book, pending LLM call for that batch); run concurrently below
+    pending_batch = [] # (position, item index, (sentence, preceding context, succeeding context)) not yet in a job
+    batch_size = max(1, args.batch_size)
+
+    def queue_pending_batch():
+        if not pending_batch: return
+        first_item_num, last_item_num = pending_batch[0][1] + 1, pending_batch[-1][1] + 1
+        item_range = f"{first_item_num}" if first_item_num == last_item_num else f"{first_item_num}-{last_item_num}"
+        sentence_jobs.append(([block_pos for block_pos, _, _ in pending_batch], process_sentence_batch_with_llm_async(
+            [batch_item for _, _, batch_item in pending_batch],
+            model, args.max_api_retries, args.max_validation_retries,
+            DEFAULT_RETRY_DELAY_SECONDS, semaphore, rate_limiter,
+            f"{book_name_stem} {item_range}/{num_items_to_output_in_file}", response_cache,
+            args.stream_responses
+        )))
+        pending_batch.clear()
+
+    sentence_text_by_item = [item["text"] if item["type"] == "sentence" else None for item in all_items]
+    # The succeeding window of item i is the preceding window of item i + 1 + num_context_sentences, so each
+    # joined window is kept until that second use instead of being rebuilt. Keyed by (start, stop) item slice.
+    joined_context_windows: dict = {}
+
+    def context_window(start: int, stop: int, reuse_later: bool) -> str:
+        window_key = (start, stop)
+        joined = joined_context_windows.pop(window_key, None)
+        if joined is None:
+            joined = "\n".join(text for text in sentence_text_by_item[start:stop] if text is not None)
+        if reuse_later:
+            joined_context_windows[window_key] = joined
+        return joined
+
+    def reuses_succeeding_window(later_item_idx: int) -> bool:
+        # Only worth keeping if that later item will be sent to the LLM in this run
+        return (num_context_sentences > 0 and later_item_idx < num_items_to_output_in_file
+                and sentence_text_by_item[later_item_idx] is not None and later_item_idx not in reusable_blocks)
+
+    for current_item_idx in range(items_already_written, num_items_to_output_in_file):
         item_data = all_items[current_item_idx]
         item_type = item_data["type"]
         item_text = item_data["text"]
 
         if item_type == "marker":
+            queue_pending_batch() # Batches never span a chapter marker
             marker_block = f"CHAPTER_MARKER_DIRECT:: {item_text}\nEND_SENTENCE\n"
             all_output_blocks_for_book.append(marker_block)
-            print(f"  Writing direct chapter marker ({current_item_idx + 1}/{num_items_to_output_in_file}): '{item_text[:60]}...'")
+            block_item_indices.append(current_item_idx)
+            book_logger.debug(f"Writing direct chapter marker ({current_item_idx + 1}/{num_items_to_output_in_file}): '{item_text[:60]}...'")
         
+        elif item_type == "sentence" and current_item_idx in reusable_blocks:
+            queue_pending_batch()
+            all_output_blocks_for_book.append(reusable_blocks.pop(current_item_idx))
+            block_item_indices.append(current_item_idx)
+            book_logger.debug(f"Keeping existing validated block ({current_item_idx + 1}/{num_items_to_output_in_file}): '{item_text[:60]}...'")
+
         elif item_type == "sentence":
             target_sentence_text = item_text
             
-            preceding_sentences = []
-            for k_offset in range(1, num_context_sentences + 1):
-                prev_idx = current_item_idx - k_offset
-                if prev_idx >= 0 and all_items[prev_idx]["type"] == "sentence":
-                    preceding_sentences.insert(0, all_items[prev_idx]["text"])
-                elif prev_idx < 0: break
-            preceding_context_str = "\n".join(preceding_sentences) if preceding_sentences else "[NO PRECEDING CONTEXT]"
-
-            succeeding_sentences = []
-            for k_offset in range(1, num_context_sentences + 1):
-                next_idx = current_item_idx + k_offset
-                if next_idx < len(all_items) and all_items[next_idx]["type"] == "sentence":
-                    succeeding_sentences.append(all_items[next_idx]["text"])
-                elif next_idx >= len(all_items): break
-            succeeding_context_str = "\n".join(succeeding_sentences) if succeeding_sentences else "[NO SUCCEEDING CONTEXT]"
-            
-            print(f"  Sending to LLM ({current_item_idx + 1}/{num_items_to_output_in_file}): '{target_sentence_text[:60]}...'")
-            
-            llm_output_core = process_sentence_with_llm(
-                target_sentence_text, preceding_context_str, succeeding_context_str,
-                model, args.max_api_retries, args.max_validation_retries,
-                DEFAULT_RETRY_DELAY_SECONDS
-            )
-            llm_calls_made_this_file +=1
-            
-            all_output_blocks_for_book.append(llm_output_core.strip() + "\nEND_SENTENCE\n") # Append END_SENTENCE
+            # Context is the sentences among the num_context_sentences items on each side (markers use up a slot)
+            preceding_context_str = context_window(max(0, current_item_idx - num_context_sentences), current_item_idx,
+                                                   reuse_later=False) or "[NO PRECEDING CONTEXT]"
+            succeeding_context_str = context_window(current_item_idx + 1, min(len(all_items), current_item_idx + 1 + num_context_sentences),
+                                                    reuse_later=reuses_succeeding_window(current_item_idx + 1 + num_context_sentences)) or "[NO SUCCEEDING CONTEXT]"
             
-            if num_items_to_output_in_file > 0 : 
-                 time.sleep(API_CALL_DELAY_SECONDS)
-    
+            all_output_blocks_for_book.append(None) # Filled in, in source order, once the LLM call completes
+            block_item_indices.append(current_item_idx)
+            pending_batch.append((len(all_output_blocks_for_book) - 1, current_item_idx,
+                                  (target_sentence_text, preceding_context_str, succeeding_context_str)))
+            if len(pending_batch) == batch_size:
+                queue_pending_batch()
+    queue_pending_batch()
+
+    # The semaphore bounds how many requests are in flight. Every batch starts now; blocks are then written
+    # strictly in source order, each one as soon as it and everything before it are done.
+    job_tasks = [asyncio.ensure_future(llm_call) for _, llm_call in sentence_jobs]
+    job_index_for_block = {block_pos: job_idx for job_idx, (block_positions, _) in enumerate(sentence_jobs)
+                           for block_pos in block_positions}
+    llm_calls_made_this_file = len(sentence_jobs)
+    blocks_written_this_run = 0
+    last_progress_log_time = time.monotonic()
+    tail_blocks = []
     if item_limit is not None and num_items_to_output_in_file < len(all_items):
-        all_output_blocks_for_book.append(f"// --- OUTPUT_LIMITED_TO_FIRST_{num_items_to_output_in_file}_ITEMS (markers or sentences) --- //\nEND_SENTENCE\n")
+        tail_blocks.append(f"// --- OUTPUT_LIMITED_TO_FIRST_{num_items_to_output_in_file}_ITEMS (markers or sentences) --- //\nEND_SENTENCE\n")
     elif item_limit == 0 and len(all_items) > 0 :
-         all_output_blocks_for_book.append(f"// --- OUTPUT_LIMITED_TO_0_ITEMS (NO LLM CALLS MADE, NO MARKERS WRITTEN) --- //\nEND_SENTENCE\n")
+         tail_blocks.append(f"// --- OUTPUT_LIMITED_TO_0_ITEMS (NO LLM CALLS MADE, NO MARKERS WRITTEN) --- //\nEND_SENTENCE\n")
 
     try:
         llm_output_dir.mkdir(parents=True, exist_ok=True)
-        with open(output_llm_file_path, 'w', encoding='utf-8') as f_out:
-            if not all_output_blocks_for_book :
-                 if item_limit == 0 and len(all_items) > 0:
-                     f_out.write(f"// --- OUTPUT_LIMITED_TO_0_ITEMS --- //\nEND_SENTENCE\n")
-                 else:
-                     f_out.write(f"// NO_OUTPUT_BLOCKS_COLLECTED_FOR_FILE (items to output: {num_items_to_output_in_file})\nEND_SENTENCE\n")
-            else:
-                f_out.write("\n".join(all_output_blocks_for_book))
+        sources_file_path.unlink(missing_ok=True) # Stale as soon as the output is rewritten
+        with open(output_llm_file_path, 'a' if items_already_written else 'w', encoding='utf-8') as f_out:
+            def write_block(block: str, items_written: Optional[int] = None):
+                """Runs in a worker thread. Appends block and fsyncs it; then, given items_written, records that
+                and the output's length so far in the progress file, so a crash in between is undone on resume."""
+                if items_already_written or blocks_written_this_run: f_out.write("\n") # Blocks are separated by a blank line
+                f_out.write(block)
+                f_out.flush()
+                os.fsync(f_out.fileno())
+                if items_written is not None:
+                    progress_tmp_path = progress_file_path.with_name(progress_file_path.name + ".tmp")
+                    progress_tmp_path.write_text(json.dumps({"source_items": len(all_items), "items_written": items_written,
+                                                             "output_bytes": f_out.tell()}), encoding='utf-8')
+                    os.replace(progress_tmp_path, progress_file_path)
+
+            for block_pos in range(len(all_output_blocks_for_book)):
+                if all_output_blocks_for_book[block_pos] is None:
+                    job_idx = job_index_for_block[block_pos]
+                    batch_outputs = await job_tasks[job_idx]
+                    for filled_pos, llm_output_core in zip(sentence_jobs[job_idx][0], batch_outputs):
+                        all_output_blocks_for_book[filled_pos] = llm_output_core.strip() + "\nEND_SENTENCE\n" # Append END_SENTENCE
+                await asyncio.to_thread(write_block, all_output_blocks_for_book[block_pos], block_item_indices[block_pos] + 1)
+                all_output_blocks_for_book[block_pos] = "" # Written; drop the text
+                blocks_written_this_run += 1
+                if time.monotonic() - last_progress_log_time >= PROGRESS_LOG_INTERVAL_SECONDS:
+                    last_progress_log_time = time.monotonic()
+                    book_logger.info(f"{block_item_indices[block_pos] + 1}/{num_items_to_output_in_file} items written")
+
+            for tail_block in tail_blocks:
+                await asyncio.to_thread(write_block, tail_block)
+                blocks_written_this_run += 1
+            if not items_already_written and not blocks_written_this_run:
+                f_out.write(f"// NO_OUTPUT_BLOCKS_COLLECTED_FOR_FILE (items to output: {num_items_to_output_in_file})\nEND_SENTENCE\n")
+        sources_file_path.write_text(json.dumps({"block_sources": [item_source_digest(item) for item in all_items[:num_items_to_output_in_file]]}),
+                                     encoding='utf-8')
+        progress_file_path.unlink(missing_ok=True)
 
         if item_limit == 0:
-            print(f"Successfully wrote placeholder file (0 items processed) to '{output_llm_file_path.name}'")
+            book_logger.info(f"Successfully wrote placeholder file (0 items processed) to '{output_llm_file_path.name}'")
         else:
-            print(f"Successfully wrote {len(all_output_blocks_for_book)} blocks ({llm_calls_made_this_file} LLM calls) to '{output_llm_file_path.name}'")
+            book_logger.info(f"Successfully wrote {blocks_written_this_run} blocks ({llm_calls_made_this_file} LLM calls) to '{output_llm_file_path.name}'")
         return False, True
-    except Exception as e:
-        print(f"Error writing output file '{output_llm_file_path.name}': {e}", file=sys.stderr)
+    except OSError as e:
+        book_logger.error(f"Error writing output file '{output_llm_file_path.name}': {e}")
         return False, False
+    finally:
+        for job_task in job_tasks: # Only still pending if writing stopped early
+            job_task.cancel()
 
-def main():
-    dotenv_path = Path('.') / '.env'
-    if dotenv_path.is_file():
-        load_dotenv(dotenv_path=dotenv_path)
-        print(f"INFO: Attempted to load API key from '{dotenv_path.resolve()}'.")
-    else:
-        print(f"INFO: No .env file found at '{dotenv_path.resolve()}'.")
-
+async def main_async():
     parser = argparse.ArgumentParser(description="Process staged text files with an LLM to generate .llm.txt format.")
     parser.add_argument("--api_key", help="Google Gemini API Key. Overrides .env and GOOGLE_API_KEY env variable if provided.")
     parser.add_argument("--project_config", default="config.toml", help="Path to the project's main config.toml file.")
@@ -396,19 +868,49 @@ def main():
     parser.add_argument("--max_validation_retries", type=int, default=DEFAULT_MAX_VALIDATION_RETRIES, help=f"Max retries with corrective prompts if LLM output fails validation (default: {DEFAULT_MAX_VALIDATION_RETRIES}). Set to 1 for no corrective retries.")
     parser.add_argument("--context_sents", type=int, default=2, help="Number of preceding/succeeding sentences for context (default: 2).")
     parser.add_argument("--limit_items", type=int, default=None, help="Output only the first N items (markers or sentences) from each book. Default: process all. Use 0 to write placeholder files without LLM calls.")
+    parser.add_argument("--concurrent_requests", type=int, default=DEFAULT_CONCURRENT_REQUESTS, help=f"Max sentences sent to the LLM concurrently (default: {DEFAULT_CONCURRENT_REQUESTS}).")
+    parser.add_argument("--max_books_concurrency", type=int, default=DEFAULT_MAX_BOOKS_CONCURRENCY, help=f"Max book files processed at once (default: {DEFAULT_MAX_BOOKS_CONCURRENCY}).")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help=f"Consecutive sentences sent per API call; blocks that fail validation are retried singly (default: {DEFAULT_BATCH_SIZE}).")
+    parser.add_argument("--no_cache", action="store_true", help=f"Don't read or write the on-disk response cache ({RESPONSE_CACHE_DIR_NAME} in the content project).")
+    parser.add_argument("--sentence_cache", action="store_true", help="Also reuse a cached output when the same sentence (ignoring whitespace differences) was processed before with different context.")
+    parser.add_argument("--stream_responses", action="store_true", help="Stream single-sentence responses and stop reading one as soon as it can no longer pass validation, going straight to the corrective retry.")
+    parser.add_argument("--requests_per_minute", type=float, default=DEFAULT_REQUESTS_PER_MINUTE, help=f"Max API calls started per minute across all concurrent requests; 0 disables pacing (default: {DEFAULT_REQUESTS_PER_MINUTE}).")
+    parser.add_argument("--log_level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Logging level; DEBUG also logs every sentence sent to or served from cache (default: INFO).")
     
     args = parser.parse_args()
 
+    # Records go through a queue so concurrent sentences never block on the console; one listener thread writes them
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        handlers=[logging.handlers.QueueHandler(log_queue)]) # Root stays at WARNING for the SDK's loggers
+    logger.setLevel(args.log_level)
+    log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    log_listener.start()
+    try:
+        run_summary_lines = await process_all_books_async(args)
+    finally:
+        log_listener.stop() # Writes out every queued record first, so nothing logged lands after the summary
+    print("\n".join(run_summary_lines))
+
+async def process_all_books_async(args) -> List[str]:
+    """Runs the whole job; returns the end-of-run summary lines, which main_async prints once logging is flushed."""
+    dotenv_path = Path('.') / '.env'
+    if dotenv_path.is_file():
+        load_dotenv(dotenv_path=dotenv_path)
+        logger.info(f"Attempted to load API key from '{dotenv_path.resolve()}'.")
+    else:
+        logger.info(f"No .env file found at '{dotenv_path.resolve()}'.")
+
     api_key_to_use = None
     if args.api_key:
         api_key_to_use = args.api_key
-        print("INFO: Using API key from --api_key command-line argument.")
+        logger.info("Using API key from --api_key command-line argument.")
     elif os.getenv("GOOGLE_API_KEY"):
         api_key_to_use = os.getenv("GOOGLE_API_KEY")
-        print("INFO: Using API key from GOOGLE_API_KEY environment variable (could be from shell or .env).")
+        logger.info("Using API key from GOOGLE_API_KEY environment variable (could be from shell or .env).")
     
     if not api_key_to_use:
-        print("ERROR: API Key not provided. Set GOOGLE_API_KEY in your shell environment, in a .env file, or use the --api_key argument.", file=sys.stderr)
+        logger.error("API Key not provided. Set GOOGLE_API_KEY in your shell environment, in a .env file, or use the --api_key argument.")
         sys.exit(1)
 
     content_project_root_str = load_project_config(args.project_config)
@@ -419,53 +921,84 @@ def main():
     llm_output_dir = content_project_root / args.output_llm_subdir
 
     if not staged_input_dir.is_dir():
-        print(f"ERROR: Input directory '{staged_input_dir}' not found.", file=sys.stderr)
+        logger.error(f"Input directory '{staged_input_dir}' not found.")
         sys.exit(1)
 
     try:
         genai.configure(api_key=api_key_to_use)
-        model = genai.GenerativeModel(MODEL_NAME)
-        print(f"Successfully configured Gemini model: {MODEL_NAME}")
+        model, cached_content = create_model_with_cached_system_prompt()
+        logger.info(f"Successfully configured Gemini model: {MODEL_NAME}")
     except Exception as e:
-        print(f"ERROR configuring Gemini SDK: {e}", file=sys.stderr)
+        logger.error(f"Error configuring Gemini SDK: {e}")
         sys.exit(1)
 
+    context_cache_refresh_task = asyncio.create_task(keep_context_cache_alive(cached_content)) if cached_content is not None else None
+    try:
+        return await process_staged_files_async(args, model, content_project_root, staged_input_dir, llm_output_dir)
+    finally:
+        if context_cache_refresh_task is not None:
+            context_cache_refresh_task.cancel()
+            await delete_context_cache(cached_content)
+
+async def process_staged_files_async(args, model, content_project_root: Path, staged_input_dir: Path, llm_output_dir: Path) -> List[str]:
     staged_files_to_process = sorted([f for f in staged_input_dir.glob('*.txt') if not f.name.endswith('.junk.txt')])
     if not staged_files_to_process:
-        print(f"INFO: No suitable .txt files found in '{staged_input_dir}'.", file=sys.stderr)
+        logger.warning(f"No suitable .txt files found in '{staged_input_dir}'.")
         sys.exit(0)
     
-    print(f"Found {len(staged_files_to_process)} files to process in '{staged_input_dir}'.")
-    print(f"Output will be written to '{llm_output_dir}'.")
+    logger.info(f"Found {len(staged_files_to_process)} files to process in '{staged_input_dir}'.")
+    logger.info(f"Output will be written to '{llm_output_dir}'.")
     if args.limit_items is not None:
-        print(f"PROCESSING MODE: Output limited to --limit_items={args.limit_items} per file.")
-    print("---")
+        logger.info(f"PROCESSING MODE: Output limited to --limit_items={args.limit_items} per file.")
 
     total_successful_ops = 0
     total_skipped_ops = 0
     total_error_ops = 0
+    semaphore = asyncio.Semaphore(max(1, args.concurrent_requests))
+    rate_limiter = RequestRateLimiter(args.requests_per_minute)
+    response_cache = None if args.no_cache else ResponseCache(content_project_root / RESPONSE_CACHE_DIR_NAME, MODEL_NAME, STATIC_SYSTEM_PROMPT,
+                                                              reuse_by_source=args.sentence_cache)
+
+    # Books run concurrently but share one model, cache, semaphore and rate limiter, so the API load
+    # stays bounded by --concurrent_requests/--requests_per_minute however many books are in flight.
+    book_semaphore = asyncio.Semaphore(max(1, args.max_books_concurrency))
+
+    async def process_book_bounded(staged_file: Path):
+        async with book_semaphore:
+            book_result = await process_book_file_async(
+                staged_file, llm_output_dir, model, args,
+                num_context_sentences=args.context_sents,
+                item_limit=args.limit_items,
+                semaphore=semaphore, rate_limiter=rate_limiter, response_cache=response_cache
+            )
+            if response_cache is not None:
+                response_cache.flush()
+            logger.info(f"Finished '{staged_file.name}'")
+            return book_result
 
-    for staged_file in staged_files_to_process:
-        was_skipped, op_successful = process_book_file(
-            staged_file, llm_output_dir, model, args,
-            num_context_sentences=args.context_sents,
-            item_limit=args.limit_items
-        )
+    try:
+        book_results = await asyncio.gather(*(process_book_bounded(f) for f in staged_files_to_process))
+    finally:
+        if response_cache is not None:
+            response_cache.close()
+    for was_skipped, op_successful in book_results:
         if was_skipped:
             total_skipped_ops += 1
         elif op_successful:
             total_successful_ops += 1
         else:
             total_error_ops += 1
-        print("---")
 
-    print("\nProcessing Complete.")
-    print(f"Successfully processed/wrote: {total_successful_ops} book(s) / file operation(s).")
-    print(f"Skipped (output existed and not in limit/force mode): {total_skipped_ops} book(s).")
+    summary_lines = ["\nProcessing Complete."]
+    if PROMPT_TOKEN_USAGE["prompt"]:
+        summary_lines.append(f"Prompt tokens: {PROMPT_TOKEN_USAGE['prompt']} ({PROMPT_TOKEN_USAGE['cached']} served from the Gemini context cache).")
+    summary_lines.append(f"Successfully processed/wrote: {total_successful_ops} book(s) / file operation(s).")
+    summary_lines.append(f"Skipped (output existed and not in limit/force mode): {total_skipped_ops} book(s).")
     if total_error_ops > 0:
-        print(f"Encountered errors during file operations for: {total_error_ops} book(s).")
+        summary_lines.append(f"Encountered errors during file operations for: {total_error_ops} book(s).")
     else:
-        print("No file operation errors encountered.")
+        summary_lines.append("No file operation errors encountered.")
+    return summary_lines
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main_async())
\ No newline at end of file
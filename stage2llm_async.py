@@ -7,11 +7,22 @@ import re
 import time # Still used for synchronous delays
 import argparse
 import sys
-from typing import Optional, List, Dict, Any, Tuple
+from typing import Optional, List, Dict, Any, Tuple, Iterator
 from dotenv import load_dotenv
 import asyncio
 import importlib.metadata # For getting package version (for SDKs)
 import json # For potential future use, not directly in this script version
+from collections import deque
+from array import array
+import hashlib
+import sqlite3
+import functools
+import random
+import tempfile
+import itertools
+import logging
+import logging.handlers
+import queue
 
 # --- Enhanced Debug Logging Setup ---
 # (If you want more verbose logging from libraries, uncomment and adapt set_library_log_levels)
@@ -30,6 +41,8 @@ import json # For potential future use, not directly in this script version
 
 SCRIPT_VERSION = "1.0.0"
 
+logger = logging.getLogger("stage2llm_async")
+
 # Attempt to import necessary libraries
 try:
     import google.generativeai as genai
@@ -37,40 +50,102 @@ except ImportError:
     print("ERROR: Google GenAI (Gemini) library not found. `pip install google-generativeai`")
     genai = None
 
+try: # Newer Google GenAI SDK, only for its Batch API (--use_batch_api): `pip install google-genai`
+    from google import genai as google_genai
+    from google.genai import types as genai_types
+except ImportError:
+    google_genai = None
+    genai_types = None
+
+try: # Installed with google-generativeai; its typed errors let Gemini failures be told apart without parsing messages
+    from google.api_core import exceptions as google_api_exceptions
+except ImportError:
+    google_api_exceptions = None
+
 try:
     import anthropic
 except ImportError:
     print("ERROR: Anthropic (Claude) library not found. `pip install anthropic`")
     anthropic = None
 
+try: # Optional, faster event loop: `pip install "uvloop>=0.18"` (Linux/macOS only; Windows falls back to asyncio's own loop)
+    import uvloop
+except ImportError:
+    uvloop = None
+# uvloop.run is new in uvloop 0.18; an older uvloop is left unused rather than failing at startup
+run_event_loop = uvloop.run if uvloop is not None and hasattr(uvloop, "run") else asyncio.run
+
 # --- Import from the validator module ---
 try:
-    from llm_output_validator import validate_llm_block
+    from llm_output_validator import validate_llm_block, validate_llm_batch_block
 except ImportError:
     print("ERROR: Could not import 'validate_llm_block' from 'llm_output_validator.py'.")
     print("Please ensure 'llm_output_validator.py' is in the same directory or accessible in PYTHONPATH.")
     sys.exit(1)
 
 # --- Configuration ---
+# Gemini API errors by kind, for _generate_llm_output_async's except clauses
+if google_api_exceptions is not None:
+    GEMINI_TRANSIENT_ERROR_TYPES = (google_api_exceptions.ServiceUnavailable, google_api_exceptions.DeadlineExceeded,
+                                    google_api_exceptions.InternalServerError, asyncio.TimeoutError)
+    GEMINI_QUOTA_ERROR_TYPES = (google_api_exceptions.TooManyRequests,) # Includes ResourceExhausted (429)
+    GEMINI_AUTH_ERROR_TYPES = (google_api_exceptions.Unauthenticated, google_api_exceptions.PermissionDenied)
+else:
+    GEMINI_TRANSIENT_ERROR_TYPES, GEMINI_QUOTA_ERROR_TYPES, GEMINI_AUTH_ERROR_TYPES = (asyncio.TimeoutError,), (), ()
+# Fallback for errors that don't come as google.api_core exceptions: quota problems recognised from the message
+GEMINI_QUOTA_ERROR_KEYWORDS = ("429", "quota", "limit", "billing", "exceeded", "model_unavailable", "resource_exhausted")
 DEFAULT_LLM_PROVIDER = "gemini" # "gemini" or "claude"
 
 # Gemini Defaults
 DEFAULT_GEMINI_MODEL_NAME = "models/gemini-1.5-pro-preview-05-06" # Or your preferred Gemini text model
+# All calls here are generate_content_async. The SDK builds one async client per configure() and keeps it, so every
+# request shares its gRPC channel: HTTP/2 streams over one connection instead of a TCP/TLS handshake per call.
+GEMINI_TRANSPORT = "grpc_asyncio"
+GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+# Gemini Batch API (--use_batch_api): a book's sentences go out as one job, at about half the online price and outside
+# the per-request rate limits; the job finishes within 24h. Every book's job is submitted and polled at once.
+BATCH_API_POLL_SECONDS = 60 # Wait between job status checks
+BATCH_API_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
 
 # Claude Defaults
 DEFAULT_CLAUDE_MODEL_NAME = "claude-3-haiku-20240307"
 DEFAULT_CLAUDE_MAX_TOKENS_OUTPUT = 4000 # Max tokens for Claude's output
 
+GENERATION_CONFIG_PARAMS = {"temperature": 0.75} # Both providers, online and Batch API
+
 DEFAULT_STAGED_DIR_NAME = "Staged"
 DEFAULT_LLM_OUTPUT_DIR_NAME = "stage"
 DEFAULT_MAX_API_RETRIES = 3
 DEFAULT_MAX_VALIDATION_RETRIES = 5
 DEFAULT_RETRY_DELAY_SECONDS = 7
 DEFAULT_CONCURRENT_REQUESTS = 20
-
-# Regex to parse input lines
-SENTENCE_LINE_REGEX = re.compile(r"^{S\d+:\s*(.*)}$")
-CHAPTER_MARKER_REGEX = re.compile(r"^%%CHAPTER_MARKER%%\s*(.*)$")
+DEFAULT_CONTEXT_CHAR_BUDGET = 400 # Cap on each of the preceding/succeeding context strings in a prompt; 0 disables
+DEFAULT_BATCH_SIZE = 1 # Target sentences per API call; >1 shares one request's prompt overhead across several sentences
+MAX_RETRY_DELAY_SECONDS = 30.0 # Cap on any single retry wait; see retry_delay_with_jitter
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000 # Token budget across all in-flight calls; set to your quota, 0 disables
+ESTIMATED_OUTPUT_TOKENS_PER_CALL = 1000 # Added to the prompt estimate (~4 chars/token) when reserving credits
+CREDIT_REFUND_SECONDS = 60.0 # Reserved credits come back after this long, like a rolling per-minute quota
+PARTIAL_FLUSH_EVERY_ITEMS = 50 # New blocks between checkpoints of a book in progress, so a crash or Ctrl-C keeps them
+LIVE_BATCH_TASKS_PER_REQUEST = 2 # A book keeps at most this many times --concurrent_requests batch tasks started at once
+
+# Sentence requests currently with the LLM, by everything that determines the prompt; see process_sentence_with_llm_async
+_inflight_sentence_requests: Dict[tuple, asyncio.Future] = {}
+
+# Response cache (same database and table as stage2llm.py; keys never overlap since the prompts differ)
+RESPONSE_CACHE_DIR_NAME = ".llm_cache" # Under content_project_dir
+RESPONSE_CACHE_DB_NAME = "cache.sqlite" # Inside RESPONSE_CACHE_DIR_NAME
+RESPONSE_CACHE_WRITE_BATCH = 32 # Entries buffered before one executemany; also flushed after every book
+RESPONSE_CACHE_VERSION = "1" # Part of every key; bump when the output format or validator rules change
+
+# Regex to parse input lines: a chapter marker or a {S<n>: sentence} line, told apart by match.lastgroup
+STAGED_LINE_REGEX = re.compile(r"^(?:%%CHAPTER_MARKER%%\s*(?P<marker>.*)|\{S\d+:\s*(?P<sentence>.*)\})$")
+ITEM_KIND_SENTENCE = 0 # Source item kinds, as stored in a book's item_kinds array('b')
+ITEM_KIND_MARKER = 1
 
 # --- Markers and Sentinels ---
 END_SENTENCE_MARKER_TEXT = "END_SENTENCE"
@@ -79,6 +154,10 @@ COPYRIGHT_BLOCK_PLACEHOLDER_PREFIX = "// LLM_COPYRIGHT_DETECTED_REPHRASE_ATTEMPT
 RESUME_MARKER_PREFIX = "// --- PARTIAL_FILE_RESUME_NEXT_ITEM_INDEX: "
 OUTPUT_LIMITED_MARKER_PREFIX = "// --- OUTPUT_LIMITED_TO_FIRST_"
 COMPLETION_MARKER_TEXT = "// --- BOOK_FULLY_PROCESSED --- //"
+END_SENTENCE_LINE = END_SENTENCE_MARKER_TEXT + "\n" # Ends every block in a .llm.txt
+# A line holding only END_SENTENCE (the LLM sometimes adds one despite the prompt), with its line break
+END_SENTENCE_ONLY_LINE_REGEX = re.compile(rf"^[^\S\n]*{re.escape(END_SENTENCE_MARKER_TEXT)}[^\S\n]*(?:\n|$)", re.MULTILINE)
+OUTPUT_TAIL_READ_BYTES = 8192 # Resume detection reads this much from the end of an existing .llm.txt
 
 
 # --- LLM_PROMPT_TEMPLATE (User-facing part for Claude, full prompt for Gemini) ---
@@ -357,6 +436,34 @@ The output block you generate MUST correspond ONLY to the "TARGET SENTENCE".
 Overall Goal for Simplification of SimE and SimS:
 For both the "SimE" (Simple English) and "SimS" (Simple Spanish) outputs, the primary goal is to use vocabulary and sentence structures appropriate for an **absolute beginner learner (e.g., a first-grade reading level, or a 6-7 year old child learning to read or learning a second language from scratch).** Prioritize very common, high-frequency words and simple sentence structures. The SimE and SimS may themselves consist of one or more simple sentences if that aids simplification of the original TARGET SENTENCE. You will be given detailed formatting instructions for all output sections in the user message.
 """
+
+# --- Corrective prompt prefixes ---
+# Put in front of the prompt (Gemini) or the user message (Claude) on a retry; the base prompt itself is built once per sentence.
+# After a validation failure, the previous attempt's errors go between the head and the tail.
+CORRECTIVE_PROMPT_PREFIX_HEAD = (
+    "PREVIOUS ATTEMPT FAILED VALIDATION. PLEASE PAY EXTREME ATTENTION TO THE REQUIRED OUTPUT FORMAT. "
+    "Specifically, ensure all sections are present and correctly formatted. Previous errors: "
+)
+CORRECTIVE_PROMPT_PREFIX_TAIL = (
+    "\n"
+    "Re-generate the entire block for the TARGET SENTENCE ensuring adherence to the format.\n"
+    "ADDITIONALLY, before the 'AdvS::' line, please include a few lines starting with '// DEBUG:' "
+    "explaining any specific difficulties or ambiguities you encountered with the previous attempt or the source sentence "
+    "that might have led to the errors.\n"
+    "---\n"
+)
+# First attempt of a model *because* an earlier attempt was blocked for copyright/recitation
+COPYRIGHT_RETRY_PROMPT_PREFIX = (
+    "THE SYSTEM BELIEVES A PREVIOUS ATTEMPT (POSSIBLY WITH A DIFFERENT MODEL) "
+    "WAS BLOCKED DUE TO POTENTIAL COPYRIGHT/RECITATION FOR THE TARGET SENTENCE. "
+    "PLEASE REPHRASE THE SimE, SimS, AND AdvS OUTPUTS SIGNIFICANTLY TO AVOID RESEMBLANCE TO COPYRIGHTED MATERIAL, "
+    "WHILE MAINTAINING THE CORE MEANING OF THE TARGET SENTENCE. THEN, REGENERATE ALL OTHER SECTIONS BASED ON THE REPHRASED CONTENT. "
+    "PAY EXTREME ATTENTION TO THE REQUIRED OUTPUT FORMAT.\n"
+    "ADDITIONALLY, before the 'AdvS::' line, please include a few lines starting with '// DEBUG:' "
+    "explaining what part of the original sentence might have triggered the copyright/recitation flag, if you can identify it. "
+    "Then proceed with the rephrased full block.\n"
+    "---\n"
+)
 def load_project_config(config_path_str="config.toml"):
     try:
         import tomllib # Python 3.11+
@@ -385,6 +492,247 @@ def load_project_config(config_path_str="config.toml"):
         return None
 
 
+def retry_delay_with_jitter(retry_delay_seconds: float, attempt: int = 0) -> float:
+    """retry_delay_seconds * 2**attempt, stretched by a random 0-50% and capped at MAX_RETRY_DELAY_SECONDS.
+    The jitter keeps concurrent requests that failed together (e.g. on a burst of 429s) from retrying together."""
+    return min(MAX_RETRY_DELAY_SECONDS, retry_delay_seconds * (2**attempt) * (1 + random.random() * 0.5))
+
+class CreditSemaphore:
+    """Admits API calls against a per-minute token budget rather than a flat call count. Each call reserves
+    an estimate of the tokens it will use; the credits come back refund_seconds later, the way the provider's
+    rolling quota frees up. Waiters are admitted in arrival order so long prompts are not starved by short ones."""
+    def __init__(self, credits_per_period: float, refund_seconds: float = CREDIT_REFUND_SECONDS):
+        self.capacity = credits_per_period
+        self._available = credits_per_period
+        self._refund_seconds = refund_seconds
+        self._waiters: deque = deque() # (credits, future) in arrival order
+
+    async def acquire(self, credits: float):
+        credits = min(credits, self.capacity) # A call bigger than the whole budget still runs, once the budget is free
+        if not self._waiters and self._available >= credits:
+            self._available -= credits
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append((credits, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled(): # Admitted just before the cancel; hand the credits on
+                    self._refund(credits)
+                raise
+        asyncio.get_running_loop().call_later(self._refund_seconds, self._refund, credits)
+
+    def _refund(self, credits: float):
+        self._available += credits
+        while self._waiters and self._available >= self._waiters[0][0]:
+            waiter_credits, waiter = self._waiters.popleft()
+            if waiter.done(): # Cancelled while queued
+                continue
+            self._available -= waiter_credits
+            waiter.set_result(None)
+
+def estimated_call_credits(*prompt_parts: str) -> int:
+    return sum(len(part) for part in prompt_parts) // 4 + ESTIMATED_OUTPUT_TOKENS_PER_CALL
+
+@functools.lru_cache(maxsize=4)
+def _prompt_template_parts(template_str: str) -> Tuple[str, str, str, str]:
+    """Fills in END_SENTENCE_MARKER_TEXT and splits the template around its three per-sentence fields, once per template."""
+    static_template = template_str.replace("{END_SENTENCE_MARKER_TEXT}", END_SENTENCE_MARKER_TEXT)
+    head, _, rest = static_template.partition("{preceding_context}")
+    mid1, _, rest = rest.partition("{source_sentence}")
+    mid2, _, tail = rest.partition("{succeeding_context}")
+    # Undo str.format brace escaping in the literal parts
+    return tuple(part.replace("{{", "{").replace("}}", "}") for part in (head, mid1, mid2, tail))
+
+def build_prompt_from_template(template_str: str, preceding_context: str, source_sentence: str, succeeding_context: str) -> str:
+    """Same result as template_str.format(...) with the three sentence fields and END_SENTENCE_MARKER_TEXT."""
+    head, mid1, mid2, tail = _prompt_template_parts(template_str)
+    return "".join((head, preceding_context, mid1, source_sentence, mid2, succeeding_context, tail))
+
+# Put in front of the prompt when several consecutive sentences go out in one request (--batch_size > 1).
+# The template's TARGET SENTENCE slot then just points back here.
+BATCH_PROMPT_PREFIX_TEMPLATE = (
+    "THIS REQUEST HAS {num_targets} TARGET SENTENCES. They are consecutive English sentences from the source text:\n"
+    "{target_lines}\n"
+    "Process each of them as the TARGET SENTENCE of the instructions below and produce one complete output block for EACH target, "
+    "in the order given. Put a line containing only " + END_SENTENCE_MARKER_TEXT + " after each block; for this request that overrides "
+    "the instruction not to output " + END_SENTENCE_MARKER_TEXT + ". Each target's following targets serve as its succeeding context.\n"
+    "---\n"
+)
+BATCH_TARGET_SENTENCE_SLOT_TEXT = "[THE NUMBERED TARGET SENTENCES AT THE TOP OF THIS REQUEST]"
+
+def build_batch_prompt_from_template(template_str: str, preceding_context: str, source_sentences: List[str], succeeding_context: str) -> str:
+    target_lines = "\n".join(f'TARGET {i}: "{sentence}"' for i, sentence in enumerate(source_sentences, 1))
+    return BATCH_PROMPT_PREFIX_TEMPLATE.format(num_targets=len(source_sentences), target_lines=target_lines) + \
+        build_prompt_from_template(template_str, preceding_context, BATCH_TARGET_SENTENCE_SLOT_TEXT, succeeding_context)
+
+def clip_context(context: str, char_budget: int, keep_end: bool) -> str:
+    """At most char_budget characters of context, cut at a word boundary. keep_end keeps the end (preceding
+    context, whose end is next to the target sentence); otherwise the start (succeeding context) is kept.
+    Empty if not one whole word fits."""
+    if char_budget <= 0 or len(context) <= char_budget: return context
+    if keep_end:
+        clipped = context[-char_budget:]
+        if not context[-char_budget - 1].isspace() and not clipped[0].isspace(): # The cut splits the first word: drop it
+            words = clipped.split(None, 1)
+            clipped = words[1] if len(words) > 1 else ""
+        return clipped.lstrip()
+    clipped = context[:char_budget]
+    if not clipped[-1].isspace() and not context[char_budget].isspace(): # The cut splits the last word: drop it
+        words = clipped.rsplit(None, 1)
+        clipped = words[0] if len(words) > 1 else ""
+    return clipped.rstrip()
+
+def iter_item_batches(item_kinds: array, item_indices: range, batch_size: int) -> Iterator[List[int]]:
+    """Splits item_indices into the units sent to the LLM: each chapter marker on its own, and runs of up to
+    batch_size consecutive sentences. A batch never spans a chapter marker."""
+    pending_sentence_indices: List[int] = []
+    for item_idx in item_indices:
+        if item_kinds[item_idx] == ITEM_KIND_MARKER:
+            if pending_sentence_indices: yield pending_sentence_indices
+            pending_sentence_indices = []
+            yield [item_idx]
+        else:
+            pending_sentence_indices.append(item_idx)
+            if len(pending_sentence_indices) == batch_size:
+                yield pending_sentence_indices
+                pending_sentence_indices = []
+    if pending_sentence_indices: yield pending_sentence_indices
+
+def iter_staged_items(staged_file_path: Path) -> Iterator[Tuple[int, str]]:
+    """Yields (ITEM_KIND_SENTENCE or ITEM_KIND_MARKER, text) for each processable line, reading the file line by line."""
+    with open(staged_file_path, 'r', encoding='utf-8') as f_in:
+        for line_raw in f_in:
+            line_match = STAGED_LINE_REGEX.match(line_raw.strip())
+            if line_match:
+                item_kind = ITEM_KIND_MARKER if line_match.lastgroup == "marker" else ITEM_KIND_SENTENCE
+                yield item_kind, line_match.group(line_match.lastgroup).strip()
+
+def load_staged_items(staged_file_path: Path) -> Tuple[array, List[str]]:
+    """Source items of a staged file as parallel arrays rather than one dict per item: kinds (array('b')) and texts."""
+    item_kinds = array('b')
+    item_texts: List[str] = []
+    for item_kind, item_text in iter_staged_items(staged_file_path):
+        item_kinds.append(item_kind)
+        item_texts.append(item_text)
+    return item_kinds, item_texts
+
+def write_output_file(output_file_path: Path, content: str):
+    output_file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_file_path, 'w', encoding='utf-8') as f_out: f_out.write(content)
+
+def write_output_checkpoint(output_file_path: Path, content_end_offset: Optional[int], new_content: str, resume_marker: str) -> int:
+    """Checkpoint of a book in progress: new_content goes at content_end_offset, the end of the blocks checkpointed so far
+    (None: start the file afresh), then resume_marker replaces whatever followed. Returns the new end of the blocks."""
+    if content_end_offset is None: output_file_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_file_path, 'w' if content_end_offset is None else 'r+', encoding='utf-8') as f_out:
+        if content_end_offset is not None: f_out.seek(content_end_offset)
+        f_out.write(new_content)
+        content_end_offset = f_out.tell()
+        f_out.write(resume_marker)
+        f_out.truncate()
+    return content_end_offset
+
+def split_off_last_output_block(llm_text: str) -> Tuple[str, Optional[str]]:
+    """Splits .llm.txt text into (everything before its last complete block, that block). A block ends with
+    END_SENTENCE_LINE; text after the last one (an interrupted write) belongs to neither. (text, None) if no block."""
+    last_end = llm_text.rfind(END_SENTENCE_LINE)
+    if last_end == -1:
+        return llm_text, None
+    previous_end = llm_text.rfind(END_SENTENCE_LINE, 0, last_end)
+    block_start = previous_end + len(END_SENTENCE_LINE) if previous_end != -1 else 0
+    return llm_text[:block_start], llm_text[block_start:last_end + len(END_SENTENCE_LINE)]
+
+def read_last_output_block(output_file_path: Path) -> Optional[str]:
+    """The last complete block of an existing .llm.txt, found by searching back from the end of the file.
+    Only the final OUTPUT_TAIL_READ_BYTES are read unless that block is longer."""
+    with open(output_file_path, 'rb') as f:
+        file_size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, file_size - OUTPUT_TAIL_READ_BYTES))
+        tail_bytes = f.read()
+    # Newlines normalized as in text mode; a character cut at the start of the tail only affects discarded text
+    tail_text = tail_bytes.decode('utf-8', errors='replace').replace("\r\n", "\n").replace("\r", "\n")
+    text_before, last_block = split_off_last_output_block(tail_text)
+    if file_size > OUTPUT_TAIL_READ_BYTES and not text_before.endswith(END_SENTENCE_LINE):
+        # The block may start before the tail
+        text_before, last_block = split_off_last_output_block(output_file_path.read_text(encoding='utf-8'))
+    return last_block
+
+
+class ResponseCache:
+    """Validated LLM outputs keyed by SHA-256 of (cache version, provider, model, prompt templates, sentence and
+    its context). Kept in memory for the run and in SQLite under cache_dir, so sentences repeated within or
+    across books, and re-runs after a crash, skip the API call. Writes are buffered and committed in batches."""
+    def __init__(self, cache_dir: Path, llm_provider: str, model_name: str):
+        self.model_name = model_name
+        # Hash the fixed part of the key once; each key copies this state and adds the sentence and context
+        self._key_prefix_hash = hashlib.sha256(
+            f"{RESPONSE_CACHE_VERSION}\0{llm_provider}\0{model_name}\0{LLM_PROMPT_TEMPLATE}\0{CLAUDE_SYSTEM_PROMPT}\0".encode('utf-8'))
+        self._memory: Dict[str, str] = {} # key -> output, for everything read or written this run
+        self._pending_writes: Dict[str, Tuple[int, bytes]] = {} # key -> (created_at, payload) not yet in the database
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            # Autocommit mode; batches get an explicit transaction in flush(). Only the event loop thread uses it.
+            self._db = sqlite3.connect(cache_dir / RESPONSE_CACHE_DB_NAME, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses "
+                             "(key TEXT PRIMARY KEY, model TEXT, created_at INTEGER, payload BLOB)")
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Response cache database unavailable at '{cache_dir}' ({e}); caching in memory only.")
+            self._db = None
+
+    def key_for(self, preceding_context: str, source_sentence_text: str, succeeding_context: str) -> str:
+        key_hash = self._key_prefix_hash.copy()
+        key_hash.update(f"{preceding_context}\0{source_sentence_text}\0{succeeding_context}".encode('utf-8'))
+        return key_hash.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if key in self._memory:
+            return self._memory[key]
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT payload FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        cached_output = bytes(row[0]).decode('utf-8')
+        if validate_llm_block(cached_output): # Re-checked so entries from looser validator rules are not reused
+            return None
+        self._memory[key] = cached_output
+        return cached_output
+
+    def put(self, key: str, validated_output: str):
+        self._memory[key] = validated_output
+        if self._db is None:
+            return
+        self._pending_writes[key] = (int(time.time()), validated_output.encode('utf-8'))
+        if len(self._pending_writes) >= RESPONSE_CACHE_WRITE_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self._db is None or not self._pending_writes:
+            return
+        rows = [(key, self.model_name, created_at, payload) for key, (created_at, payload) in self._pending_writes.items()]
+        self._pending_writes.clear()
+        try:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO responses (key, model, created_at, payload) VALUES (?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+        except sqlite3.Error as e:
+            if self._db.in_transaction:
+                self._db.execute("ROLLBACK")
+            logger.warning(f"Could not write {len(rows)} response cache entries: {e}")
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
 async def process_sentence_with_llm_async(
     source_sentence_text: str,
     preceding_context: str,
@@ -400,203 +748,413 @@ async def process_sentence_with_llm_async(
     llm_prompt_template_str: str, # The main template (becomes user prompt for Claude)
     claude_system_prompt_str: str, # System prompt for Claude
     claude_max_tokens: int,
-    is_copyright_retry_attempt: bool = False
+    is_copyright_retry_attempt: bool = False,
+    response_cache: Optional[ResponseCache] = None,
+    credit_semaphore: Optional[CreditSemaphore] = None
 ) -> str:
 
-    # This is the base "user-facing" part of the prompt for both providers
-    current_original_prompt_text_for_sentence = llm_prompt_template_str.format(
-        preceding_context=preceding_context,
-        source_sentence=source_sentence_text,
-        succeeding_context=succeeding_context,
-        END_SENTENCE_MARKER_TEXT=END_SENTENCE_MARKER_TEXT
+    # Checked before taking a semaphore slot: a hit costs no API call
+    cache_key = None
+    if response_cache is not None:
+        cache_key = response_cache.key_for(preceding_context, source_sentence_text, succeeding_context)
+        cached_output = response_cache.get(cache_key)
+        if cached_output is not None:
+            logger.debug("Item %s: Using cached LLM output.", item_idx_for_log) # %-args: formatted only at DEBUG
+            return cached_output
+
+    # The same sentence and context already on its way to the LLM (a repeated line, or two sentences
+    # with the same neighbours): wait for that result instead of making a second identical call
+    inflight_key = (llm_provider, model_name_to_use_in_api_call, llm_prompt_template_str, preceding_context,
+                    source_sentence_text, succeeding_context, is_copyright_retry_attempt)
+    inflight_result = _inflight_sentence_requests.get(inflight_key)
+    if inflight_result is not None:
+        logger.debug("Item %s: Waiting for an identical request already in flight.", item_idx_for_log)
+        return await asyncio.shield(inflight_result)
+
+    inflight_result = asyncio.get_running_loop().create_future()
+    _inflight_sentence_requests[inflight_key] = inflight_result
+    try:
+        item_result_str = await _process_sentence_with_llm_uncached_async(
+            source_sentence_text, preceding_context, succeeding_context,
+            llm_client_or_model_obj, llm_provider, model_name_to_use_in_api_call,
+            max_api_retries, max_validation_retries, retry_delay_seconds, semaphore, item_idx_for_log,
+            llm_prompt_template_str, claude_system_prompt_str, claude_max_tokens,
+            is_copyright_retry_attempt, response_cache, cache_key, credit_semaphore
+        )
+    except Exception as e:
+        inflight_result.set_exception(e) # Callers waiting on this request get the same error
+        inflight_result.exception() # Retrieved here, so it isn't reported as unhandled when nobody was waiting
+        raise
+    except BaseException: # Cancelled (or the run is stopping): so are the callers waiting on this request
+        inflight_result.cancel()
+        raise
+    else:
+        inflight_result.set_result(item_result_str)
+        return item_result_str
+    finally:
+        del _inflight_sentence_requests[inflight_key]
+
+async def process_sentence_batch_with_llm_async(
+    batch_items: List[Tuple[str, str, str, int]],
+    llm_client_or_model_obj: Any,
+    llm_provider: str,
+    model_name_to_use_in_api_call: str,
+    max_api_retries: int,
+    max_validation_retries: int,
+    retry_delay_seconds: int,
+    semaphore: asyncio.Semaphore,
+    llm_prompt_template_str: str,
+    claude_system_prompt_str: str,
+    claude_max_tokens: int,
+    response_cache: Optional[ResponseCache] = None,
+    credit_semaphore: Optional[CreditSemaphore] = None
+) -> List[str]:
+    """batch_items are consecutive (source_sentence, preceding_context, succeeding_context, item_idx_for_log)
+    tuples. They go out in one request; any sentence whose block is missing or fails validation is redone
+    on its own with process_sentence_with_llm_async. Returns one result per item, in order."""
+    def process_items_singly(item_positions: List[int]):
+        return asyncio.gather(*(
+            process_sentence_with_llm_async(
+                batch_items[i][0], batch_items[i][1], batch_items[i][2],
+                llm_client_or_model_obj, llm_provider, model_name_to_use_in_api_call,
+                max_api_retries, max_validation_retries, retry_delay_seconds, semaphore, batch_items[i][3],
+                llm_prompt_template_str, claude_system_prompt_str, claude_max_tokens,
+                response_cache=response_cache, credit_semaphore=credit_semaphore
+            ) for i in item_positions
+        ))
+
+    if len(batch_items) == 1:
+        return await process_items_singly([0])
+
+    # Cached per sentence under the same keys as the single-sentence path, so either path can reuse the other's output
+    batch_outputs: List[Optional[str]] = [None] * len(batch_items)
+    cache_keys: List[Optional[str]] = [None] * len(batch_items)
+    if response_cache is not None:
+        for i, (source_sentence_text, preceding_context, succeeding_context, _) in enumerate(batch_items):
+            cache_keys[i] = response_cache.key_for(preceding_context, source_sentence_text, succeeding_context)
+            batch_outputs[i] = response_cache.get(cache_keys[i])
+    uncached_positions = [i for i, output in enumerate(batch_outputs) if output is None]
+    if not uncached_positions:
+        logger.debug("Items %s-%s: Using cached LLM output.", batch_items[0][3], batch_items[-1][3])
+        return batch_outputs
+    if len(uncached_positions) == 1:
+        batch_outputs[uncached_positions[0]], = await process_items_singly(uncached_positions)
+        return batch_outputs
+
+    first_item_idx_for_log = batch_items[uncached_positions[0]][3]
+    source_sentences = [batch_items[i][0] for i in uncached_positions]
+    batch_prompt_text = build_batch_prompt_from_template(
+        llm_prompt_template_str, batch_items[uncached_positions[0]][1], source_sentences, batch_items[uncached_positions[-1]][2]
     )
-    
-    # Initialize current_prompt_to_send based on provider for the first API call attempt in the validation loop
+    async with semaphore:
+        raw_batch_output, _ = await _generate_llm_output_async(
+            batch_prompt_text, source_sentences[0], llm_client_or_model_obj, llm_provider,
+            model_name_to_use_in_api_call, max_api_retries, retry_delay_seconds, first_item_idx_for_log,
+            claude_system_prompt_str, claude_max_tokens, credit_semaphore
+        )
+    if raw_batch_output == FATAL_QUOTA_ERROR_SENTINEL:
+        for i in uncached_positions: batch_outputs[i] = FATAL_QUOTA_ERROR_SENTINEL
+        return batch_outputs
+
+    if not raw_batch_output or raw_batch_output.startswith("//"): # An '// LLM_...' placeholder: the request itself failed
+        blocks, errors_per_block = [""] * len(uncached_positions), [["No usable batch output."]] * len(uncached_positions)
+    else:
+        blocks, errors_per_block = validate_llm_batch_block(raw_batch_output, len(uncached_positions))
+
+    failed_positions = []
+    for i, block, block_errors in zip(uncached_positions, blocks, errors_per_block):
+        if block_errors:
+            failed_positions.append(i)
+        else:
+            batch_outputs[i] = block
+            if response_cache is not None: response_cache.put(cache_keys[i], block)
+
+    if failed_positions:
+        logger.warning(f"Items {first_item_idx_for_log}-{batch_items[uncached_positions[-1]][3]}: {len(failed_positions)} of {len(uncached_positions)} blocks in batch unusable ({errors_per_block[uncached_positions.index(failed_positions[0])][0]}); retrying them one sentence at a time.")
+        for i, single_output in zip(failed_positions, await process_items_singly(failed_positions)):
+            batch_outputs[i] = single_output
+    return batch_outputs
+
+def upload_batch_api_requests(batch_api_client: Any, request_lines: str, display_name: str) -> str:
+    """Writes the JSONL requests to a temporary file and uploads it with the Files API; returns the uploaded file's name."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        requests_file_path = Path(tmp_dir) / "requests.jsonl"
+        requests_file_path.write_text(request_lines, encoding="utf-8")
+        uploaded_file = batch_api_client.files.upload(
+            file=requests_file_path, config=genai_types.UploadFileConfig(display_name=display_name, mime_type="jsonl")
+        )
+    return uploaded_file.name
+
+async def process_sentences_with_batch_api_async(
+    batch_items: List[Tuple[str, str, str, int]],
+    batch_api_client: Any, # google.genai Client
+    job_display_name: str,
+    llm_client_or_model_obj: Any, # For sentences redone online
+    model_name_to_use_in_api_call: str,
+    max_api_retries: int,
+    max_validation_retries: int,
+    retry_delay_seconds: int,
+    semaphore: asyncio.Semaphore,
+    llm_prompt_template_str: str,
+    response_cache: Optional[ResponseCache] = None,
+    credit_semaphore: Optional[CreditSemaphore] = None
+) -> List[str]:
+    """Gemini only. batch_items are (source_sentence, preceding_context, succeeding_context, item_idx_for_log)
+    tuples; the uncached ones go out as one Batch API job of requests keyed 'item-<item_idx_for_log>', polled
+    until it ends. Any sentence whose response is missing, failed or invalid is redone online with
+    process_sentence_with_llm_async. Returns one result per item, in order."""
+    batch_outputs: List[Optional[str]] = [None] * len(batch_items)
+    cache_keys: List[Optional[str]] = [None] * len(batch_items)
+    if response_cache is not None:
+        for i, (source_sentence_text, preceding_context, succeeding_context, _) in enumerate(batch_items):
+            cache_keys[i] = response_cache.key_for(preceding_context, source_sentence_text, succeeding_context)
+            batch_outputs[i] = response_cache.get(cache_keys[i])
+    uncached_positions = [i for i, output in enumerate(batch_outputs) if output is None]
+    if not uncached_positions:
+        return batch_outputs
+
+    # One line per sentence, in the Batch API's JSONL input format; the prompt is exactly the online one
+    request_positions = {f"item-{batch_items[i][3]}": i for i in uncached_positions}
+    request_lines = "".join(json.dumps({"key": request_key, "request": {
+        "contents": [{"role": "user", "parts": [{"text": build_prompt_from_template(
+            llm_prompt_template_str, batch_items[i][1], batch_items[i][0], batch_items[i][2])}]}],
+        "safetySettings": GEMINI_SAFETY_SETTINGS,
+        "generationConfig": GENERATION_CONFIG_PARAMS,
+    }}, ensure_ascii=False) + "\n" for request_key, i in request_positions.items())
+
+    result_lines: List[str] = []
+    try:
+        uploaded_file_name = await asyncio.to_thread(upload_batch_api_requests, batch_api_client, request_lines, job_display_name)
+        batch_job = await batch_api_client.aio.batches.create(
+            model=model_name_to_use_in_api_call, src=uploaded_file_name, config={"display_name": job_display_name}
+        )
+        logger.info(f"{job_display_name}: Batch API job '{batch_job.name}' submitted for {len(request_positions)} sentences; checking every {BATCH_API_POLL_SECONDS}s.")
+        while batch_job.state.name not in BATCH_API_DONE_STATES:
+            await asyncio.sleep(BATCH_API_POLL_SECONDS)
+            batch_job = await batch_api_client.aio.batches.get(name=batch_job.name)
+        if batch_job.state.name != "JOB_STATE_SUCCEEDED":
+            raise RuntimeError(f"job ended in {batch_job.state.name} ({batch_job.error})")
+        result_file_bytes = await asyncio.to_thread(batch_api_client.files.download, file=batch_job.dest.file_name)
+        result_lines = result_file_bytes.decode("utf-8").splitlines()
+    except Exception as e_batch:
+        logger.warning(f"{job_display_name}: Batch API job failed ({type(e_batch).__name__} {e_batch}); its sentences go out online instead.")
+
+    for result_line_number, result_line in enumerate(result_lines, 1):
+        if not result_line.strip(): continue
+        try:
+            result = json.loads(result_line)
+            i = request_positions.get(result.get("key"))
+            if i is None or "response" not in result: continue # Unknown key, or this request's own error
+            candidates = result["response"].get("candidates") or [{}] # None when the prompt was blocked
+            raw_llm_output = "".join(part.get("text", "") for part in candidates[0].get("content", {}).get("parts", [])).strip()
+        except (ValueError, AttributeError, TypeError) as e_line: # Its sentence is redone online below
+            logger.warning(f"{job_display_name}: Skipping unreadable Batch API result line {result_line_number} ({type(e_line).__name__} {e_line}).")
+            continue
+        if END_SENTENCE_MARKER_TEXT in raw_llm_output:
+            raw_llm_output = END_SENTENCE_ONLY_LINE_REGEX.sub("", raw_llm_output).strip()
+        if raw_llm_output and not validate_llm_block(raw_llm_output):
+            batch_outputs[i] = raw_llm_output
+            if response_cache is not None: response_cache.put(cache_keys[i], raw_llm_output)
+
+    failed_positions = [i for i in uncached_positions if batch_outputs[i] is None]
+    if failed_positions:
+        if result_lines: logger.warning(f"{job_display_name}: {len(failed_positions)} of {len(uncached_positions)} Batch API results missing or invalid; retrying them online.")
+        online_outputs = await asyncio.gather(*(
+            process_sentence_with_llm_async(
+                batch_items[i][0], batch_items[i][1], batch_items[i][2],
+                llm_client_or_model_obj, "gemini", model_name_to_use_in_api_call,
+                max_api_retries, max_validation_retries, retry_delay_seconds, semaphore, batch_items[i][3],
+                llm_prompt_template_str, CLAUDE_SYSTEM_PROMPT, DEFAULT_CLAUDE_MAX_TOKENS_OUTPUT, # Claude only; unused
+                response_cache=response_cache, credit_semaphore=credit_semaphore
+            ) for i in failed_positions
+        ))
+        for i, online_output in zip(failed_positions, online_outputs):
+            batch_outputs[i] = online_output
+    return batch_outputs
+
+async def _generate_llm_output_async(
+    prompt_text: str, # Gemini: the whole prompt; Claude: the user message
+    source_sentence_text: str, # Named in placeholder outputs
+    llm_client_or_model_obj: Any,
+    llm_provider: str,
+    model_name_to_use_in_api_call: str,
+    max_api_retries: int,
+    retry_delay_seconds: int,
+    item_idx_for_log: int,
+    claude_system_prompt_str: str,
+    claude_max_tokens: int,
+    credit_semaphore: Optional[CreditSemaphore]
+) -> Tuple[Optional[str], bool]:
+    """One LLM request, with up to max_api_retries attempts. The caller holds the semaphore.
+    Returns (output or '// LLM_...' placeholder, api_call_successful_flag); the output is
+    FATAL_QUOTA_ERROR_SENTINEL when the quota or key makes further calls pointless."""
+
+    _raw_llm_output_core_this_api_cycle = None
+    api_call_successful_flag = False
+
     if llm_provider == "claude":
-        # For Claude, corrective instructions prepend the user message part
-        current_prompt_user_message_part = current_original_prompt_text_for_sentence
-    else: # gemini
-        # For Gemini, corrective instructions prepend the whole prompt
-        current_prompt_to_send_to_api = current_original_prompt_text_for_sentence
+        call_credits = estimated_call_credits(claude_system_prompt_str, prompt_text)
+    else:
+        call_credits = estimated_call_credits(prompt_text)
 
+    for api_attempt in range(max_api_retries):
+        if credit_semaphore is not None: await credit_semaphore.acquire(call_credits) # Every attempt uses tokens
+        try:
+            if llm_provider == "gemini":
+                response = await llm_client_or_model_obj.generate_content_async(
+                    prompt_text,
+                    safety_settings=GEMINI_SAFETY_SETTINGS,
+                    generation_config=genai.types.GenerationConfig(**GENERATION_CONFIG_PARAMS)
+                )
+                if response.parts:
+                    _raw_llm_output_core_this_api_cycle = response.text.strip()
+                    api_call_successful_flag = True
+                    if response.prompt_feedback and response.prompt_feedback.block_reason:
+                        reason_str = str(response.prompt_feedback.block_reason).lower()
+                        reason_msg = response.prompt_feedback.block_reason_message or reason_str
+                        if "recitation" in reason_str or response.prompt_feedback.block_reason == 4: # 4 is BlockReason.SAFETY (often for recitation)
+                            logger.warning(f"LLM API Warning (Gemini, Item {item_idx_for_log}): Potential copyright/recitation block. Reason: {reason_msg}")
+                            _raw_llm_output_core_this_api_cycle = f"{COPYRIGHT_BLOCK_PLACEHOLDER_PREFIX}{source_sentence_text}"
+                    break # API call success
+                else: # No parts, but response object exists (likely blocked)
+                    reason = "Unknown reason, empty parts list in response."
+                    is_fatal_quota = False
+                    if response.prompt_feedback and response.prompt_feedback.block_reason:
+                        reason_str = str(response.prompt_feedback.block_reason).lower()
+                        reason_msg = response.prompt_feedback.block_reason_message or reason_str
+                        reason = reason_msg
+                        if any(kw in reason_str for kw in ["quota", "limit", "billing", "exceeded", "rate_limit_exceeded"]): # Gemini specific check
+                            is_fatal_quota = True
+                        elif "recitation" in reason_str or response.prompt_feedback.block_reason == 4:
+                            logger.warning(f"LLM API Warning (Gemini, Item {item_idx_for_log}): Potential copyright/recitation block (no parts). Reason: {reason}")
+                            _raw_llm_output_core_this_api_cycle = f"{COPYRIGHT_BLOCK_PLACEHOLDER_PREFIX}{source_sentence_text}"
+                            api_call_successful_flag = True; break
+                    logger.warning(f"LLM Warning (Gemini, API Attempt {api_attempt+1}) for item {item_idx_for_log}: Blocked or empty parts. Reason: {reason}")
+                    if is_fatal_quota: return FATAL_QUOTA_ERROR_SENTINEL, False
+                    if not api_call_successful_flag: # If not already set to copyright placeholder
+                        _raw_llm_output_core_this_api_cycle = f"// LLM_BLOCKED_NO_PARTS (Gemini, Reason: {reason}) FOR_SOURCE: {source_sentence_text}"
+                    break # Handled block/empty parts
+
+            elif llm_provider == "claude":
+                messages_for_claude = [{"role": "user", "content": prompt_text}]
+                api_response = await llm_client_or_model_obj.messages.create(
+                    model=model_name_to_use_in_api_call,
+                    max_tokens=claude_max_tokens,
+                    system=claude_system_prompt_str,
+                    messages=messages_for_claude,
+                    temperature=GENERATION_CONFIG_PARAMS.get("temperature", 0.7)
+                )
+                if api_response.content and api_response.content[0].text:
+                    _raw_llm_output_core_this_api_cycle = api_response.content[0].text.strip()
+                    api_call_successful_flag = True
+                    if api_response.stop_reason == "max_tokens":
+                        logger.warning(f"LLM API Warning (Claude, Item {item_idx_for_log}): Output truncated due to max_tokens ({claude_max_tokens}).")
+                    # Claude's copyright/safety is usually via 400 error, handled in exceptions
+                else: # Should not happen if no exception
+                    _raw_llm_output_core_this_api_cycle = f"// LLM_EMPTY_CONTENT_UNEXPECTED (Claude) FOR_SOURCE: {source_sentence_text}"
+                break # API call success or handled empty
+
+        # Gemini's clauses dispatch on google.api_core exception types; anything else falls through to the last clause
+        except (anthropic.APIConnectionError, anthropic.InternalServerError) if llm_provider == "claude" else GEMINI_TRANSIENT_ERROR_TYPES as e_generic_retry: # Temp server issues
+            logger.warning(f"LLM API Error ({llm_provider.capitalize()}, API Attempt {api_attempt + 1}/{max_api_retries}) for item {item_idx_for_log}: Temporary issue - {type(e_generic_retry).__name__} {e_generic_retry}")
+            if api_attempt + 1 == max_api_retries:
+                 _raw_llm_output_core_this_api_cycle = f"// LLM_API_TEMP_ERROR_MAX_RETRIES ({llm_provider.capitalize()}, {type(e_generic_retry).__name__}) FOR_SOURCE: {source_sentence_text}"
+                 break
+            await asyncio.sleep(retry_delay_with_jitter(retry_delay_seconds, api_attempt)) # Exponential backoff for server issues
+
+        except anthropic.RateLimitError if llm_provider == "claude" else GEMINI_QUOTA_ERROR_TYPES as e_rate_limit:
+            logger.warning(f"LLM API Error ({llm_provider.capitalize()}, API Attempt {api_attempt + 1}/{max_api_retries}) for item {item_idx_for_log}: Rate limit / Quota - {e_rate_limit}")
+            if api_attempt + 1 == max_api_retries:
+                logger.error(f"FATAL QUOTA LIKELY ({llm_provider.capitalize()}, persisted API error): Item {item_idx_for_log}. Error: {e_rate_limit}")
+                return FATAL_QUOTA_ERROR_SENTINEL, False
+            effective_delay = retry_delay_with_jitter(retry_delay_seconds, api_attempt)
+            logger.warning(f"Item {item_idx_for_log} ({llm_provider.capitalize()}): Retrying API call (rate limit/quota) in {effective_delay:.1f} seconds...")
+            await asyncio.sleep(effective_delay)
+
+        except anthropic.AuthenticationError if llm_provider == "claude" else GEMINI_AUTH_ERROR_TYPES as e_auth: # Before APIStatusError, its base class
+            logger.error(f"FATAL LLM API Authentication Error ({llm_provider.capitalize()}): {e_auth}. Check API Key.")
+            return FATAL_QUOTA_ERROR_SENTINEL, False # Treat as fatal for this run
+
+        except anthropic.APIStatusError if llm_provider == "claude" else () as e_claude_status: # Claude specific for 4xx/5xx not covered above
+            logger.warning(f"LLM API Error (Claude, API Attempt {api_attempt + 1}/{max_api_retries}) for item {item_idx_for_log}: Status {e_claude_status.status_code} - {e_claude_status.message}")
+            if e_claude_status.status_code == 400 and e_claude_status.body and \
+               e_claude_status.body.get('error', {}).get('type') == 'invalid_request_error':
+                error_message_lower = e_claude_status.message.lower()
+                if "safety" in error_message_lower or "policy" in error_message_lower or "harmful" in error_message_lower:
+                    logger.warning(f"Potential copyright/safety block from Claude for item {item_idx_for_log}.")
+                    _raw_llm_output_core_this_api_cycle = f"{COPYRIGHT_BLOCK_PLACEHOLDER_PREFIX}{source_sentence_text}"
+                    api_call_successful_flag = True; break 
+            
+            # For other 4xx/5xx errors, treat as potentially retriable or fatal depending on attempts
+            if api_attempt + 1 == max_api_retries:
+                _raw_llm_output_core_this_api_cycle = f"// LLM_API_STATUS_ERROR_MAX_RETRIES (Claude, {e_claude_status.status_code}) FOR_SOURCE: {source_sentence_text}"
+                break
+            await asyncio.sleep(retry_delay_with_jitter(retry_delay_seconds))
+
+        except Exception as e: # General catch-all, including Gemini errors of no type handled above
+            logger.warning(f"LLM API Error ({llm_provider.capitalize()}, API Attempt {api_attempt + 1}/{max_api_retries}) for item {item_idx_for_log}: {type(e).__name__} - {e}")
+            # A typed google.api_core error has already been classified; only untyped ones are checked by message
+            is_untyped_gemini_error = llm_provider == "gemini" and (google_api_exceptions is None or not isinstance(e, google_api_exceptions.GoogleAPICallError))
+            if is_untyped_gemini_error and any(kw in str(e).lower() for kw in GEMINI_QUOTA_ERROR_KEYWORDS):
+                 if api_attempt + 1 == max_api_retries:
+                    logger.error(f"FATAL QUOTA LIKELY (Gemini, persisted API error): Item {item_idx_for_log}. Error: {e}")
+                    return FATAL_QUOTA_ERROR_SENTINEL, False
+                 effective_delay = retry_delay_with_jitter(retry_delay_seconds, api_attempt)
+                 logger.warning(f"Item {item_idx_for_log} (Gemini): Retrying API call (potential quota/availability) in {effective_delay:.1f} seconds...")
+                 await asyncio.sleep(effective_delay)
+                 continue # continue to next API attempt
+
+            if api_attempt + 1 == max_api_retries:
+                _raw_llm_output_core_this_api_cycle = f"// LLM_API_ERROR_MAX_RETRIES ({llm_provider.capitalize()}, {type(e).__name__}) FOR_SOURCE: {source_sentence_text}"
+                break
+            await asyncio.sleep(retry_delay_with_jitter(retry_delay_seconds))
+
+    return _raw_llm_output_core_this_api_cycle, api_call_successful_flag
+
+async def _process_sentence_with_llm_uncached_async(
+    source_sentence_text: str,
+    preceding_context: str,
+    succeeding_context: str,
+    llm_client_or_model_obj: Any,
+    llm_provider: str,
+    model_name_to_use_in_api_call: str,
+    max_api_retries: int,
+    max_validation_retries: int,
+    retry_delay_seconds: int,
+    semaphore: asyncio.Semaphore,
+    item_idx_for_log: int,
+    llm_prompt_template_str: str,
+    claude_system_prompt_str: str,
+    claude_max_tokens: int,
+    is_copyright_retry_attempt: bool,
+    response_cache: Optional[ResponseCache],
+    cache_key: Optional[str],
+    credit_semaphore: Optional[CreditSemaphore]
+) -> str:
 
-    last_validation_error_details_str = ""
-    # Gemini specific settings
-    gemini_safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-    ]
-    # Common generation config (temperature can be used by both)
-    generation_config_params = {"temperature": 0.75}
+    # This is the base "user-facing" part of the prompt for both providers; retries only add a prefix to it
+    current_original_prompt_text_for_sentence = build_prompt_from_template(
+        llm_prompt_template_str, preceding_context, source_sentence_text, succeeding_context
+    )
 
+    last_validation_error_details_str = ""
 
     async with semaphore:
         for validation_attempt in range(max_validation_retries):
-            # Construct corrective prompts if this is a retry
-            corrective_instruction_general = ""
-            corrective_instruction_copyright = ""
-
-            if validation_attempt > 0: # This is a validation retry
-                corrective_instruction_general = (
-                    "PREVIOUS ATTEMPT FAILED VALIDATION. PLEASE PAY EXTREME ATTENTION TO THE REQUIRED OUTPUT FORMAT. "
-                    f"Specifically, ensure all sections are present and correctly formatted. Previous errors: {last_validation_error_details_str}\n"
-                    "Re-generate the entire block for the TARGET SENTENCE ensuring adherence to the format.\n"
-                    "ADDITIONALLY, before the 'AdvS::' line, please include a few lines starting with '// DEBUG:' "
-                    "explaining any specific difficulties or ambiguities you encountered with the previous attempt or the source sentence "
-                    "that might have led to the errors.\n"
-                    "---\n"
-                )
-            
+            # The whole prompt for Gemini, the user message for Claude (whose system prompt stays claude_system_prompt_str)
             if is_copyright_retry_attempt and validation_attempt == 0: # First attempt of this model *because* of copyright
-                 corrective_instruction_copyright = (
-                    "THE SYSTEM BELIEVES A PREVIOUS ATTEMPT (POSSIBLY WITH A DIFFERENT MODEL) "
-                    "WAS BLOCKED DUE TO POTENTIAL COPYRIGHT/RECITATION FOR THE TARGET SENTENCE. "
-                    "PLEASE REPHRASE THE SimE, SimS, AND AdvS OUTPUTS SIGNIFICANTLY TO AVOID RESEMBLANCE TO COPYRIGHTED MATERIAL, "
-                    "WHILE MAINTAINING THE CORE MEANING OF THE TARGET SENTENCE. THEN, REGENERATE ALL OTHER SECTIONS BASED ON THE REPHRASED CONTENT. "
-                    "PAY EXTREME ATTENTION TO THE REQUIRED OUTPUT FORMAT.\n"
-                    "ADDITIONALLY, before the 'AdvS::' line, please include a few lines starting with '// DEBUG:' "
-                    "explaining what part of the original sentence might have triggered the copyright/recitation flag, if you can identify it. "
-                    "Then proceed with the rephrased full block.\n"
-                    "---\n"
-                )
-
-            # Prepare the actual prompt to send for this validation attempt
-            if llm_provider == "claude":
-                current_prompt_user_message_part = current_original_prompt_text_for_sentence
-                if corrective_instruction_copyright: # Takes precedence for the first attempt if it's a copyright retry
-                    current_prompt_user_message_part = corrective_instruction_copyright + current_prompt_user_message_part
-                elif corrective_instruction_general: # For subsequent validation retries
-                    current_prompt_user_message_part = corrective_instruction_general + current_prompt_user_message_part
-                # system_prompt_for_claude remains claude_system_prompt_str
-            else: # gemini
-                current_prompt_to_send_to_api = current_original_prompt_text_for_sentence
-                if corrective_instruction_copyright:
-                    current_prompt_to_send_to_api = corrective_instruction_copyright + current_prompt_to_send_to_api
-                elif corrective_instruction_general:
-                    current_prompt_to_send_to_api = corrective_instruction_general + current_prompt_to_send_to_api
-            
-            _raw_llm_output_core_this_api_cycle = None
-            api_call_successful_flag = False
-
-            for api_attempt in range(max_api_retries):
-                try:
-                    if llm_provider == "gemini":
-                        response = await llm_client_or_model_obj.generate_content_async(
-                            current_prompt_to_send_to_api,
-                            safety_settings=gemini_safety_settings,
-                            generation_config=genai.types.GenerationConfig(**generation_config_params)
-                        )
-                        if response.parts:
-                            _raw_llm_output_core_this_api_cycle = response.text.strip()
-                            api_call_successful_flag = True
-                            if response.prompt_feedback and response.prompt_feedback.block_reason:
-                                reason_str = str(response.prompt_feedback.block_reason).lower()
-                                reason_msg = response.prompt_feedback.block_reason_message or reason_str
-                                if "recitation" in reason_str or response.prompt_feedback.block_reason == 4: # 4 is BlockReason.SAFETY (often for recitation)
-                                    print(f"  LLM API Warning (Gemini, Item {item_idx_for_log}): Potential copyright/recitation block. Reason: {reason_msg}", file=sys.stderr)
-                                    _raw_llm_output_core_this_api_cycle = f"{COPYRIGHT_BLOCK_PLACEHOLDER_PREFIX}{source_sentence_text}"
-                            break # API call success
-                        else: # No parts, but response object exists (likely blocked)
-                            reason = "Unknown reason, empty parts list in response."
-                            is_fatal_quota = False
-                            if response.prompt_feedback and response.prompt_feedback.block_reason:
-                                reason_str = str(response.prompt_feedback.block_reason).lower()
-                                reason_msg = response.prompt_feedback.block_reason_message or reason_str
-                                reason = reason_msg
-                                if any(kw in reason_str for kw in ["quota", "limit", "billing", "exceeded", "rate_limit_exceeded"]): # Gemini specific check
-                                    is_fatal_quota = True
-                                elif "recitation" in reason_str or response.prompt_feedback.block_reason == 4:
-                                    print(f"  LLM API Warning (Gemini, Item {item_idx_for_log}): Potential copyright/recitation block (no parts). Reason: {reason}", file=sys.stderr)
-                                    _raw_llm_output_core_this_api_cycle = f"{COPYRIGHT_BLOCK_PLACEHOLDER_PREFIX}{source_sentence_text}"
-                                    api_call_successful_flag = True; break
-                            print(f"  LLM Warning (Gemini, API Attempt {api_attempt+1}) for item {item_idx_for_log}: Blocked or empty parts. Reason: {reason}", file=sys.stderr)
-                            if is_fatal_quota: return FATAL_QUOTA_ERROR_SENTINEL
-                            if not api_call_successful_flag: # If not already set to copyright placeholder
-                                _raw_llm_output_core_this_api_cycle = f"// LLM_BLOCKED_NO_PARTS (Gemini, Reason: {reason}) FOR_SOURCE: {source_sentence_text}"
-                            break # Handled block/empty parts
-
-                    elif llm_provider == "claude":
-                        messages_for_claude = [{"role": "user", "content": current_prompt_user_message_part}]
-                        api_response = await llm_client_or_model_obj.messages.create(
-                            model=model_name_to_use_in_api_call,
-                            max_tokens=claude_max_tokens,
-                            system=claude_system_prompt_str,
-                            messages=messages_for_claude,
-                            temperature=generation_config_params.get("temperature", 0.7)
-                        )
-                        if api_response.content and api_response.content[0].text:
-                            _raw_llm_output_core_this_api_cycle = api_response.content[0].text.strip()
-                            api_call_successful_flag = True
-                            if api_response.stop_reason == "max_tokens":
-                                print(f"  LLM API Warning (Claude, Item {item_idx_for_log}): Output truncated due to max_tokens ({claude_max_tokens}).", file=sys.stderr)
-                            # Claude's copyright/safety is usually via 400 error, handled in exceptions
-                        else: # Should not happen if no exception
-                            _raw_llm_output_core_this_api_cycle = f"// LLM_EMPTY_CONTENT_UNEXPECTED (Claude) FOR_SOURCE: {source_sentence_text}"
-                        break # API call success or handled empty
-
-                except (anthropic.APIConnectionError, anthropic.InternalServerError) if llm_provider == "claude" else Exception as e_generic_retry: # Temp server issues
-                    # This generic Exception for Gemini is broad, might need refinement if specific Gemini transient errors arise
-                    print(f"  LLM API Error ({llm_provider.capitalize()}, API Attempt {api_attempt + 1}/{max_api_retries}) for item {item_idx_for_log}: Temporary issue - {type(e_generic_retry).__name__} {e_generic_retry}", file=sys.stderr)
-                    if api_attempt + 1 == max_api_retries:
-                         _raw_llm_output_core_this_api_cycle = f"// LLM_API_TEMP_ERROR_MAX_RETRIES ({llm_provider.capitalize()}, {type(e_generic_retry).__name__}) FOR_SOURCE: {source_sentence_text}"
-                         break
-                    await asyncio.sleep(retry_delay_seconds * (2**api_attempt)) # Exponential backoff for server issues
-
-                except anthropic.RateLimitError if llm_provider == "claude" else Exception as e_rate_limit: # Gemini uses general Exception for 429
-                    # For Gemini, check error string for 429
-                    is_gemini_rate_limit = llm_provider == "gemini" and ("429" in str(e_rate_limit).lower() or "resource_exhausted" in str(e_rate_limit).lower())
-                    
-                    if llm_provider == "claude" or is_gemini_rate_limit:
-                        print(f"  LLM API Error ({llm_provider.capitalize()}, API Attempt {api_attempt + 1}/{max_api_retries}) for item {item_idx_for_log}: Rate limit / Quota - {e_rate_limit}", file=sys.stderr)
-                        if api_attempt + 1 == max_api_retries:
-                            print(f"    FATAL QUOTA LIKELY ({llm_provider.capitalize()}, persisted API error): Item {item_idx_for_log}. Error: {e_rate_limit}", file=sys.stderr)
-                            return FATAL_QUOTA_ERROR_SENTINEL
-                        effective_delay = retry_delay_seconds * (2**api_attempt)
-                        print(f"    Item {item_idx_for_log} ({llm_provider.capitalize()}): Retrying API call (rate limit/quota) in {effective_delay} seconds...", file=sys.stderr)
-                        await asyncio.sleep(effective_delay)
-                    else: # General Gemini exception not identified as rate limit
-                         raise e_rate_limit # Re-raise if not a Gemini rate limit
-
-                except anthropic.APIStatusError as e_claude_status: # Claude specific for 4xx/5xx not covered above
-                    print(f"  LLM API Error (Claude, API Attempt {api_attempt + 1}/{max_api_retries}) for item {item_idx_for_log}: Status {e_claude_status.status_code} - {e_claude_status.message}", file=sys.stderr)
-                    if e_claude_status.status_code == 400 and e_claude_status.body and \
-                       e_claude_status.body.get('error', {}).get('type') == 'invalid_request_error':
-                        error_message_lower = e_claude_status.message.lower()
-                        if "safety" in error_message_lower or "policy" in error_message_lower or "harmful" in error_message_lower:
-                            print(f"    Potential copyright/safety block from Claude for item {item_idx_for_log}.", file=sys.stderr)
-                            _raw_llm_output_core_this_api_cycle = f"{COPYRIGHT_BLOCK_PLACEHOLDER_PREFIX}{source_sentence_text}"
-                            api_call_successful_flag = True; break 
-                    
-                    # For other 4xx/5xx errors, treat as potentially retriable or fatal depending on attempts
-                    if api_attempt + 1 == max_api_retries:
-                        _raw_llm_output_core_this_api_cycle = f"// LLM_API_STATUS_ERROR_MAX_RETRIES (Claude, {e_claude_status.status_code}) FOR_SOURCE: {source_sentence_text}"
-                        break
-                    await asyncio.sleep(retry_delay_seconds)
-
-                except anthropic.AuthenticationError as e_auth:
-                    print(f"  FATAL LLM API Authentication Error ({llm_provider.capitalize()}): {e_auth}. Check API Key.", file=sys.stderr)
-                    return FATAL_QUOTA_ERROR_SENTINEL # Treat as fatal for this run
-
-                except Exception as e: # General catch-all, primarily for Gemini's varied exceptions
-                    error_str = str(e).lower()
-                    print(f"  LLM API Error ({llm_provider.capitalize()}, API Attempt {api_attempt + 1}/{max_api_retries}) for item {item_idx_for_log}: {type(e).__name__} - {e}", file=sys.stderr)
-                    # Check for Gemini quota errors again if not caught by specific rate limit check
-                    if llm_provider == "gemini" and any(kw in error_str for kw in ["quota", "limit", "billing", "exceeded", "model_unavailable", "resource_exhausted"]):
-                         if api_attempt + 1 == max_api_retries:
-                            print(f"    FATAL QUOTA LIKELY (Gemini, persisted API error): Item {item_idx_for_log}. Error: {e}", file=sys.stderr)
-                            return FATAL_QUOTA_ERROR_SENTINEL
-                         effective_delay = retry_delay_seconds * (2**api_attempt)
-                         print(f"    Item {item_idx_for_log} (Gemini): Retrying API call (potential quota/availability) in {effective_delay} seconds...", file=sys.stderr)
-                         await asyncio.sleep(effective_delay)
-                         continue # continue to next API attempt
-
-                    if api_attempt + 1 == max_api_retries:
-                        _raw_llm_output_core_this_api_cycle = f"// LLM_API_ERROR_MAX_RETRIES ({llm_provider.capitalize()}, {type(e).__name__}) FOR_SOURCE: {source_sentence_text}"
-                        break
-                    await asyncio.sleep(retry_delay_seconds)
+                prompt_text_for_api = COPYRIGHT_RETRY_PROMPT_PREFIX + current_original_prompt_text_for_sentence
+            elif validation_attempt > 0: # This is a validation retry
+                prompt_text_for_api = "".join((CORRECTIVE_PROMPT_PREFIX_HEAD, last_validation_error_details_str,
+                                               CORRECTIVE_PROMPT_PREFIX_TAIL, current_original_prompt_text_for_sentence))
+            else:
+                prompt_text_for_api = current_original_prompt_text_for_sentence
 
+            _raw_llm_output_core_this_api_cycle, api_call_successful_flag = await _generate_llm_output_async(
+                prompt_text_for_api, source_sentence_text, llm_client_or_model_obj, llm_provider,
+                model_name_to_use_in_api_call, max_api_retries, retry_delay_seconds, item_idx_for_log,
+                claude_system_prompt_str, claude_max_tokens, credit_semaphore
+            )
             raw_llm_output_core_from_api = _raw_llm_output_core_this_api_cycle
 
             if raw_llm_output_core_from_api == FATAL_QUOTA_ERROR_SENTINEL: return FATAL_QUOTA_ERROR_SENTINEL
@@ -604,8 +1162,7 @@ async def process_sentence_with_llm_async(
                  raw_llm_output_core_from_api = f"// LLM_NO_OUTPUT_AFTER_API_RETRIES ({llm_provider.capitalize()}) FOR_SOURCE: {source_sentence_text}"
 
             if END_SENTENCE_MARKER_TEXT in raw_llm_output_core_from_api:
-                lines_cleaned = [line for line in raw_llm_output_core_from_api.splitlines() if line.strip() != END_SENTENCE_MARKER_TEXT]
-                raw_llm_output_core_from_api = "\n".join(lines_cleaned).strip()
+                raw_llm_output_core_from_api = END_SENTENCE_ONLY_LINE_REGEX.sub("", raw_llm_output_core_from_api).strip()
 
             raw_output_for_validation = raw_llm_output_core_from_api
             debug_lines_from_llm = []
@@ -624,9 +1181,9 @@ async def process_sentence_with_llm_async(
                     elif seen_advs_or_first_content_marker: potential_block_lines.append(line_content)
                     elif not stripped_line.startswith("//"): potential_block_lines.append(line_content) # Capture non-comment lines before first marker too
                 
-                if debug_lines_from_llm:
-                    print(f"  Item {item_idx_for_log} ({llm_provider.capitalize()}/{model_name_to_use_in_api_call}) - LLM Debug Info (Validation Attempt {validation_attempt+1}):")
-                    for d_line in debug_lines_from_llm: print(f"    {d_line.strip()}")
+                if debug_lines_from_llm and logger.isEnabledFor(logging.DEBUG): # Skips building the message at the default level
+                    logger.debug(f"Item {item_idx_for_log} ({llm_provider.capitalize()}/{model_name_to_use_in_api_call}) - LLM Debug Info (Validation Attempt {validation_attempt+1}):\n" +
+                                 "\n".join(d_line.strip() for d_line in debug_lines_from_llm))
                 
                 if not potential_block_lines and debug_lines_from_llm: # Only debug lines, likely an error
                     raw_output_for_validation = "\n".join(debug_lines_from_llm) # Validate the debug message itself if it's all we have
@@ -637,15 +1194,17 @@ async def process_sentence_with_llm_async(
             validation_errors = validate_llm_block(raw_output_for_validation)
             last_validation_error_details_str = "; ".join(validation_errors)
 
-            if not validation_errors: return raw_output_for_validation
+            if not validation_errors:
+                if response_cache is not None: response_cache.put(cache_key, raw_output_for_validation)
+                return raw_output_for_validation
 
-            print(f"  Item {item_idx_for_log} ({llm_provider.capitalize()}/{model_name_to_use_in_api_call}): Validation FAILED (Attempt {validation_attempt+1}/{max_validation_retries}) for '{source_sentence_text[:30]}...': {last_validation_error_details_str}", file=sys.stderr)
+            logger.warning(f"Item {item_idx_for_log} ({llm_provider.capitalize()}/{model_name_to_use_in_api_call}): Validation FAILED (Attempt {validation_attempt+1}/{max_validation_retries}) for '{source_sentence_text[:30]}...': {last_validation_error_details_str}")
             
             # This flag gets updated for the *next* validation attempt's prompt construction
             is_copyright_retry_attempt = raw_llm_output_core_from_api.startswith(COPYRIGHT_BLOCK_PLACEHOLDER_PREFIX)
             
             if validation_attempt + 1 < max_validation_retries:
-                await asyncio.sleep(retry_delay_seconds)
+                await asyncio.sleep(retry_delay_with_jitter(retry_delay_seconds))
                 continue
             else:
                 if is_copyright_retry_attempt :
@@ -662,7 +1221,10 @@ async def process_book_file_async(
     model_name_to_use: str, # Specific model name string for this provider
     args: argparse.Namespace,
     num_context_sentences: int, item_limit: Optional[int],
-    semaphore: asyncio.Semaphore
+    semaphore: asyncio.Semaphore,
+    response_cache: Optional[ResponseCache] = None,
+    credit_semaphore: Optional[CreditSemaphore] = None,
+    batch_api_client: Any = None # google.genai Client with --use_batch_api
 ) -> Tuple[bool, bool, bool]: # (was_skipped, operation_successful, daily_limit_hit_flag)
 
     book_name_stem = staged_file_path.stem
@@ -674,18 +1236,10 @@ async def process_book_file_async(
 
     if not args.force and output_llm_file_path.exists():
         try:
-            with open(output_llm_file_path, 'r', encoding='utf-8') as f_exist:
-                full_existing_content = f_exist.read().strip()
-            
-            # Ensure END_SENTENCE_MARKER_TEXT ends with a newline for regex if not already
-            effective_end_marker = END_SENTENCE_MARKER_TEXT
-            if not effective_end_marker.endswith('\n'):
-                 effective_end_marker += '\n'
+            # File I/O here and below runs in a worker thread so other books' requests keep going meanwhile
+            last_block_full_content = await asyncio.to_thread(read_last_output_block, output_llm_file_path)
 
-            raw_blocks_with_delimiters = re.findall(f"(.*?{re.escape(effective_end_marker)})", full_existing_content, re.DOTALL)
-
-            if raw_blocks_with_delimiters:
-                last_block_full_content = raw_blocks_with_delimiters[-1]
+            if last_block_full_content is not None:
                 lines_in_last_block = last_block_full_content.strip().splitlines()
                 
                 penultimate_line_of_last_block = ""
@@ -698,15 +1252,17 @@ async def process_book_file_async(
 
 
                 if penultimate_line_of_last_block == COMPLETION_MARKER_TEXT:
-                    print(f"Skipping '{staged_file_path.name}': Found completion marker.")
+                    logger.info(f"Skipping '{staged_file_path.name}': Found completion marker.")
                     return True, True, False
                 elif penultimate_line_of_last_block.startswith(RESUME_MARKER_PREFIX) and penultimate_line_of_last_block.endswith("--- //"):
                     try:
                         index_str = penultimate_line_of_last_block[len(RESUME_MARKER_PREFIX):].split(" ")[0]
                         start_item_idx = int(index_str)
                         is_resuming = True
-                        existing_content_blocks = raw_blocks_with_delimiters[:-1] # Exclude the block with the resume marker
-                        print(f"Resuming '{staged_file_path.name}' from source item index {start_item_idx}.")
+                        # Only now is the whole file needed: everything before the block with the resume marker
+                        existing_output_text, _ = split_off_last_output_block(await asyncio.to_thread(output_llm_file_path.read_text, encoding='utf-8'))
+                        existing_content_blocks = [existing_output_text] if existing_output_text else []
+                        logger.info(f"Resuming '{staged_file_path.name}' from source item index {start_item_idx}.")
                     except ValueError: start_item_idx = 0; is_resuming = False; existing_content_blocks = []
                 elif penultimate_line_of_last_block.startswith(OUTPUT_LIMITED_MARKER_PREFIX) and penultimate_line_of_last_block.endswith("--- //"):
                     try:
@@ -714,135 +1270,177 @@ async def process_book_file_async(
                         limit_in_marker = int(limit_in_marker_str)
                         can_process_more = args.limit_items is None or args.limit_items > limit_in_marker
                         if can_process_more:
-                            start_item_idx = len(raw_blocks_with_delimiters) -1 # Start after the limited block
-                            is_resuming = True; existing_content_blocks = raw_blocks_with_delimiters[:-1] # Exclude limited marker block
-                            print(f"Resuming '{staged_file_path.name}' after previous limit of {limit_in_marker} items.")
+                            existing_output_text, _ = split_off_last_output_block(await asyncio.to_thread(output_llm_file_path.read_text, encoding='utf-8')) # Exclude limited marker block
+                            start_item_idx = existing_output_text.count(END_SENTENCE_LINE) # Start after the limited block
+                            is_resuming = True; existing_content_blocks = [existing_output_text] if existing_output_text else []
+                            logger.info(f"Resuming '{staged_file_path.name}' after previous limit of {limit_in_marker} items.")
                         else: 
-                            print(f"Skipping '{staged_file_path.name}': Limit of {limit_in_marker} (from file) meets or exceeds current --limit-items={args.limit_items}.")
+                            logger.info(f"Skipping '{staged_file_path.name}': Limit of {limit_in_marker} (from file) meets or exceeds current --limit-items={args.limit_items}.")
                             return True, True, False
                     except ValueError: start_item_idx = 0; is_resuming = False; existing_content_blocks = []
                 elif args.limit_items is None: # Ambiguous end, reprocess if no explicit limit
-                    print(f"Warning: Could not determine resume point for '{output_llm_file_path.name}'. Reprocessing from start (or use --force).", file=sys.stderr)
+                    logger.warning(f"Could not determine resume point for '{output_llm_file_path.name}'. Reprocessing from start (or use --force).")
                     start_item_idx = 0; is_resuming = False; existing_content_blocks = []
 
         except Exception as e_read:
-            print(f"Warning: Error reading existing output file '{output_llm_file_path.name}': {e_read}. Reprocessing from start.", file=sys.stderr)
+            logger.warning(f"Error reading existing output file '{output_llm_file_path.name}': {e_read}. Reprocessing from start.")
             start_item_idx = 0; is_resuming = False; existing_content_blocks = []
     
-    print(f"Processing '{staged_file_path.name}' (LLM: {llm_provider.capitalize()}/{model_name_to_use}, effective start source item index: {start_item_idx})...")
+    logger.info(f"Processing '{staged_file_path.name}' (LLM: {llm_provider.capitalize()}/{model_name_to_use}, effective start source item index: {start_item_idx})...")
     try:
-        with open(staged_file_path, 'r', encoding='utf-8') as f_in: raw_lines_from_staged_file = f_in.readlines()
+        item_kinds, item_texts = await asyncio.to_thread(load_staged_items, staged_file_path)
     except Exception as e: 
-        print(f"FATAL: Could not read input staged file {staged_file_path}: {e}", file=sys.stderr)
+        logger.error(f"FATAL: Could not read input staged file {staged_file_path}: {e}")
         return False, False, False # was_skipped, operation_successful, daily_limit_hit
-
-    all_items: List[Dict[str, Any]] = []
-    for orig_idx, line_raw in enumerate(raw_lines_from_staged_file):
-        line = line_raw.strip()
-        if CHAPTER_MARKER_REGEX.match(line): all_items.append({"type": "marker", "text": CHAPTER_MARKER_REGEX.match(line).group(1).strip(), "original_idx_in_file": orig_idx})
-        elif SENTENCE_LINE_REGEX.match(line): all_items.append({"type": "sentence", "text": SENTENCE_LINE_REGEX.match(line).group(1).strip(), "original_idx_in_file": orig_idx})
+    num_items = len(item_texts)
     
-    if not all_items:
+    if not num_items:
         try:
-            llm_output_dir.mkdir(parents=True, exist_ok=True)
-            with open(output_llm_file_path, 'w', encoding='utf-8') as f_out: f_out.write(f"// NO_PROCESSABLE_ITEMS_IN_SOURCE_FILE\n{END_SENTENCE_MARKER_TEXT}\n")
-            print(f"Wrote placeholder: {output_llm_file_path.name} (no processable items).")
-        except Exception as e_ph: print(f"Error writing placeholder for empty source {output_llm_file_path.name}: {e_ph}", file=sys.stderr)
+            await asyncio.to_thread(write_output_file, output_llm_file_path, f"// NO_PROCESSABLE_ITEMS_IN_SOURCE_FILE\n{END_SENTENCE_MARKER_TEXT}\n")
+            logger.info(f"Wrote placeholder: {output_llm_file_path.name} (no processable items).")
+        except Exception as e_ph: logger.error(f"Error writing placeholder for empty source {output_llm_file_path.name}: {e_ph}")
         return False, True, False # Not skipped, op "successful" (wrote placeholder), no limit hit
 
-    items_to_process_this_run_slice: List[Dict[str, Any]] = []
-    target_total_items_in_output_file = len(all_items)
-    if args.limit_items is not None: target_total_items_in_output_file = min(args.limit_items, len(all_items))
+    target_total_items_in_output_file = num_items
+    if args.limit_items is not None: target_total_items_in_output_file = min(args.limit_items, num_items)
     
     num_existing_items_count = "".join(existing_content_blocks).count(END_SENTENCE_MARKER_TEXT)
 
     if num_existing_items_count >= target_total_items_in_output_file:
         if is_resuming: # Ensure file is correctly terminated if resuming led to this state
             try:
-                with open(output_llm_file_path, 'w', encoding='utf-8') as f_out:
-                    f_out.write("".join(existing_content_blocks)) # Write back the existing blocks
-                    final_marker_to_add = ""
-                    if num_existing_items_count >= len(all_items):
-                        final_marker_to_add = f"{COMPLETION_MARKER_TEXT}\n{END_SENTENCE_MARKER_TEXT}\n"
-                    elif args.limit_items is not None and num_existing_items_count >= args.limit_items:
-                        final_marker_to_add = f"{OUTPUT_LIMITED_MARKER_PREFIX}{args.limit_items}_ITEMS --- //\n{END_SENTENCE_MARKER_TEXT}\n"
-                    if final_marker_to_add: f_out.write(final_marker_to_add)
-                print(f"Finalized '{output_llm_file_path.name}' as existing items meet target.")
-            except Exception as e_fin: print(f"Error finalizing {output_llm_file_path.name}: {e_fin}", file=sys.stderr)
+                final_marker_to_add = ""
+                if num_existing_items_count >= num_items:
+                    final_marker_to_add = f"{COMPLETION_MARKER_TEXT}\n{END_SENTENCE_MARKER_TEXT}\n"
+                elif args.limit_items is not None and num_existing_items_count >= args.limit_items:
+                    final_marker_to_add = f"{OUTPUT_LIMITED_MARKER_PREFIX}{args.limit_items}_ITEMS --- //\n{END_SENTENCE_MARKER_TEXT}\n"
+                # Write back the existing blocks
+                await asyncio.to_thread(write_output_file, output_llm_file_path, "".join(existing_content_blocks) + final_marker_to_add)
+                logger.info(f"Finalized '{output_llm_file_path.name}' as existing items meet target.")
+            except Exception as e_fin: logger.error(f"Error finalizing {output_llm_file_path.name}: {e_fin}")
         return False, True, False # Not skipped, considered successful, no limit
 
     num_new_items_to_process_this_run = target_total_items_in_output_file - num_existing_items_count
-    end_idx_for_slice_in_all_items = min(len(all_items), start_item_idx + num_new_items_to_process_this_run)
+    end_item_idx = min(num_items, start_item_idx + num_new_items_to_process_this_run)
+    item_indices_to_process_this_run = range(start_item_idx, end_item_idx) # Empty if start_item_idx >= end_item_idx
     
-    if start_item_idx < end_idx_for_slice_in_all_items:
-        items_to_process_this_run_slice = all_items[start_item_idx:end_idx_for_slice_in_all_items]
-    
-    if not items_to_process_this_run_slice:
+    if not item_indices_to_process_this_run:
         if is_resuming: # Similar finalization if no new items are needed after resume logic
              try:
-                with open(output_llm_file_path, 'w', encoding='utf-8') as f_out:
-                    f_out.write("".join(existing_content_blocks))
-                    final_marker_to_add = ""
-                    if num_existing_items_count >= len(all_items):
-                        final_marker_to_add = f"{COMPLETION_MARKER_TEXT}\n{END_SENTENCE_MARKER_TEXT}\n"
-                    elif args.limit_items is not None and num_existing_items_count >= args.limit_items:
-                        final_marker_to_add = f"{OUTPUT_LIMITED_MARKER_PREFIX}{args.limit_items}_ITEMS --- //\n{END_SENTENCE_MARKER_TEXT}\n"
-                    if final_marker_to_add: f_out.write(final_marker_to_add)
-                print(f"Finalized '{output_llm_file_path.name}' as no new items needed.")
-             except Exception as e_fin: print(f"Error finalizing {output_llm_file_path.name}: {e_fin}", file=sys.stderr)
+                final_marker_to_add = ""
+                if num_existing_items_count >= num_items:
+                    final_marker_to_add = f"{COMPLETION_MARKER_TEXT}\n{END_SENTENCE_MARKER_TEXT}\n"
+                elif args.limit_items is not None and num_existing_items_count >= args.limit_items:
+                    final_marker_to_add = f"{OUTPUT_LIMITED_MARKER_PREFIX}{args.limit_items}_ITEMS --- //\n{END_SENTENCE_MARKER_TEXT}\n"
+                await asyncio.to_thread(write_output_file, output_llm_file_path, "".join(existing_content_blocks) + final_marker_to_add)
+                logger.info(f"Finalized '{output_llm_file_path.name}' as no new items needed.")
+             except Exception as e_fin: logger.error(f"Error finalizing {output_llm_file_path.name}: {e_fin}")
         return False, True, False
 
     newly_processed_blocks_this_run: List[str] = []
     daily_limit_hit_for_this_book = False
-    first_failed_item_original_idx = -1 # Store original index in all_items
+    first_failed_item_original_idx = -1 # Store index among the book's source items
     llm_calls_made_this_run = 0
     
-    for run_slice_idx, item_data in enumerate(items_to_process_this_run_slice):
-        original_item_idx_in_all_items = start_item_idx + run_slice_idx # This is the 0-based index in all_items
-
-        if daily_limit_hit_for_this_book and first_failed_item_original_idx != -1:
-            print(f"  Skipping further processing for source item {original_item_idx_in_all_items+1} in '{book_name_stem}' due to earlier fatal quota error.")
-            break
-
-        item_output_block_content = None
-        
-        if item_data["type"] == "marker":
-            item_output_block_content = f"CHAPTER_MARKER_DIRECT:: {item_data['text']}"
-        
-        elif item_data["type"] == "sentence":
-            source_sentence_text = item_data["text"]
+    # Each batch is a chapter marker or up to --batch_size consecutive sentences (0-based indices among the book's source items).
+    # A batch's LLM call is started as a task only when it enters a window of LIVE_BATCH_TASKS_PER_REQUEST * --concurrent_requests
+    # batches, so a long book never has every sentence's task (and prompt) waiting on the semaphore at once;
+    # results are then taken in source order below, each as soon as it and everything before it is done.
+    # With --use_batch_api the sentences instead wait in batch_api_sentences for one Batch API job, sent before the loop below.
+    def build_batch_sentences(batch_item_indices: List[int]) -> List[Tuple[str, str, str, int]]:
+        batch_sentences: List[Tuple[str, str, str, int]] = []
+        for source_item_idx in batch_item_indices:
+            source_sentence_text = item_texts[source_item_idx]
             preceding_context_str = "[NO PRECEDING CONTEXT]"
-            pre_sent_texts = [all_items[i]["text"] for i in range(max(0, original_item_idx_in_all_items - num_context_sentences), original_item_idx_in_all_items) if all_items[i]["type"] == "sentence"]
-            if pre_sent_texts: preceding_context_str = "\n".join(pre_sent_texts)
+            pre_sent_texts = [item_texts[i] for i in range(max(0, source_item_idx - num_context_sentences), source_item_idx) if item_kinds[i] == ITEM_KIND_SENTENCE]
+            if pre_sent_texts: preceding_context_str = clip_context("\n".join(pre_sent_texts), args.context_char_budget, keep_end=True) or preceding_context_str
             
             succeeding_context_str = "[NO SUCCEEDING CONTEXT]"
-            suc_sent_texts = [all_items[i]["text"] for i in range(original_item_idx_in_all_items + 1, min(len(all_items), original_item_idx_in_all_items + 1 + num_context_sentences)) if all_items[i]["type"] == "sentence"]
-            if suc_sent_texts: succeeding_context_str = "\n".join(suc_sent_texts)
-
-            print(f"  Processing item {original_item_idx_in_all_items+1} ('{source_sentence_text[:30]}...') with {llm_provider.capitalize()}/{model_name_to_use}.")
-            
-            item_result_str = await process_sentence_with_llm_async(
-                source_sentence_text, preceding_context_str, succeeding_context_str,
-                llm_client_or_model_obj, llm_provider, model_name_to_use,
+            suc_sent_texts = [item_texts[i] for i in range(source_item_idx + 1, min(num_items, source_item_idx + 1 + num_context_sentences)) if item_kinds[i] == ITEM_KIND_SENTENCE]
+            if suc_sent_texts: succeeding_context_str = clip_context("\n".join(suc_sent_texts), args.context_char_budget, keep_end=False) or succeeding_context_str
+
+            if logger.isEnabledFor(logging.DEBUG): # Once per sentence, so the message isn't built at the default level
+                logger.debug(f"Processing item {source_item_idx+1} ('{source_sentence_text[:30]}...') with {llm_provider.capitalize()}/{model_name_to_use}.")
+            batch_sentences.append((source_sentence_text, preceding_context_str, succeeding_context_str,
+                                    source_item_idx + 1)) # 1-based for logging
+        return batch_sentences
+
+    def start_batch_job(batch_item_indices: List[int]) -> Tuple[List[int], Any]:
+        """(item indices, asyncio.Task for their results, or the chapter marker's results)"""
+        if item_kinds[batch_item_indices[0]] == ITEM_KIND_MARKER:
+            return batch_item_indices, [f"CHAPTER_MARKER_DIRECT:: {item_texts[batch_item_indices[0]]}"]
+        return batch_item_indices, asyncio.create_task(process_sentence_batch_with_llm_async(
+            build_batch_sentences(batch_item_indices),
+            llm_client_or_model_obj, llm_provider, model_name_to_use,
+            args.max_api_retries, args.max_validation_retries, DEFAULT_RETRY_DELAY_SECONDS,
+            semaphore, LLM_PROMPT_TEMPLATE, CLAUDE_SYSTEM_PROMPT, args.claude_max_tokens,
+            response_cache=response_cache, credit_semaphore=credit_semaphore
+        ), name=f"{book_name_stem}-items-{batch_item_indices[0] + 1}")
+
+    if batch_api_client is None:
+        batch_jobs: Iterator[Tuple[List[int], Any]] = map(start_batch_job, iter_item_batches(item_kinds, item_indices_to_process_this_run, max(1, args.batch_size)))
+    else: # The Batch API takes one request per sentence, and all of the book's go in one job
+        batch_api_jobs: List[Tuple[List[int], Any]] = []
+        batch_api_sentences: List[Tuple[str, str, str, int]] = []
+        for batch_item_indices in iter_item_batches(item_kinds, item_indices_to_process_this_run, 1):
+            if item_kinds[batch_item_indices[0]] == ITEM_KIND_MARKER:
+                batch_api_jobs.append(start_batch_job(batch_item_indices))
+            else:
+                batch_api_sentences.extend(build_batch_sentences(batch_item_indices))
+                batch_api_jobs.append((batch_item_indices, None)) # Filled in from the Batch API job below
+        if batch_api_sentences:
+            batch_api_results = iter(await process_sentences_with_batch_api_async(
+                batch_api_sentences, batch_api_client, f"{book_name_stem}-items-{item_indices_to_process_this_run[0] + 1}",
+                llm_client_or_model_obj, model_name_to_use,
                 args.max_api_retries, args.max_validation_retries, DEFAULT_RETRY_DELAY_SECONDS,
-                semaphore, original_item_idx_in_all_items + 1, # 1-based for logging
-                LLM_PROMPT_TEMPLATE, CLAUDE_SYSTEM_PROMPT, args.claude_max_tokens,
-                is_copyright_retry_attempt=False # Initial call, not a copyright-specific retry from orchestrator
-            )
-            llm_calls_made_this_run += 1
-
-            if item_result_str == FATAL_QUOTA_ERROR_SENTINEL:
-                daily_limit_hit_for_this_book = True
-                if first_failed_item_original_idx == -1:
-                    first_failed_item_original_idx = original_item_idx_in_all_items
-            # Store result whether it's good output or a placeholder error/copyright
-            item_output_block_content = item_result_str
-        
-        if item_output_block_content is not None:
-            newly_processed_blocks_this_run.append(item_output_block_content.strip() + f"\n{END_SENTENCE_MARKER_TEXT}\n")
-        
-        if daily_limit_hit_for_this_book and first_failed_item_original_idx != -1:
-            break
+                semaphore, LLM_PROMPT_TEMPLATE,
+                response_cache=response_cache, credit_semaphore=credit_semaphore
+            ))
+            batch_api_jobs = [(batch_item_indices, [next(batch_api_results)] if batch_job is None else batch_job)
+                              for batch_item_indices, batch_job in batch_api_jobs]
+            llm_calls_made_this_run += len(batch_api_sentences)
+        batch_jobs = iter(batch_api_jobs)
+
+    checkpoint_end_offset: Optional[int] = None # End of the blocks in the output file's latest checkpoint, once written
+    checkpointed_block_count = 0 # Of newly_processed_blocks_this_run
+    live_batch_jobs = deque(itertools.islice(batch_jobs, max(1, LIVE_BATCH_TASKS_PER_REQUEST * args.concurrent_requests)))
+    try:
+        while live_batch_jobs:
+            batch_item_indices, batch_job = live_batch_jobs.popleft()
+            live_batch_jobs.extend(itertools.islice(batch_jobs, 1)) # Keeps the window full while this batch is awaited
+            if isinstance(batch_job, asyncio.Task):
+                batch_results = await batch_job
+                llm_calls_made_this_run += len(batch_item_indices)
+            else:
+                batch_results = batch_job
+
+            # Store each result whether it's good output or a placeholder error/copyright
+            for source_item_idx, item_output_block_content in zip(batch_item_indices, batch_results):
+                if item_output_block_content == FATAL_QUOTA_ERROR_SENTINEL:
+                    # Not written as a block: the resume marker makes the next run start at this item
+                    daily_limit_hit_for_this_book = True
+                    if first_failed_item_original_idx == -1:
+                        first_failed_item_original_idx = source_item_idx
+                    break
+                newly_processed_blocks_this_run.append(item_output_block_content.strip() + f"\n{END_SENTENCE_MARKER_TEXT}\n")
+            
+            if daily_limit_hit_for_this_book and first_failed_item_original_idx != -1:
+                break
+
+            # Blocks are taken in source order, so everything up to this batch can be saved with a resume marker after it
+            if len(newly_processed_blocks_this_run) - checkpointed_block_count >= PARTIAL_FLUSH_EVERY_ITEMS and live_batch_jobs:
+                checkpoint_end_offset = await asyncio.to_thread(
+                    write_output_checkpoint, output_llm_file_path, checkpoint_end_offset,
+                    ("".join(existing_content_blocks) if checkpoint_end_offset is None else "") + "".join(newly_processed_blocks_this_run[checkpointed_block_count:]),
+                    f"{RESUME_MARKER_PREFIX}{batch_item_indices[-1] + 1} --- //\n{END_SENTENCE_MARKER_TEXT}\n"
+                )
+                checkpointed_block_count = len(newly_processed_blocks_this_run)
+                logger.debug("Checkpointed '%s' through source item index %s.", output_llm_file_path.name, batch_item_indices[-1])
+    finally:
+        # After a fatal quota error (or an exception) the calls still running can only waste quota
+        unfinished_batch_tasks = [batch_job for _, batch_job in live_batch_jobs if isinstance(batch_job, asyncio.Task) and not batch_job.done()]
+        for batch_task in unfinished_batch_tasks: batch_task.cancel()
+        if unfinished_batch_tasks: await asyncio.gather(*unfinished_batch_tasks, return_exceptions=True)
 
     final_output_content = "".join(existing_content_blocks) + "".join(newly_processed_blocks_this_run)
     total_end_sentence_markers_in_final = final_output_content.count(END_SENTENCE_MARKER_TEXT)
@@ -850,37 +1448,35 @@ async def process_book_file_async(
     if daily_limit_hit_for_this_book:
         # first_failed_item_original_idx is the index of the item that *caused* the quota error.
         # We want to resume from this item next time.
-        if first_failed_item_original_idx != -1 and first_failed_item_original_idx < len(all_items):
+        if first_failed_item_original_idx != -1 and first_failed_item_original_idx < num_items:
             final_output_content += f"{RESUME_MARKER_PREFIX}{first_failed_item_original_idx} --- //\n{END_SENTENCE_MARKER_TEXT}\n"
-            print(f"  Partial file for '{book_name_stem}' will be saved. Resume from source item index {first_failed_item_original_idx} next time.")
-    elif total_end_sentence_markers_in_final >= len(all_items):
+            logger.info(f"Partial file for '{book_name_stem}' will be saved. Resume from source item index {first_failed_item_original_idx} next time.")
+    elif total_end_sentence_markers_in_final >= num_items:
         final_output_content += f"{COMPLETION_MARKER_TEXT}\n{END_SENTENCE_MARKER_TEXT}\n"
-        print(f"  Marking '{book_name_stem}' as fully processed.")
+        logger.info(f"Marking '{book_name_stem}' as fully processed.")
     elif args.limit_items is not None and total_end_sentence_markers_in_final >= args.limit_items:
         final_output_content += f"{OUTPUT_LIMITED_MARKER_PREFIX}{args.limit_items}_ITEMS --- //\n{END_SENTENCE_MARKER_TEXT}\n"
-        print(f"  Marking '{book_name_stem}' as limited to {args.limit_items} items.")
-    elif total_end_sentence_markers_in_final > 0 : # Partial but not due to error or limit, means it ran out of items_to_process_this_run_slice
+        logger.info(f"Marking '{book_name_stem}' as limited to {args.limit_items} items.")
+    elif total_end_sentence_markers_in_final > 0 : # Partial but not due to error or limit, means it ran out of item_indices_to_process_this_run
         # This case should ideally be covered by num_new_items_to_process_this_run logic
         # But as a fallback, if it's partial and not completed/limited/error, save resume marker
-        # The resume index should be the count of *successfully processed blocks* in `all_items`
+        # The resume index should be the count of *successfully processed blocks* among the source items
         # which is `total_end_sentence_markers_in_final`.
-        if total_end_sentence_markers_in_final < len(all_items):
+        if total_end_sentence_markers_in_final < num_items:
             final_output_content += f"{RESUME_MARKER_PREFIX}{total_end_sentence_markers_in_final} --- //\n{END_SENTENCE_MARKER_TEXT}\n"
-            print(f"  Partial file for '{book_name_stem}' saved. Resume from source item index {total_end_sentence_markers_in_final} next time.")
+            logger.info(f"Partial file for '{book_name_stem}' saved. Resume from source item index {total_end_sentence_markers_in_final} next time.")
 
 
     try:
-        llm_output_dir.mkdir(parents=True, exist_ok=True)
-        with open(output_llm_file_path, 'w', encoding='utf-8') as f_out:
-            f_out.write(final_output_content)
+        await asyncio.to_thread(write_output_file, output_llm_file_path, final_output_content)
         
         num_newly_processed_items = len(newly_processed_blocks_this_run)
         log_msg_blocks = f"Wrote {num_newly_processed_items} new blocks " \
                          f"({llm_calls_made_this_run} LLM calls attempted) to '{output_llm_file_path.name}'"
-        print(log_msg_blocks)
+        logger.info(log_msg_blocks)
         return False, True, daily_limit_hit_for_this_book
     except Exception as e:
-        print(f"Error writing output file '{output_llm_file_path.name}': {e}", file=sys.stderr)
+        logger.error(f"Error writing output file '{output_llm_file_path.name}': {e}")
         return False, False, daily_limit_hit_for_this_book
 
 async def main_async():
@@ -914,11 +1510,30 @@ async def main_async():
     parser.add_argument("--max_api_retries", type=int, default=DEFAULT_MAX_API_RETRIES, help="Max retries for basic API calls.")
     parser.add_argument("--max_validation_retries", type=int, default=DEFAULT_MAX_VALIDATION_RETRIES, help="Max retries with corrective prompts if LLM output fails validation. Set to 1 for no corrective retries.")
     parser.add_argument("--context_sents", type=int, default=2, help="Number of preceding/succeeding sentences for context.")
+    parser.add_argument("--context_char_budget", type=int, default=DEFAULT_CONTEXT_CHAR_BUDGET, help=f"Max characters of preceding and of succeeding context per prompt, trimmed at a word boundary; 0 disables (default: {DEFAULT_CONTEXT_CHAR_BUDGET}).")
     parser.add_argument("--limit_items", type=int, default=None, help="Output only the first N items (markers or sentences) in total for each book. Default: process all.")
     parser.add_argument("--concurrent_requests", type=int, default=DEFAULT_CONCURRENT_REQUESTS, help="Max concurrent LLM API requests.")
+    parser.add_argument("--batch_size", type=int, default=DEFAULT_BATCH_SIZE, help=f"Consecutive sentences sent per API call; blocks that fail validation are retried singly (default: {DEFAULT_BATCH_SIZE}).")
+    parser.add_argument("--use_batch_api", action="store_true", help="Gemini only: send each book's sentences as one Batch API job (about half the cost, no per-request rate limit, done within 24h) instead of online calls; all books' jobs are submitted together and run in parallel; missing or invalid results are redone online. Needs `pip install google-genai`; --batch_size is ignored.")
+    parser.add_argument("--tokens_per_minute", type=int, default=DEFAULT_TOKENS_PER_MINUTE, help="Estimated prompt+output tokens admitted per minute across concurrent requests; 0 disables. Set to the provider's quota to avoid bursts of 429s.")
+    parser.add_argument("--no_cache", action="store_true", help=f"Don't read or write the response cache ({RESPONSE_CACHE_DIR_NAME} in the content project).")
+    parser.add_argument("--log_level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="Logging level; DEBUG also logs every item sent to or served from cache, and the LLM's own // DEBUG notes.")
     
     args = parser.parse_args()
 
+    # Records go through a queue so concurrent requests never block on the console; one listener thread writes them
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        handlers=[logging.handlers.QueueHandler(log_queue)]) # Root stays at WARNING for the SDKs' loggers
+    logger.setLevel(args.log_level)
+    log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    log_listener.start()
+    try:
+        await process_all_books_async(args)
+    finally:
+        log_listener.stop()
+
+async def process_all_books_async(args):
     # Initialize LLM client/model object
     llm_client_or_model_obj = None
     actual_model_name_to_use = ""
@@ -932,8 +1547,8 @@ async def main_async():
             print("ERROR: Gemini API Key not found. Set GOOGLE_API_KEY or use --gemini_api_key.", file=sys.stderr)
             sys.exit(1)
         try:
-            genai.configure(api_key=api_key_to_use)
-            llm_client_or_model_obj = genai.GenerativeModel(args.gemini_model_name)
+            genai.configure(api_key=api_key_to_use, transport=GEMINI_TRANSPORT)
+            llm_client_or_model_obj = genai.GenerativeModel(args.gemini_model_name) # Created once, reused for every book
             actual_model_name_to_use = args.gemini_model_name
             print(f"Successfully configured Gemini model: {actual_model_name_to_use}")
             try: print(f"  Gemini SDK Version: {importlib.metadata.version('google-generativeai')}")
@@ -963,6 +1578,19 @@ async def main_async():
         print(f"ERROR: Unknown LLM provider '{args.llm_provider}'.", file=sys.stderr)
         sys.exit(1)
 
+    batch_api_client = None
+    if args.use_batch_api:
+        if args.llm_provider != "gemini" or not google_genai:
+            print("ERROR: --use_batch_api needs --llm_provider gemini and the 'google-genai' library (`pip install google-genai`).", file=sys.stderr)
+            sys.exit(1)
+        try:
+            batch_api_client = google_genai.Client(api_key=api_key_to_use)
+            try: print(f"  Batch API via google-genai SDK Version: {importlib.metadata.version('google-genai')}")
+            except: pass
+        except Exception as e:
+            print(f"ERROR configuring google-genai client for the Batch API: {e}", file=sys.stderr)
+            sys.exit(1)
+
     content_project_root_str = load_project_config(args.project_config)
     if not content_project_root_str: sys.exit(1)
     
@@ -985,19 +1613,20 @@ async def main_async():
     if args.force: print("PROCESSING MODE: --force enabled, will reprocess all files from scratch.")
     if args.limit_items is not None: print(f"PROCESSING MODE: Output limited to --limit_items={args.limit_items} total items per file.")
     print(f"Max concurrent LLM requests: {args.concurrent_requests}")
+    if args.use_batch_api: print("PROCESSING MODE: --use_batch_api, each book's sentences go out as one Gemini Batch API job, all books' at once (can take up to 24h).")
+    elif args.batch_size > 1: print(f"Sentences per LLM request: up to {args.batch_size}")
+    if args.tokens_per_minute: print(f"Token budget: {args.tokens_per_minute} estimated tokens per minute")
+    if args.no_cache: print("PROCESSING MODE: --no_cache, every sentence goes to the LLM.")
     print("---")
 
     total_successful_ops, total_skipped_ops, total_error_ops = 0, 0, 0
     semaphore = asyncio.Semaphore(args.concurrent_requests)
+    credit_semaphore = CreditSemaphore(args.tokens_per_minute) if args.tokens_per_minute > 0 else None
     overall_daily_limit_hit_flag = False
+    response_cache = None if args.no_cache else ResponseCache(content_project_root / RESPONSE_CACHE_DIR_NAME, args.llm_provider, actual_model_name_to_use)
 
-    for staged_file in staged_files_to_process:
-        if overall_daily_limit_hit_flag:
-            print(f"Daily rate limit was hit earlier. Skipping further processing of '{staged_file.name}' and subsequent files in this run.")
-            total_skipped_ops +=1
-            continue
-
-        was_skipped, op_successful, book_hit_daily_limit = await process_book_file_async(
+    def process_book(staged_file: Path):
+        return process_book_file_async(
             staged_file, llm_output_dir, 
             llm_client_or_model_obj, 
             args.llm_provider,
@@ -1005,18 +1634,42 @@ async def main_async():
             args,
             num_context_sentences=args.context_sents,
             item_limit=args.limit_items,
-            semaphore=semaphore
+            semaphore=semaphore,
+            response_cache=response_cache,
+            credit_semaphore=credit_semaphore,
+            batch_api_client=batch_api_client
         )
 
-        if was_skipped: total_skipped_ops += 1
-        elif op_successful: total_successful_ops += 1
-        else: total_error_ops += 1
-        
-        if book_hit_daily_limit:
-            overall_daily_limit_hit_flag = True
-            print(f"--- Daily rate limit hit while processing '{staged_file.name}'. Will stop processing new books after this. ---")
-        
-        print("---")
+    try:
+        # A Batch API job can take hours, so rather than wait out each book's in turn, every book's job is submitted
+        # and polled at once; the results are then tallied in book order as below
+        batch_api_book_results = None
+        if batch_api_client is not None:
+            batch_api_book_results = await asyncio.gather(*(process_book(staged_file) for staged_file in staged_files_to_process))
+
+        for book_number, staged_file in enumerate(staged_files_to_process):
+            if overall_daily_limit_hit_flag and batch_api_book_results is None:
+                print(f"Daily rate limit was hit earlier. Skipping further processing of '{staged_file.name}' and subsequent files in this run.")
+                total_skipped_ops +=1
+                continue
+
+            if batch_api_book_results is not None:
+                was_skipped, op_successful, book_hit_daily_limit = batch_api_book_results[book_number]
+            else:
+                was_skipped, op_successful, book_hit_daily_limit = await process_book(staged_file)
+            if response_cache is not None: response_cache.flush()
+
+            if was_skipped: total_skipped_ops += 1
+            elif op_successful: total_successful_ops += 1
+            else: total_error_ops += 1
+            
+            if book_hit_daily_limit:
+                overall_daily_limit_hit_flag = True
+                print(f"--- Daily rate limit hit while processing '{staged_file.name}'. Will stop processing new books after this. ---")
+            
+            print("---")
+    finally:
+        if response_cache is not None: response_cache.close()
 
     print("\nProcessing Complete.")
     print(f"Successfully processed/wrote: {total_successful_ops} book(s)/file operation(s).")
@@ -1032,7 +1685,7 @@ async def main_async():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main_async())
+        run_event_loop(main_async())
     except KeyboardInterrupt:
         print("\nProcessing interrupted by user. Partial progress for the current book might not be saved unless its write cycle completed.")
     except Exception as e:
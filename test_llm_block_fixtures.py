@@ -412,4 +412,21 @@ S1 :: E1->S1(F1)(Y)
 LOCKED_PHRASE:: S1 S5 
 """ # S5 not in SimS_Segments
 
+BAD_BLOCK_LOCKED_PHRASE_DUPLICATE = """
+AdvS:: a
+SimS:: s
+SimE:: e
+SimS_Segments::
+S1(segment one)
+PHRASE_ALIGN::
+S1 ~ span1 ~ span2
+SimSL::
+S1 :: l1
+AdvSL:: la
+DIGLOT_MAP::
+S1 :: E1->S1(F1)(Y)
+LOCKED_PHRASE:: S1
+LOCKED_PHRASE:: S1
+"""
+
 # --- Add more test cases as needed ---
\ No newline at end of file
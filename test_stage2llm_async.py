@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip("dotenv") # stage2llm_async needs python-dotenv at import
+from stage2llm_async import clip_context
+
+# --- Test Functions for clip_context ---
+
+@pytest.mark.parametrize("context, char_budget, keep_end, expected", [
+    ("aaaa bbbb cccc", 10, True, "bbbb cccc"),   # Cut falls exactly on a word boundary: nothing dropped
+    ("aaaa bbbb cccc", 10, False, "aaaa bbbb"),
+    ("aaaa bbbb cccc", 8, True, "cccc"),         # Cut splits a word: that word is dropped
+    ("aaaa bbbb cccc", 8, False, "aaaa"),
+    ("aaaa bbbb cccc", 9, True, "bbbb cccc"),    # Cut just after the space: the slice's leading space is trimmed
+    ("aaaa bbbb cccc", 5, False, "aaaa"),
+    ("aaaaaaaaaaaa b", 3, True, "b"),
+    ("a bbbbbbbbbbbb", 3, False, "a"),
+    ("aaaaaaaaaaaaaa", 5, True, ""),             # No whole word fits
+    ("aaaa      bbbb", 4, False, "aaaa"),
+    ("aaaa      bbbb", 8, True, "bbbb"),         # All-whitespace part of the slice
+    ("aaaa bbbb", 0, True, "aaaa bbbb"),         # Budget off
+])
+def test_clip_context(context, char_budget, keep_end, expected):
+    assert clip_context(context, char_budget, keep_end) == expected
+
+def test_clip_context_whitespace_only_slice():
+    assert clip_context("aaaa" + " " * 10, 6, keep_end=True) == ""
+    assert clip_context(" " * 10 + "aaaa", 6, keep_end=False) == ""
@@ -1,5 +1,6 @@
 import pytest
 from llm_output_validator import validate_llm_block # Import the function to test
+from llm_output_validator import parse_diglot_entry, RE_DIGLOT_ENTRY, validate_llm_batch_block, streamed_block_cannot_pass, streamed_block_error
 import test_llm_block_fixtures as fx # Import the test data fixtures
 
 # --- Helper Function for Assertions (Optional but can make tests cleaner) ---
@@ -138,12 +139,65 @@ def test_bad_block_diglot_extra_pipe():
     errors = validate_llm_block(fx.BAD_BLOCK_DIGLOT_EXTRA_PIPE)
     # Match the core part of the validator's more detailed message
     assert_validation_contains_error(errors, "found empty entry part (likely due to '||' or trailing/leading '|')", "BAD_BLOCK_DIGLOT_EXTRA_PIPE")
+
+
+@pytest.mark.parametrize("entry", [
+    "Simple->simple(simple)(Y)",
+    "jumped->saltar(saltó) (N)",
+    "->Spa1(Form1)(Y)",
+    "Eng1->Spa1()(Y)",
+    "a->b->c(d(e))(Y)",
+    "Eng1->Spa1(Form1)(X)",
+    "Eng1->Spa1(Form1)(1)",
+    "Eng1->Spa1_Form1_Y",
+    "Eng1 Spa1(Form1)(Y)",
+    "Eng1->Spa1(Form1)Y",
+])
+def test_parse_diglot_entry_matches_reference_regex(entry):
+    match = RE_DIGLOT_ENTRY.match(entry)
+    assert parse_diglot_entry(entry) == (match.groups() if match else None)
+
 # --- Test Functions for Bad Blocks - LOCKED_PHRASE ---
 
 def test_bad_block_locked_phrase_unknown_id():
     errors = validate_llm_block(fx.BAD_BLOCK_LOCKED_PHRASE_UNKNOWN_ID)
     assert_validation_contains_error(errors, "LOCKED_PHRASE:: Uses unknown segment ID: S5", "BAD_BLOCK_LOCKED_PHRASE_UNKNOWN_ID")
 
+def test_bad_block_locked_phrase_duplicate():
+    errors = validate_llm_block(fx.BAD_BLOCK_LOCKED_PHRASE_DUPLICATE)
+    assert_validation_contains_error(errors, "Duplicate optional section marker: LOCKED_PHRASE:: (first at line 14, new at 15)", "BAD_BLOCK_LOCKED_PHRASE_DUPLICATE")
+
+# --- Test Functions for Batched Output ---
+
+def test_batch_block_splits_and_validates_each_block():
+    batch_text = f"{fx.GOOD_BLOCK_MINIMAL_CORRECT}\nEND_SENTENCE\n{fx.BAD_BLOCK_MISSING_REQUIRED_ADVS}\nEND_SENTENCE\n"
+    blocks, errors_per_block = validate_llm_batch_block(batch_text, 2)
+    assert blocks[0] == fx.GOOD_BLOCK_MINIMAL_CORRECT.strip()
+    assert_validation_passes(errors_per_block[0], "BATCH_BLOCK_0")
+    assert_validation_contains_error(errors_per_block[1], "Missing required section marker: AdvS::", "BATCH_BLOCK_1")
+
+def test_batch_block_count_mismatch_fails_every_block():
+    blocks, errors_per_block = validate_llm_batch_block(fx.GOOD_BLOCK_MINIMAL_CORRECT, 2)
+    assert blocks == ["", ""]
+    for errors in errors_per_block:
+        assert_validation_contains_error(errors, "Batch output has 1 blocks; expected 2", "BATCH_COUNT_MISMATCH")
+
+# --- Test Functions for Streamed Output ---
+
+def test_streamed_good_block_never_aborts():
+    for block in (fx.GOOD_BLOCK_MINIMAL_CORRECT, fx.GOOD_BLOCK_MULTI_SEGMENT_WITH_LOCKED, fx.GOOD_BLOCK_EMPTY_SECTIONS_VALID):
+        for end in range(len(block) + 1):
+            assert not streamed_block_cannot_pass(block[:end]), f"Aborted a valid block after {end} characters"
+
+def test_streamed_bad_block_aborts_early():
+    for block in (fx.BAD_BLOCK_PREMATURE_END_SENTENCE, fx.BAD_BLOCK_DUPLICATE_SECTION_SIMS, fx.BAD_BLOCK_WRONG_ORDER_SIMS_BEFORE_ADVS):
+        assert validate_llm_block(block)
+        assert streamed_block_cannot_pass(block + "\n")
+
+def test_streamed_error_matches_validator_wording():
+    for block in (fx.BAD_BLOCK_PREMATURE_END_SENTENCE, fx.BAD_BLOCK_DUPLICATE_SECTION_SIMS):
+        assert streamed_block_error(block + "\n") in validate_llm_block(block)
+
 # --- To run this test script:
 # 1. Make sure pytest is installed: pip install pytest
 # 2. Save this file as test_validator_script.py